@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 import urlparse
@@ -5,11 +6,19 @@ import urlparse
 from django import forms
 from django.conf import settings
 
-import requests
 from requests.exceptions import HTTPError
 
+from ..base import deadline
+from ..base.cache import LRUCache
+from . import fxa, tokens
+
 log = logging.getLogger(__name__)
 
+# Results of verifying FxA access tokens, keyed by a hash of the token.
+token_cache = LRUCache('fxa.token_cache', settings.FXA_TOKEN_CACHE_MAXSIZE)
+# Cached in place of a token that FxA rejected.
+_rejected = object()
+
 
 class SignInForm(forms.Form):
     """
@@ -26,7 +35,8 @@ class SignInForm(forms.Form):
         necessary because several clients may be supported by
         the backend at the same time.
     """
-    access_token = forms.CharField(max_length=255, required=False)
+    # Signed (JWT) access tokens are much longer than opaque ones.
+    access_token = forms.CharField(max_length=4096, required=False)
     authorization_code = forms.CharField(max_length=255, required=False)
     client_id = forms.ChoiceField(required=False)
 
@@ -78,7 +88,8 @@ class SignInForm(forms.Form):
                  .format(self.repr_token(access_token),
                          self.repr_token(code)))
 
-        self.validate_access_token(access_token)
+        self.validate_access_token(access_token,
+                                   expires_in=data.get('expires_in'))
 
     def clean_access_token(self):
         access_token = self.cleaned_data['access_token']
@@ -92,9 +103,12 @@ class SignInForm(forms.Form):
         kw.setdefault('headers', {})
         kw['headers']['Content-Type'] = 'application/json'
         kw['headers']['Accept'] = 'application/json'
+        # Stay within the deadline of the current request, if any.
+        kw['timeout'] = deadline.timeout(settings.FXA_TIMEOUT,
+                                         call='FxA POST {}'.format(url))
 
         try:
-            res = requests.post(url, json.dumps(data), **kw)
+            res = fxa.session().post(url, json.dumps(data), **kw)
             res.raise_for_status()
         except HTTPError, exc:
             log.info(u'FxA client exception: '
@@ -102,19 +116,20 @@ class SignInForm(forms.Form):
                      u'url={url}; status={status}; data={data}'
                      .format(exc=exc, url=res.url, status=res.status_code,
                              data=data))
-            raise forms.ValidationError('invalid FxA response')
+            status = getattr(exc.response, 'status_code', None)
+            raise forms.ValidationError(
+                'invalid FxA response',
+                # FxA rejected the request itself, as opposed to failing.
+                code='rejected' if status and 400 <= status < 500 else None)
 
         return res.json()
 
     def repr_token(self, token):
         return '{}...'.format(token[0:8])
 
-    def validate_access_token(self, access_token):
-        url = urlparse.urljoin(settings.FXA_OAUTH_URL, 'v1/verify')
-        log.info(u'verifying access token at {url}; token={token}'
-                 .format(url=url, token=self.repr_token(access_token)))
-
-        fxa_token = self.fxa_post(url, {'token': access_token})
+    def validate_access_token(self, access_token, expires_in=None):
+        fxa_token = self.verify_access_token(access_token,
+                                             expires_in=expires_in)
 
         if u'payments' not in fxa_token['scope']:
             log.info(u'FxA access token cannot access the "payments" '
@@ -141,3 +156,71 @@ class SignInForm(forms.Form):
                  u'email={email}'.format(token=self.repr_token(access_token),
                                          user=self.fxa_user_id,
                                          email=self.fxa_email))
+
+    def verify_access_token(self, access_token, expires_in=None):
+        """
+        Returns FxA's scope, user and email for an access token.
+
+        Results are cached until the token expires, if FxA said when
+        (expires_in), or for settings.FXA_TOKEN_CACHE_TTL seconds,
+        whichever is sooner. Tokens that FxA rejected are remembered for
+        settings.FXA_TOKEN_CACHE_NEGATIVE_TTL seconds.
+
+        When settings.FXA_JWT_VERIFICATION is enabled, signed tokens are
+        verified locally with FxA's public keys. See tokens.verify().
+        """
+        key = hashlib.sha256(access_token.encode('utf8')).hexdigest()
+        fxa_token = token_cache.get(key)
+        if fxa_token is _rejected:
+            log.info(u'FxA recently rejected access token; token={token}'
+                     .format(token=self.repr_token(access_token)))
+            raise forms.ValidationError('invalid FxA response',
+                                        code='rejected')
+        if fxa_token is not None:
+            log.info(u'using cached verification of access token; '
+                     u'token={token}'
+                     .format(token=self.repr_token(access_token)))
+            return fxa_token
+
+        result = None
+        if settings.FXA_JWT_VERIFICATION:
+            try:
+                result = tokens.verify(access_token)
+            except tokens.InvalidToken, exc:
+                log.info(u'rejecting signed access token: {exc}; '
+                         u'token={token}'
+                         .format(exc=exc,
+                                 token=self.repr_token(access_token)))
+                token_cache.set(key, _rejected,
+                                settings.FXA_TOKEN_CACHE_NEGATIVE_TTL)
+                raise forms.ValidationError('invalid FxA access token',
+                                            code='rejected')
+        if result:
+            log.info(u'verified signed access token locally; token={token}'
+                     .format(token=self.repr_token(access_token)))
+            if expires_in is None or result['expires_in'] < expires_in:
+                expires_in = result['expires_in']
+        else:
+            url = urlparse.urljoin(settings.FXA_OAUTH_URL, 'v1/verify')
+            log.info(u'verifying access token at {url}; token={token}'
+                     .format(url=url, token=self.repr_token(access_token)))
+            try:
+                result = self.fxa_post(url, {'token': access_token})
+            except forms.ValidationError, exc:
+                if exc.code == 'rejected':
+                    token_cache.set(key, _rejected,
+                                    settings.FXA_TOKEN_CACHE_NEGATIVE_TTL)
+                raise
+
+        fxa_token = dict((attr, result.get(attr))
+                         for attr in ('scope', 'user', 'email'))
+        ttl = settings.FXA_TOKEN_CACHE_TTL
+        if expires_in is not None:
+            if expires_in < 1:
+                log.info(u'not caching access token that is about to '
+                         u'expire; token={token}'
+                         .format(token=self.repr_token(access_token)))
+                return fxa_token
+            ttl = min(ttl, int(expires_in))
+        token_cache.set(key, fxa_token, ttl)
+        return fxa_token
@@ -0,0 +1,75 @@
+import logging
+import time
+import urlparse
+
+from django.conf import settings
+
+from django_statsd.clients import statsd
+from requests.packages.urllib3.util.retry import Retry
+
+from ..base.concurrency import ProcessSingleton
+from ..base.http import PooledSession
+
+log = logging.getLogger(__name__)
+
+
+def _create_session():
+    session = FxASession(pool_maxsize=settings.FXA_POOL_MAXSIZE,
+                         connect_retries=settings.FXA_CONNECT_RETRIES)
+    log.info('created an FxA session with a pool of {size} connections'
+             .format(size=settings.FXA_POOL_MAXSIZE))
+    return session
+
+
+_session = ProcessSingleton(_create_session, close=lambda s: s.close())
+
+
+def session():
+    """
+    Returns the FxA OAuth session for this process.
+
+    The session is created on first use and shared by all threads so that
+    connections to the FxA OAuth server are kept alive between sign-ins.
+    """
+    return _session.get()
+
+
+def reset_session():
+    """
+    Discards the shared FxA session and closes its connections.
+    """
+    _session.reset()
+
+
+def endpoint_name(url):
+    """
+    Returns the FxA endpoint of a URL as a metrics name.
+
+    For example, https://oauth.accounts.firefox.com/v1/verify is v1.verify
+    """
+    return '.'.join(p for p in urlparse.urlparse(url).path.split('/') if p)
+
+
+class FxASession(PooledSession):
+    """
+    Pooled session for talking to the FxA OAuth server.
+
+    Connection errors are retried up to `connect_retries` times. Since the
+    request was never sent, this is safe for POSTs too. The time taken by
+    each endpoint is sent to statsd as fxa.{endpoint}, for example
+    fxa.v1.verify.
+    """
+
+    def __init__(self, pool_maxsize=10, connect_retries=0):
+        super(FxASession, self).__init__(
+            'fxa', pool_maxsize=pool_maxsize,
+            max_retries=Retry(total=connect_retries, connect=connect_retries,
+                              read=0, redirect=0))
+
+    def request(self, method, url, **kw):
+        start = time.time()
+        try:
+            return super(FxASession, self).request(method, url, **kw)
+        finally:
+            statsd.timing('fxa.{}'.format(endpoint_name(url)),
+                          (time.time() - start) * 1000)
@@ -6,13 +6,16 @@ import mock
 
 from payments_service.base.tests import TestCase
 
+from ..forms import token_cache
+from ..fxa import FxASession
+
 
 class AuthTest(TestCase):
 
     def setUp(self):
         super(AuthTest, self).setUp()
 
-        p = mock.patch('payments_service.auth.forms.requests.post')
+        p = mock.patch.object(FxASession, 'post')
         self.fxa_post = p.start()
         self.fxa_post_results = {}
 
@@ -22,6 +25,9 @@ class AuthTest(TestCase):
         self.fxa_post.side_effect = get_stub_result
         self.addCleanup(p.stop)
 
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+
         self.access_token = 'some-oauth-token'
         self.fxa_user_id = '54321abcde'
         self.fxa_email = 'some-user@somewhere.com'
@@ -42,11 +48,13 @@ class AuthTest(TestCase):
         }
         self.set_fxa_url_result('v1/verify', mock_response)
 
-    def set_fxa_token_response(self, scope=None):
+    def set_fxa_token_response(self, scope=None, expires_in=None):
         mock_response = mock.Mock()
         mock_response.json.return_value = {
             'access_token': self.access_token,
         }
+        if expires_in:
+            mock_response.json.return_value['expires_in'] = expires_in
         self.set_fxa_url_result('v1/token', mock_response)
 
     def set_fxa_post_side_effect(self, side_effect):
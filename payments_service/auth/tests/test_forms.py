@@ -1,9 +1,17 @@
-from nose.tools import eq_
+import time
+
+import mock
+from nose.tools import eq_, raises
 from requests.exceptions import HTTPError
 
+from payments_service.base import context, deadline
+from payments_service.base.deadline import DeadlineExceeded
 from payments_service.base.tests import FormTest
 
-from ..forms import SignInForm
+from .. import tokens
+from ..forms import SignInForm, token_cache
+from ..fxa import FxASession
+from .test_tokens import jwks, other_key, signed_token
 from .test_views import BaseSignInTest
 
 
@@ -56,6 +64,175 @@ class TestSignInForm(BaseSignInTest, FormTest):
 
         assert self.fxa_post.called
 
+    def test_fxa_timeout(self):
+        self.set_fxa_verify_response()
+        with self.settings(FXA_TIMEOUT=3):
+            assert self.submit().is_valid()
+        eq_(self.fxa_post.call_args[1]['timeout'], 3)
+
+    @raises(DeadlineExceeded)
+    def test_deadline_exceeded(self):
+        self.set_fxa_verify_response()
+        context.start()
+        self.addCleanup(context.end)
+        deadline.start(-1)
+        self.submit().is_valid()
+
+
+class TestTokenCache(BaseSignInTest, FormTest):
+
+    def submit(self):
+        return SignInForm({'access_token': self.access_token})
+
+    def rejected(self, status):
+        return HTTPError('rejected', response=mock.Mock(status_code=status))
+
+    def test_verify_once(self):
+        self.set_fxa_verify_response()
+        assert self.submit().is_valid()
+        form = self.submit()
+        assert form.is_valid(), form.errors.as_text()
+        eq_(form.fxa_user_id, self.fxa_user_id)
+        eq_(form.fxa_email, self.fxa_email)
+        eq_(self.fxa_post.call_count, 1)
+
+    def test_check_scope_of_cached_token(self):
+        self.set_fxa_verify_response(scope=['payments'])
+        self.submit().is_valid()
+        form = self.submit()
+        self.assert_form_error(form.errors, 'access_token',
+                               msg='.*missing the profile:email scope')
+        eq_(self.fxa_post.call_count, 1)
+
+    def test_key_by_hash(self):
+        self.set_fxa_verify_response()
+        self.submit().is_valid()
+        eq_(token_cache.get(self.access_token), None)
+
+    def test_other_tokens_are_verified(self):
+        self.set_fxa_verify_response()
+        self.submit().is_valid()
+        self.access_token = 'another-token'
+        self.submit().is_valid()
+        eq_(self.fxa_post.call_count, 2)
+
+    def test_ttl(self):
+        self.set_fxa_verify_response()
+        with mock.patch.object(token_cache, 'set') as set_cache:
+            with self.settings(FXA_TOKEN_CACHE_TTL=60):
+                self.submit().is_valid()
+        eq_(set_cache.call_args[0][2], 60)
+
+    def test_expire_with_token(self):
+        self.set_fxa_token_response(expires_in=30)
+        self.set_fxa_verify_response()
+        with mock.patch.object(token_cache, 'set') as set_cache:
+            with self.settings(FXA_TOKEN_CACHE_TTL=60):
+                SignInForm({'authorization_code': 'code',
+                            'client_id': self.client_id}).is_valid()
+        eq_(set_cache.call_args[0][2], 30)
+
+    def test_do_not_cache_when_fxa_says_it_expired(self):
+        self.set_fxa_token_response(expires_in=0.5)
+        self.set_fxa_verify_response()
+        with mock.patch.object(token_cache, 'set') as set_cache:
+            SignInForm({'authorization_code': 'code',
+                        'client_id': self.client_id}).is_valid()
+        assert not set_cache.called
+
+    def test_cache_rejection_briefly(self):
+        self.set_fxa_post_side_effect(self.rejected(401))
+        with mock.patch.object(token_cache, 'set') as set_cache:
+            with self.settings(FXA_TOKEN_CACHE_NEGATIVE_TTL=5):
+                self.submit().is_valid()
+        eq_(set_cache.call_args[0][2], 5)
+
+    def test_remember_rejection(self):
+        self.set_fxa_post_side_effect(self.rejected(401))
+        self.submit().is_valid()
+        form = self.submit()
+        self.assert_form_error(form.errors, 'access_token',
+                               msg='invalid FxA response')
+        eq_(self.fxa_post.call_count, 1)
+
+    def test_do_not_cache_fxa_errors(self):
+        self.set_fxa_post_side_effect(self.rejected(503))
+        self.submit().is_valid()
+        self.submit().is_valid()
+        eq_(self.fxa_post.call_count, 2)
+
+    def test_disabled(self):
+        self.set_fxa_verify_response()
+        with mock.patch.object(token_cache, 'maxsize', 0):
+            self.submit().is_valid()
+            self.submit().is_valid()
+        eq_(self.fxa_post.call_count, 2)
+
+
+class TestLocalVerification(BaseSignInTest, FormTest):
+
+    def setUp(self):
+        super(TestLocalVerification, self).setUp()
+        tokens.reset_key_set()
+        self.addCleanup(tokens.reset_key_set)
+        # Serve the stand-in issuer's public keys.
+        p = mock.patch.object(FxASession, 'get')
+        p.start().return_value.json.return_value = jwks()
+        self.addCleanup(p.stop)
+        self.set_fxa_verify_response()
+
+        self.settings_override = self.settings(FXA_JWT_VERIFICATION=True)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def submit(self, token):
+        return SignInForm({'access_token': token})
+
+    def test_verify_locally(self):
+        form = self.submit(signed_token(sub=self.fxa_user_id,
+                                        email=self.fxa_email))
+        assert form.is_valid(), form.errors.as_text()
+        eq_(form.fxa_user_id, self.fxa_user_id)
+        eq_(form.fxa_email, self.fxa_email)
+        assert not self.fxa_post.called
+
+    def test_check_scope(self):
+        form = self.submit(signed_token(scope='payments'))
+        self.assert_form_error(form.errors, 'access_token',
+                               msg='.*missing the profile:email scope')
+        assert not self.fxa_post.called
+
+    def test_reject_bad_signature(self):
+        form = self.submit(signed_token(key=other_key))
+        self.assert_form_error(form.errors, 'access_token',
+                               msg='invalid FxA access token')
+        assert not self.fxa_post.called
+
+    def test_opaque_token(self):
+        assert self.submit(self.access_token).is_valid()
+        assert self.fxa_post.called
+
+    def test_unknown_key(self):
+        assert self.submit(signed_token(kid='unknown')).is_valid()
+        assert self.fxa_post.called
+
+    def test_disabled(self):
+        with self.settings(FXA_JWT_VERIFICATION=False):
+            assert self.submit(signed_token()).is_valid()
+        assert self.fxa_post.called
+
+    def test_cache_until_expiry(self):
+        token = signed_token(exp=int(time.time()) + 30)
+        with mock.patch.object(token_cache, 'set') as set_cache:
+            self.submit(token).is_valid()
+        assert set_cache.call_args[0][2] <= 30, set_cache.call_args
+
+    def test_do_not_cache_token_about_to_expire(self):
+        token = signed_token(exp=time.time() + 0.5)
+        with mock.patch.object(token_cache, 'set') as set_cache:
+            assert self.submit(token).is_valid()
+        assert not set_cache.called
+
 
 class TestSignInFormWithCode(BaseSignInTest, FormTest):
 
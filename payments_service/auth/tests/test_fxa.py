@@ -0,0 +1,66 @@
+import unittest
+
+from django.test.utils import override_settings
+
+import mock
+from nose.tools import eq_
+from requests.adapters import HTTPAdapter
+
+from payments_service.base.tests.test_http import fake_response
+
+from .. import fxa
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        fxa.reset_session()
+        self.addCleanup(fxa.reset_session)
+
+    def test_share_one_session(self):
+        eq_(fxa.session(), fxa.session())
+
+    def test_reset(self):
+        session = fxa.session()
+        fxa.reset_session()
+        assert fxa.session() is not session
+
+    def test_configure_pool(self):
+        with override_settings(FXA_POOL_MAXSIZE=3, FXA_CONNECT_RETRIES=4):
+            session = fxa.session()
+        adapter = session.get_adapter('https://fxa/')
+        eq_(adapter._pool_maxsize, 3)
+        eq_(adapter.max_retries.connect, 4)
+        eq_(adapter.max_retries.read, 0)
+
+
+class TestFxASession(unittest.TestCase):
+
+    def setUp(self):
+        p = mock.patch.object(HTTPAdapter, 'send')
+        self.send = p.start()
+        self.addCleanup(p.stop)
+        self.send.side_effect = fake_response
+
+    @mock.patch('payments_service.auth.fxa.statsd')
+    def test_endpoint_latency(self, statsd):
+        fxa.FxASession().post('https://fxa/v1/verify', '{}')
+        eq_(statsd.timing.call_args[0][0], 'fxa.v1.verify')
+
+    @mock.patch('payments_service.auth.fxa.statsd')
+    def test_latency_of_errors(self, statsd):
+        self.send.side_effect = ValueError
+        try:
+            fxa.FxASession().post('https://fxa/v1/verify', '{}')
+        except ValueError:
+            pass
+        eq_(statsd.timing.call_args[0][0], 'fxa.v1.verify')
+
+
+class TestEndpointName(unittest.TestCase):
+
+    def test_name(self):
+        eq_(fxa.endpoint_name('https://fxa/v1/verify'), 'v1.verify')
+
+    def test_ignore_query(self):
+        eq_(fxa.endpoint_name('https://fxa/v1/token/?a=b'), 'v1.token')
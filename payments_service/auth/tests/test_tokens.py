@@ -0,0 +1,216 @@
+import base64
+import json
+import threading
+import time
+import unittest
+
+from django.test.utils import override_settings
+
+import mock
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from nose.tools import eq_, raises
+
+from .. import tokens
+
+# A local key pair that stands in for FxA's signing key.
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                       backend=default_backend())
+other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                     backend=default_backend())
+
+
+def b64encode(value):
+    return base64.urlsafe_b64encode(value).rstrip('=')
+
+
+def int_to_b64(value):
+    hex_value = '{:x}'.format(value)
+    return b64encode(('0' * (len(hex_value) % 2) + hex_value).decode('hex'))
+
+
+def jwks(key=private_key, kid='fxa-key'):
+    numbers = key.public_key().public_numbers()
+    return {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'kid': kid,
+                      'n': int_to_b64(numbers.n),
+                      'e': int_to_b64(numbers.e)}]}
+
+
+def signed_token(key=private_key, kid='fxa-key', **claims):
+    claims.setdefault('sub', 'fxa-user')
+    claims.setdefault('email', 'user@example.com')
+    claims.setdefault('scope', 'profile:email payments')
+    claims.setdefault('exp', int(time.time()) + 600)
+    signing_input = '{}.{}'.format(
+        b64encode(json.dumps({'alg': 'RS256', 'kid': kid})),
+        b64encode(json.dumps(claims)))
+    signer = key.signer(padding.PKCS1v15(), hashes.SHA256())
+    signer.update(signing_input)
+    return '{}.{}'.format(signing_input, b64encode(signer.finalize()))
+
+
+class KeySetTest(unittest.TestCase):
+
+    def setUp(self):
+        tokens.reset_key_set()
+        self.addCleanup(tokens.reset_key_set)
+
+        p = mock.patch('payments_service.auth.tokens.fxa.session')
+        self.session = p.start().return_value
+        self.addCleanup(p.stop)
+        self.session.get.return_value.json.return_value = jwks()
+
+        p = mock.patch('payments_service.auth.tokens.thread_pool')
+        self.thread_pool = p.start().return_value
+        self.addCleanup(p.stop)
+        # Run background refreshes right away.
+        self.thread_pool.apply_async.side_effect = lambda func: func()
+
+
+class TestVerify(KeySetTest):
+
+    def test_valid(self):
+        result = tokens.verify(signed_token())
+        eq_(result['user'], 'fxa-user')
+        eq_(result['email'], 'user@example.com')
+        eq_(result['scope'], ['profile:email', 'payments'])
+        assert 0 < result['expires_in'] <= 600, result
+
+    def test_about_to_expire(self):
+        result = tokens.verify(signed_token(exp=time.time() + 0.5))
+        assert 0 < result['expires_in'] < 1, result
+
+    def test_opaque(self):
+        eq_(tokens.verify('some-oauth-token'), None)
+        assert not self.session.get.called
+
+    def test_not_json(self):
+        eq_(tokens.verify('not.a.jwt'), None)
+
+    @raises(tokens.InvalidToken)
+    def test_bad_signature(self):
+        tokens.verify(signed_token(key=other_key))
+
+    @raises(tokens.InvalidToken)
+    def test_tampered(self):
+        header, claims, signature = signed_token().split('.')
+        claims = b64encode(json.dumps({'sub': 'someone-else',
+                                       'email': 'x@example.com',
+                                       'scope': 'payments',
+                                       'exp': time.time() + 600}))
+        tokens.verify('.'.join((header, claims, signature)))
+
+    @raises(tokens.InvalidToken)
+    def test_expired(self):
+        tokens.verify(signed_token(exp=int(time.time()) - 1))
+
+    @raises(tokens.InvalidToken)
+    def test_wrong_issuer(self):
+        with override_settings(FXA_JWT_ISSUER='https://fxa'):
+            tokens.verify(signed_token(iss='https://elsewhere'))
+
+    def test_issuer(self):
+        with override_settings(FXA_JWT_ISSUER='https://fxa'):
+            assert tokens.verify(signed_token(iss='https://fxa'))
+
+    def test_no_email(self):
+        eq_(tokens.verify(signed_token(email=None)), None)
+
+    def test_unknown_key(self):
+        eq_(tokens.verify(signed_token(kid='new-key')), None)
+
+    @raises(tokens.InvalidToken)
+    def test_header_not_an_object(self):
+        tokens.verify('MQ.MQ.MQ')
+
+    @raises(tokens.InvalidToken)
+    def test_claims_not_an_object(self):
+        header = b64encode(json.dumps({'alg': 'RS256', 'kid': 'fxa-key'}))
+        tokens.verify('{}.{}.MQ'.format(header, b64encode('[]')))
+
+    @raises(tokens.InvalidToken)
+    def test_exp_not_a_number(self):
+        tokens.verify(signed_token(exp='tomorrow'))
+
+    @raises(tokens.InvalidToken)
+    def test_exp_is_bool(self):
+        tokens.verify(signed_token(exp=True))
+
+
+class TestKeySet(KeySetTest):
+
+    def key_set(self, **kw):
+        return tokens.KeySet('https://fxa/v1/jwks', **kw)
+
+    def test_fetch_once(self):
+        key_set = self.key_set()
+        assert key_set.get('fxa-key')
+        assert key_set.get('fxa-key')
+        eq_(self.session.get.call_count, 1)
+        eq_(self.session.get.call_args[0][0], 'https://fxa/v1/jwks')
+
+    def test_refresh_stale_keys_in_background(self):
+        key_set = self.key_set(max_age=0)
+        key_set.get('fxa-key')
+        time.sleep(0.01)
+        assert key_set.get('fxa-key')
+        assert self.thread_pool.apply_async.called
+        eq_(self.session.get.call_count, 2)
+
+    def test_refresh_for_unknown_key(self):
+        key_set = self.key_set(min_refresh_interval=0)
+        key_set.get('fxa-key')
+        self.session.get.return_value.json.return_value = jwks(kid='new-key')
+        time.sleep(0.01)
+        eq_(key_set.get('new-key'), None)
+        assert key_set.get('new-key')
+
+    def test_do_not_refresh_for_unknown_key_too_often(self):
+        key_set = self.key_set(min_refresh_interval=60)
+        key_set.get('fxa-key')
+        key_set.get('new-key')
+        eq_(self.session.get.call_count, 1)
+
+    def test_fetch_error(self):
+        self.session.get.side_effect = ValueError
+        key_set = self.key_set(min_refresh_interval=60)
+        eq_(key_set.get('fxa-key'), None)
+        eq_(key_set.get('fxa-key'), None)
+        eq_(self.session.get.call_count, 1)
+
+    def test_fetch_once_for_concurrent_threads(self):
+        fetching = threading.Event()
+        finish = threading.Event()
+        response = self.session.get.return_value
+
+        def slow_get(*args, **kw):
+            fetching.set()
+            finish.wait()
+            return response
+
+        self.session.get.side_effect = slow_get
+        key_set = self.key_set()
+        keys = []
+        threads = [threading.Thread(
+            target=lambda: keys.append(key_set.get('fxa-key')))
+            for i in range(3)]
+        threads[0].start()
+        fetching.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while key_set._first_fetch.coalesced < 2:
+            time.sleep(0.001)
+        finish.set()
+        for thread in threads:
+            thread.join()
+        eq_(self.session.get.call_count, 1)
+        assert all(keys), keys
+
+    def test_ignore_other_keys(self):
+        keys = jwks()
+        keys['keys'].append({'kty': 'EC', 'kid': 'ec-key'})
+        self.session.get.return_value.json.return_value = keys
+        key_set = self.key_set()
+        assert key_set.get('fxa-key')
+        eq_(key_set.get('ec-key'), None)
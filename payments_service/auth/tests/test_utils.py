@@ -1,5 +1,9 @@
 from django.core.exceptions import ObjectDoesNotExist
 
+import mock
+from nose.tools import eq_
+from slumber.exceptions import HttpClientError
+
 from payments_service.base.tests import TestCase
 
 from .. utils import set_up_braintree_customer
@@ -35,3 +39,52 @@ class TestSetUpBraintreeCustomer(TestCase):
         self.solitude.braintree.customer.post.assert_called_with(
             {'uuid': buyer['uuid']}
         )
+
+    def test_remember_existing_customer(self):
+        buyer = self.set_solitude_buyer_getter()
+        set_up_braintree_customer(buyer)
+        set_up_braintree_customer(buyer)
+
+        bt_getter = self.solitude.braintree.mozilla.buyer.get_object_or_404
+        eq_(bt_getter.call_count, 1)
+
+    def test_remember_new_customer(self):
+        buyer = self.set_solitude_buyer_getter()
+        bt_getter = self.solitude.braintree.mozilla.buyer.get_object_or_404
+        bt_getter.side_effect = ObjectDoesNotExist
+
+        set_up_braintree_customer(buyer)
+        set_up_braintree_customer(buyer)
+
+        eq_(bt_getter.call_count, 1)
+        eq_(self.solitude.braintree.customer.post.call_count, 1)
+
+    def test_per_buyer(self):
+        buyer = self.set_solitude_buyer_getter()
+        set_up_braintree_customer(buyer)
+        set_up_braintree_customer({'uuid': 'other-uuid', 'resource_pk': 2})
+
+        bt_getter = self.solitude.braintree.mozilla.buyer.get_object_or_404
+        eq_(bt_getter.call_count, 2)
+
+    def test_do_not_remember_failures(self):
+        buyer = self.set_solitude_buyer_getter()
+        bt_getter = self.solitude.braintree.mozilla.buyer.get_object_or_404
+        bt_getter.side_effect = ObjectDoesNotExist
+        self.solitude.braintree.customer.post.side_effect = HttpClientError
+
+        for i in range(2):
+            with self.assertRaises(HttpClientError):
+                set_up_braintree_customer(buyer)
+
+        eq_(bt_getter.call_count, 2)
+
+    def test_configure_cache(self):
+        buyer = self.set_solitude_buyer_getter()
+        with mock.patch('payments_service.auth.utils.caches') as caches:
+            caches.__getitem__.return_value.get.return_value = None
+            with self.settings(BRAINTREE_CUSTOMER_CACHE='shared',
+                               BRAINTREE_CUSTOMER_CACHE_TTL=10):
+                set_up_braintree_customer(buyer)
+        caches.__getitem__.assert_called_with('shared')
+        eq_(caches.__getitem__.return_value.set.call_args[0][2], 10)
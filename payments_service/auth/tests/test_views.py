@@ -1,12 +1,15 @@
+import threading
+
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.test import RequestFactory
 
 import mock
-from nose.tools import eq_
+from nose.tools import eq_, raises
 from slumber.exceptions import HttpClientError
 
+from payments_service.base import writebehind
 from payments_service.base.tests import AuthenticatedTestCase
 from . import AuthTest
 from .. import SessionUserAuthentication
@@ -110,6 +113,7 @@ class TestSignInView(SignInTest):
 
         res, data = self.post()
         eq_(res.status_code, 200, res)
+        writebehind.drain()
 
         buyer_patcher.assert_called_with({
             'email': self.fxa_email,
@@ -122,9 +126,51 @@ class TestSignInView(SignInTest):
 
         res, data = self.post(headers={'HTTP_ACCEPT_LANGUAGE': ''})
         eq_(res.status_code, 200, res)
+        writebehind.drain()
+
+        buyer_patcher.assert_called_with({'email': self.fxa_email})
+
+    def test_patch_changed_data_only(self):
+        buyer = self.set_solitude_buyer_getter()
+        buyer.update(email='old@example.com', locale='en-US')
+        buyer_patcher = self.set_solitude_buyer_patcher()
+
+        self.post()
+        writebehind.drain()
 
         buyer_patcher.assert_called_with({'email': self.fxa_email})
 
+    def test_skip_unchanged_buyer(self):
+        buyer = self.set_solitude_buyer_getter()
+        buyer.update(email=self.fxa_email, locale='en-US')
+        buyer_patcher = self.set_solitude_buyer_patcher()
+
+        res, data = self.post()
+        eq_(res.status_code, 200, res)
+        writebehind.drain()
+
+        assert not buyer_patcher.called
+
+    def test_patch_behind_response(self):
+        self.set_solitude_buyer_getter()
+        self.set_solitude_buyer_patcher()
+        with mock.patch('payments_service.auth.views.writebehind') as queue:
+            res, data = self.post()
+        eq_(res.status_code, 200, res)
+        assert queue.put.called
+        assert not self.solitude.generic.buyer.return_value.patch.called
+
+    def test_do_not_patch_new_buyer(self):
+        self.solitude.generic.buyer.get_object.side_effect = ObjectDoesNotExist
+        self.solitude.generic.buyer.post.return_value = {
+            'uuid': 'buyer-uuid', 'resource_pk': 1}
+        buyer_patcher = self.set_solitude_buyer_patcher()
+
+        self.post()
+        writebehind.drain()
+
+        assert not buyer_patcher.called
+
     def test_create_solitude_buyer(self):
         self.solitude.generic.buyer.get_object.side_effect = ObjectDoesNotExist
         buyer = {
@@ -163,6 +209,69 @@ class TestSignInView(SignInTest):
         res, data = self.post()
         assert 'csrf_token' in data, 'Unexpected: {}'.format(data)
 
+    def test_set_up_customer_concurrently(self):
+        self.set_solitude_buyer_getter()
+        paymethods_started = threading.Event()
+        overlapped = []
+
+        def set_up_braintree_customer(buyer):
+            # Fetching payment methods has to start while this is running.
+            overlapped.append(paymethods_started.wait(5))
+
+        def get_paymethods(**kw):
+            paymethods_started.set()
+            return []
+
+        self.set_up_braintree_customer.side_effect = set_up_braintree_customer
+        self.solitude.braintree.mozilla.paymethod.get.side_effect = (
+            get_paymethods)
+        with self.settings(SIGN_IN_CONCURRENCY=3):
+            res, data = self.post()
+        eq_(res.status_code, 200, res)
+        eq_(overlapped, [True])
+
+    def test_one_call_at_a_time(self):
+        self.set_solitude_buyer_getter()
+        with self.settings(SIGN_IN_CONCURRENCY=1):
+            res, data = self.post()
+        eq_(res.status_code, 200, res)
+        assert self.solitude.braintree.mozilla.paymethod.get.called
+        assert self.set_up_braintree_customer.called
+
+    def test_bad_solitude_response_for_customer(self):
+        self.set_solitude_buyer_getter()
+        err = HttpClientError('Bad Request')
+        self.set_up_braintree_customer.side_effect = err
+
+        res, data = self.post()
+        self.assert_error_response(res)
+        eq_(self.client.session.get('buyer'), None)
+
+    def test_do_not_patch_after_customer_error(self):
+        self.set_solitude_buyer_getter()
+        self.set_up_braintree_customer.side_effect = (
+            HttpClientError('Bad Request'))
+        with mock.patch('payments_service.auth.views.writebehind') as queue:
+            res, data = self.post()
+        self.assert_error_response(res)
+        assert not queue.put.called
+
+    @raises(RuntimeError)
+    def test_customer_error_comes_first(self):
+        self.set_solitude_buyer_getter()
+        self.set_up_braintree_customer.side_effect = RuntimeError
+        self.solitude.braintree.mozilla.paymethod.get.side_effect = (
+            HttpClientError('Bad Request'))
+        with self.settings(SIGN_IN_CONCURRENCY=2):
+            self.post()
+
+    @raises(HttpClientError)
+    def test_bad_solitude_response_for_paymethods(self):
+        self.set_solitude_buyer_getter()
+        self.solitude.braintree.mozilla.paymethod.get.side_effect = (
+            HttpClientError('Bad Request'))
+        self.post()
+
 
 class TestSignOut(AuthenticatedTestCase):
 
@@ -0,0 +1,221 @@
+import base64
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+
+from ..base import deadline
+from ..base.cache import SingleFlight
+from ..base.concurrency import ProcessSingleton, thread_pool
+from . import fxa
+
+log = logging.getLogger(__name__)
+
+_key_set = ProcessSingleton(lambda: KeySet(
+    settings.FXA_JWKS_URL, max_age=settings.FXA_JWKS_MAX_AGE))
+
+
+class InvalidToken(Exception):
+    """
+    Raised for a signed token that must not be accepted.
+    """
+
+
+def b64decode(value):
+    """
+    Decodes unpadded URL-safe base64, as used by JWTs and JWKs.
+    """
+    value = str(value)
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def b64_to_int(value):
+    return int(b64decode(value).encode('hex'), 16)
+
+
+def is_jwt(token):
+    """
+    Returns True if token looks like a signed JWT rather than an opaque
+    token.
+    """
+    return token.count('.') == 2
+
+
+def key_set():
+    """
+    Returns the FxA public key set for this process.
+    """
+    return _key_set.get()
+
+
+def reset_key_set():
+    _key_set.reset()
+
+
+def verify(token):
+    """
+    Verifies a signed FxA access token locally.
+
+    Returns a dict of the token's scope (as a list), user, email and
+    expires_in (seconds) like the FxA verify endpoint. Returns None if
+    the token can't be verified locally, for example because it's opaque,
+    it doesn't have an email or its key is not known. The caller should
+    then ask FxA.
+
+    Raises InvalidToken if the token is signed but must be rejected.
+    """
+    if not is_jwt(token):
+        return None
+    encoded_header, encoded_claims, encoded_signature = token.split('.')
+    try:
+        header = json.loads(b64decode(encoded_header))
+        claims = json.loads(b64decode(encoded_claims))
+        signature = b64decode(encoded_signature)
+    except (TypeError, ValueError):
+        log.info('token looks like a JWT but could not be decoded')
+        return None
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise InvalidToken('header and claims must be JSON objects')
+
+    if header.get('alg') != 'RS256':
+        log.info('cannot verify a token signed with {}'
+                 .format(header.get('alg')))
+        return None
+    key = key_set().get(header.get('kid'))
+    if key is None:
+        log.info('no public key to verify a token signed by {}'
+                 .format(header.get('kid')))
+        return None
+
+    verifier = key.verifier(signature, padding.PKCS1v15(), hashes.SHA256())
+    verifier.update('{}.{}'.format(encoded_header, encoded_claims))
+    try:
+        verifier.verify()
+    except InvalidSignature:
+        raise InvalidToken('bad signature')
+
+    expires = claims.get('exp')
+    if (not isinstance(expires, (int, long, float)) or
+            isinstance(expires, bool)):
+        raise InvalidToken('exp is not a number')
+    expires_in = expires - time.time()
+    if expires_in <= 0:
+        raise InvalidToken('expired')
+    issuer = settings.FXA_JWT_ISSUER
+    if issuer and claims.get('iss') != issuer:
+        raise InvalidToken('issued by {}'.format(claims.get('iss')))
+
+    if not claims.get('email'):
+        log.info('signed token has no email claim')
+        return None
+    scope = claims.get('scope') or ''
+    if not isinstance(scope, list):
+        scope = scope.split()
+    return {
+        'scope': scope,
+        'user': claims.get('sub') or claims.get('user'),
+        'email': claims['email'],
+        'expires_in': expires_in,
+    }
+
+
+class KeySet(object):
+    """
+    The public keys that FxA signs tokens with, as published at a JWKS URL.
+
+    Keys are fetched on first use; threads that need them at the same
+    time wait for the same fetch. After `max_age` seconds they are
+    refreshed in the background while the old keys are still used. A
+    token signed by an unknown key also triggers a background refresh,
+    at most once every `min_refresh_interval` seconds.
+    """
+
+    def __init__(self, url, max_age=3600, min_refresh_interval=60):
+        self.url = url
+        self.max_age = max_age
+        self.min_refresh_interval = min_refresh_interval
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._fetched_at = None
+        self._failed_at = None
+        self._refreshing = False
+        self._first_fetch = SingleFlight('fxa.jwks')
+
+    def get(self, kid):
+        """
+        Returns the public key with ID kid or None.
+        """
+        now = time.time()
+        if self._fetched_at is None:
+            self._first_fetch.do(self.url, self._fetch_first,
+                                 timeout=deadline.remaining())
+        elif now - self._fetched_at > self.max_age:
+            self.refresh_in_background()
+
+        key = self._keys.get(kid)
+        if (key is None and self._fetched_at is not None and
+                now - self._fetched_at > self.min_refresh_interval):
+            # FxA may have published a new key.
+            self.refresh_in_background()
+        return key
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self._try_refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        thread_pool().apply_async(refresh)
+
+    def refresh(self):
+        """
+        Fetches the key set now.
+        """
+        log.info('fetching FxA public keys from {}'.format(self.url))
+        res = fxa.session().get(
+            self.url, timeout=deadline.timeout(settings.FXA_TIMEOUT,
+                                               call='FxA GET {}'
+                                                    .format(self.url)))
+        res.raise_for_status()
+        keys = {}
+        for jwk in res.json().get('keys', []):
+            if jwk.get('kty') != 'RSA' or jwk.get('alg', 'RS256') != 'RS256':
+                continue
+            numbers = RSAPublicNumbers(b64_to_int(jwk['e']),
+                                       b64_to_int(jwk['n']))
+            keys[jwk.get('kid')] = numbers.public_key(default_backend())
+        self._keys = keys
+        self._fetched_at = time.time()
+        log.info('got {} FxA public keys'.format(len(keys)))
+
+    def _fetch_first(self):
+        # Another thread may have fetched the keys, or failed to, while
+        # this one was waiting.
+        if self._fetched_at is not None:
+            return
+        if (self._failed_at is None or
+                time.time() - self._failed_at > self.min_refresh_interval):
+            self._try_refresh()
+
+    def _try_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            # Keep the keys we have; tokens are verified by FxA meanwhile.
+            log.exception('fetching FxA public keys from {}'.format(self.url))
+            self._failed_at = time.time()
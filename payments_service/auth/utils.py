@@ -1,5 +1,7 @@
 import logging
 
+from django.conf import settings
+from django.core.cache import caches
 from django.core.exceptions import ObjectDoesNotExist
 
 from .. import solitude
@@ -7,11 +9,34 @@ from .. import solitude
 log = logging.getLogger(__name__)
 
 
+def customer_cache_key(buyer_pk):
+    return 'braintree-customer:{}'.format(buyer_pk)
+
+
+def remember_braintree_customer(buyer_pk):
+    """
+    Remembers that a buyer has a braintree customer so that
+    set_up_braintree_customer() doesn't have to look it up again.
+    """
+    caches[settings.BRAINTREE_CUSTOMER_CACHE].set(
+        customer_cache_key(buyer_pk), True,
+        settings.BRAINTREE_CUSTOMER_CACHE_TTL)
+
+
 def set_up_braintree_customer(buyer):
     """
     Make sure this user has a braintree customer which is needed for
     pretty much all subsequent API interactions involving braintree.
+
+    Buyers known to have a customer are remembered in the
+    settings.BRAINTREE_CUSTOMER_CACHE cache.
     """
+    cache = caches[settings.BRAINTREE_CUSTOMER_CACHE]
+    if cache.get(customer_cache_key(buyer['resource_pk'])):
+        log.info('braintree customer tied to buyer {b} is known to exist'
+                 .format(b=buyer['resource_pk']))
+        return
+
     api = solitude.api()
     try:
         api.braintree.mozilla.buyer.get_object_or_404(
@@ -22,3 +47,4 @@ def set_up_braintree_customer(buyer):
         api.braintree.customer.post({'uuid': buyer['uuid']})
         log.info('created new braintree customer for {buyer}'
                  .format(buyer=buyer['resource_pk']))
+    remember_braintree_customer(buyer['resource_pk'])
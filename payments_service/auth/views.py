@@ -1,19 +1,48 @@
 import logging
+import sys
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.middleware import csrf
 
+from django_statsd.clients import statsd
 from rest_framework.response import Response
 from slumber.exceptions import HttpClientError
 
 from . import utils
 from .. import solitude
+from ..base import etags, writebehind
+from ..base.concurrency import bounded_map
 from ..base.views import APIView, error_400, UnprotectedAPIView
 from .forms import SignInForm
 
 log = logging.getLogger(__name__)
 
 
+def capture(call):
+    """
+    Returns a tuple of call() and None, or None and the exception info if
+    call() raised an exception.
+    """
+    try:
+        return call(), None
+    except Exception:
+        return None, sys.exc_info()
+
+
+def changed_buyer_data(buyer, email, locale):
+    """
+    Returns a dict of the email and locale values that differ from the
+    buyer's Solitude record. A missing locale is never a change.
+    """
+    data = {}
+    if buyer.get('email') != email:
+        data['email'] = email
+    if locale and buyer.get('locale') != locale:
+        data['locale'] = locale
+    return data
+
+
 class SignInView(UnprotectedAPIView):
 
     def post(self, request):
@@ -44,40 +73,63 @@ class SignInView(UnprotectedAPIView):
                     u'created solitude buyer {buyer} for FxA user {fxa_uuid}'
                     .format(buyer=buyer['uuid'], fxa_uuid=fxa_uuid))
                 created = True
-
-            utils.set_up_braintree_customer(buyer)
-
         except HttpClientError, exc:
-            log.warn(
-                u'error setting up solitude buyers; {exc.__class__}: {exc}; '
-                u'FxA user={fxa_uuid}'.format(exc=exc, fxa_uuid=fxa_uuid))
-            return error_400(exception=exc)
+            return self.buyer_error(exc, fxa_uuid)
+
+        def update_buyer(data):
+            api.generic.buyer(buyer['resource_pk']).patch(data)
+            # The buyer's data changed after the response was sent.
+            etags.bump_buyer_version(buyer['uuid'])
+
+        def get_pay_methods():
+            # As a convenience, put any saved payment methods in the
+            # response if the user has them.
+            return api.braintree.mozilla.paymethod.get(
+                active=True, braintree_buyer__buyer__uuid=buyer['uuid'])
+
+        # Once we have a buyer, these calls don't depend on each other so
+        # they are made at the same time. Their results are handled as if
+        # the calls had been made one after another: when setting up the
+        # customer fails, the payment methods are thrown away and nothing
+        # else happens.
+        calls = [lambda: utils.set_up_braintree_customer(buyer),
+                 get_pay_methods]
+        ((customer, customer_error),
+         (pay_methods, pay_methods_error)) = bounded_map(
+            capture, calls, settings.SIGN_IN_CONCURRENCY)
+        if customer_error:
+            if isinstance(customer_error[1], HttpClientError):
+                return self.buyer_error(customer_error[1], fxa_uuid)
+            raise customer_error[0], customer_error[1], customer_error[2]
+        if pay_methods_error:
+            raise (pay_methods_error[0], pay_methods_error[1],
+                   pay_methods_error[2])
 
         if not created:
-            log.info('updating email to {} for user {}'
-                     .format(email, locale, buyer['resource_pk']))
             # Pretty soon we can hopefully stop storing the email address.
             # This patch request exists mainly to ease local development but
             # could theoretically handle changing email addresses.
-            data = {'email': email}
             # Similarly we can update the locale until we can find a way to
             # access that from FxA.
-            if locale:
-                log.info('Updating locale to {} for user {}'
-                         .format(locale, buyer['resource_pk']))
-                data['locale'] = locale
-            api.generic.buyer(buyer['resource_pk']).patch(data)
+            data = changed_buyer_data(buyer, email, locale)
+            if data:
+                log.info('updating {} for user {}'
+                         .format(', '.join(sorted(data)),
+                                 buyer['resource_pk']))
+                # The response doesn't depend on this write.
+                writebehind.put(
+                    'buyer {} patch'.format(buyer['resource_pk']),
+                    lambda: update_buyer(data))
+            else:
+                log.info('buyer {} is up to date'
+                         .format(buyer['resource_pk']))
+                statsd.incr('auth.sign_in.buyer_unchanged')
 
         request.session['buyer'] = {
             'pk': buyer['resource_pk'],
             'uuid': buyer['uuid'],
         }
 
-        # As a convenience, put any saved payment methods in the response
-        # if the user has them.
-        pay_methods = api.braintree.mozilla.paymethod.get(
-            active=True, braintree_buyer__buyer__uuid=buyer['uuid'])
-
         # Generate a new token for added security.
         csrf.rotate_token(request)
 
@@ -89,6 +141,12 @@ class SignInView(UnprotectedAPIView):
             'csrf_token': csrf.get_token(request),
         }, status=201 if created else 200)
 
+    def buyer_error(self, exc, fxa_uuid):
+        log.warn(
+            u'error setting up solitude buyers; {exc.__class__}: {exc}; '
+            u'FxA user={fxa_uuid}'.format(exc=exc, fxa_uuid=fxa_uuid))
+        return error_400(exception=exc)
+
 
 class SignOutView(APIView):
 
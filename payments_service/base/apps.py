@@ -4,6 +4,8 @@ from django.apps import AppConfig
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
+from .etags import shared_cache
+
 log = logging.getLogger(__name__)
 
 
@@ -29,3 +31,10 @@ class BaseApp(AppConfig):
             raise ImproperlyConfigured(
                 'You cannot run in non-debug mode with '
                 'the default SECRET_KEY')
+
+        if (settings.ETAG_VERSION_STAMPS and
+                not shared_cache(settings.ETAG_VERSION_CACHE)):
+            raise ImproperlyConfigured(
+                'You cannot enable ETAG_VERSION_STAMPS with a cache that '
+                'only one process can see; set ETAG_VERSION_CACHE to a '
+                'shared cache such as memcached')
@@ -0,0 +1,186 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from django_statsd.clients import statsd
+
+log = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Values for the {name}.circuit.state gauge.
+STATE_GAUGES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a dependency whose circuit is open.
+
+    *retry_after* is the number of seconds until the dependency will
+    be tried again.
+    """
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super(CircuitOpen, self).__init__(
+            '{} is unavailable; retry in {} seconds'.format(name,
+                                                            retry_after))
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a dependency that keeps failing.
+
+    The circuit starts out closed and every call goes through. When at
+    least `min_calls` calls were made in the last `window` seconds and
+    `failure_rate` of them failed, the circuit opens. While it is open,
+    calls fail immediately with CircuitOpen.
+
+    After `cooldown` seconds the circuit is half open: a single probe
+    call goes through while others keep failing. If the probe succeeds,
+    the circuit closes again. Otherwise it opens for another cooldown.
+
+    Example:
+
+        breaker.call(send, is_failure=lambda res: res.status_code >= 500)
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window=30,
+                 cooldown=15):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = None
+        self._probing = False
+        # Each bucket is a list of [second, calls, failures].
+        self._buckets = deque()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def call(self, func, is_failure=None, ignore=()):
+        """
+        Returns func(), unless the circuit is open.
+
+        Any exception raised by func() counts as a failure, except for
+        the exception classes in ignore. A result for which
+        is_failure(result) returns True is a failure too.
+        """
+        probe = self._before_call()
+        try:
+            result = func()
+        except ignore:
+            # Neither a success nor a failure. Let another probe try.
+            if probe:
+                with self._lock:
+                    self._probing = False
+            raise
+        except Exception:
+            self._after_call(False, probe)
+            raise
+        self._after_call(not (is_failure and is_failure(result)), probe)
+        return result
+
+    def stats(self):
+        with self._lock:
+            calls, failures = self._counts(time.time())
+            return {
+                'state': self._current_state(),
+                'calls': calls,
+                'failures': failures,
+                'retry_after': self._retry_after(),
+            }
+
+    def _before_call(self):
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and not self._probing:
+                if self._state != HALF_OPEN:
+                    self._change_state(HALF_OPEN)
+                self._probing = True
+                return True
+            retry_after = self._retry_after()
+
+        statsd.incr('{}.circuit.rejected'.format(self.name))
+        raise CircuitOpen(self.name, retry_after)
+
+    def _after_call(self, ok, probe):
+        with self._lock:
+            if probe:
+                self._probing = False
+                if ok:
+                    self._buckets.clear()
+                    self._change_state(CLOSED)
+                else:
+                    self._open()
+                return
+
+            now = time.time()
+            self._record(now, ok)
+            if self._state != CLOSED:
+                # The circuit opened while this call was in flight.
+                return
+            calls, failures = self._counts(now)
+            if (calls >= self.min_calls and
+                    failures >= calls * self.failure_rate):
+                log.warning('{name}: {failures} of {calls} calls failed in '
+                            'the last {window} seconds'
+                            .format(name=self.name, failures=failures,
+                                    calls=calls, window=self.window))
+                self._open()
+
+    def _open(self):
+        self._opened_at = time.time()
+        self._change_state(OPEN)
+
+    def _current_state(self):
+        # This must be called while holding the lock.
+        if (self._state == OPEN and
+                time.time() - self._opened_at >= self.cooldown):
+            return HALF_OPEN
+        return self._state
+
+    def _change_state(self, state):
+        # This must be called while holding the lock.
+        if state == self._state:
+            return
+        log.warning('{name}: circuit changed from {old} to {new}'
+                    .format(name=self.name, old=self._state, new=state))
+        self._state = state
+        statsd.incr('{}.circuit.{}'.format(self.name, state))
+        statsd.gauge('{}.circuit.state'.format(self.name),
+                     STATE_GAUGES[state])
+
+    def _retry_after(self):
+        # This must be called while holding the lock.
+        if self._state == CLOSED:
+            return 0
+        remaining = self.cooldown - (time.time() - self._opened_at)
+        return max(1, int(math.ceil(remaining)))
+
+    def _record(self, now, ok):
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        self._buckets[-1][1] += 1
+        if not ok:
+            self._buckets[-1][2] += 1
+
+    def _counts(self, now):
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        return (sum(bucket[1] for bucket in self._buckets),
+                sum(bucket[2] for bucket in self._buckets))
@@ -0,0 +1,263 @@
+import itertools
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from django_statsd.clients import statsd
+
+from .deadline import DeadlineExceeded
+
+log = logging.getLogger(__name__)
+
+_missing = object()
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe, in-process cache.
+
+    Every entry expires after its own time to live. When the cache is full,
+    the least recently used entry is evicted.
+
+    Arguments:
+
+    *name*
+        Short name of the cache, used as the metrics prefix.
+
+    *maxsize*
+        Maximum number of entries. A cache with a maxsize of 0 never
+        stores anything.
+    """
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loading = SingleFlight(name)
+        # Changed by clear() so that loads started before it aren't kept.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Returns the unexpired value for key or default.
+        """
+        with self._lock:
+            value = self._lookup(key)
+        if value is _missing:
+            return default
+        return value
+
+    def set(self, key, value, ttl):
+        """
+        Stores value for key for ttl seconds.
+        """
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_or_load(self, key, load, ttl, keep=None, timeout=None):
+        """
+        Returns the value for key, calling load() to get it if it isn't
+        cached or has expired.
+
+        When several threads are missing the same key at the same time,
+        only one of them calls load() and the others wait for its value,
+        for at most timeout seconds (see SingleFlight.do()). The loaded
+        value is stored for ttl seconds unless keep(value) returns False
+        or the cache was cleared while it was loading.
+        """
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            generation = self._generation
+
+        def load_and_store():
+            # Another thread may have stored the value since we looked.
+            with self._lock:
+                value = self._peek(key)
+            if value is not _missing:
+                return value
+            value = load()
+            if keep is None or keep(value):
+                with self._lock:
+                    if self._generation == generation:
+                        self._store(key, value, ttl)
+                    else:
+                        log.debug('{}: not storing {}, which was loaded '
+                                  'before a clear()'.format(self.name, key))
+            return value
+
+        # Loads from before a clear() are not shared with later misses.
+        return self._loading.do((generation, key), load_and_store,
+                                timeout=timeout)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _lookup(self, key):
+        # This must be called while holding the lock.
+        value = self._peek(key)
+        if value is not _missing:
+            self.hits += 1
+            statsd.incr('{}.hit'.format(self.name))
+        else:
+            self.misses += 1
+            statsd.incr('{}.miss'.format(self.name))
+        return value
+
+    def _peek(self, key):
+        # This must be called while holding the lock.
+        entry = self._entries.pop(key, None)
+        if not entry or entry[0] <= time.time():
+            return _missing
+        # Re-insert the entry to mark it as the most recently used.
+        self._entries[key] = entry
+        return entry[1]
+
+    def _store(self, key, value, ttl):
+        # This must be called while holding the lock.
+        if not self.maxsize:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + ttl, value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            statsd.incr('{}.eviction'.format(self.name))
+
+
+class SingleFlight(object):
+    """
+    Collapses identical calls that are in flight at the same time.
+
+    The first thread to call do() with a key runs the function. Any other
+    thread that calls do() with the same key before it returns waits for
+    that result instead of running the function again. Nothing is kept
+    once the call finishes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._sequence = itertools.count(1)
+        self.coalesced = 0
+
+    def mark(self):
+        """
+        Returns a number that is lower than that of every call started
+        after this. See the since argument of do().
+        """
+        return next(self._sequence)
+
+    def do(self, key, func, timeout=None, since=None):
+        """
+        Returns func(), or the result of the identical call in flight.
+
+        A thread waits at most timeout seconds for the call in flight and
+        then raises DeadlineExceeded. If that call raised DeadlineExceeded
+        because the thread that made it ran out of time, the waiting
+        thread calls func() itself instead of sharing the failure.
+
+        With since, the call in flight is only shared if it started after
+        mark() returned since.
+        """
+        with self._lock:
+            started, pending = self._calls.get(key, (None, None))
+            is_leader = pending is None or (since is not None and
+                                            started <= since)
+            if is_leader:
+                pending = Pending()
+                self._calls[key] = (self.mark(), pending)
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            log.debug('{}: waiting for {} in flight'.format(self.name, key))
+            statsd.incr('{}.coalesced'.format(self.name))
+            try:
+                return pending.wait(timeout)
+            except DeadlineExceeded, exc:
+                if exc is not pending.error:
+                    raise
+            # The call ran out of another request's time, not ours.
+            log.info('{}: calling {} again after the call in flight ran out '
+                     'of time'.format(self.name, key))
+            statsd.incr('{}.deadline_retry'.format(self.name))
+            return func()
+
+        try:
+            value = func()
+        except Exception:
+            pending.fail(sys.exc_info())
+            raise
+        else:
+            pending.set(value)
+        finally:
+            with self._lock:
+                # A newer call may have replaced this one.
+                if self._calls.get(key, (None, None))[1] is pending:
+                    del self._calls[key]
+        return value
+
+
+class Pending(object):
+    """
+    A value that one thread produces and other threads wait for.
+    """
+
+    def __init__(self):
+        self._ready = threading.Event()
+        self._value = None
+        self._exc_info = None
+
+    @property
+    def error(self):
+        """
+        The exception raised instead of producing the value, if any.
+        """
+        return self._exc_info[1] if self._exc_info else None
+
+    def set(self, value):
+        self._value = value
+        self._ready.set()
+
+    def fail(self, exc_info):
+        self._exc_info = exc_info
+        self._ready.set()
+
+    def wait(self, timeout=None):
+        """
+        Returns the value, or raises the exception raised instead.
+
+        Raises DeadlineExceeded if neither is ready within timeout seconds.
+        """
+        if not self._ready.wait(timeout):
+            raise DeadlineExceeded('gave up waiting for a call in flight: '
+                                   'request deadline exceeded')
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
@@ -0,0 +1,162 @@
+import logging
+import os
+import sys
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+from . import context
+
+log = logging.getLogger(__name__)
+
+
+class ProcessSingleton(object):
+    """
+    A value that all threads of a process share, made by factory() on
+    first use.
+
+    A process forked from the one that made the value makes its own, since
+    the threads, connections and locks of the value are not its to use.
+    reset() calls close(value), if given, when this process made it.
+    """
+
+    def __init__(self, factory, close=None):
+        self.factory = factory
+        self.close = close
+        # The process that made the value, and the value.
+        self._made = (None, None)
+        # One lock per process: a lock that another thread held when this
+        # process was forked stays held here.
+        self._locks = {}
+
+    def _lock(self):
+        pid = os.getpid()
+        lock = self._locks.get(pid)
+        if lock is None:
+            lock = self._locks.setdefault(pid, threading.Lock())
+        return lock
+
+    def get(self):
+        value = self.peek()
+        if value is None:
+            with self._lock():
+                value = self.peek()
+                if value is None:
+                    value = self.factory()
+                    self._made = (os.getpid(), value)
+        return value
+
+    def peek(self):
+        """
+        Returns the value if this process made it, without making one.
+        """
+        pid, value = self._made
+        if pid != os.getpid():
+            return None
+        return value
+
+    def reset(self, value=None):
+        """
+        Forgets the value so that the next get() makes a new one. If value
+        is given, it is only forgotten if get() still returns it.
+        """
+        with self._lock():
+            made = self.peek()
+            if value is not None and made is not value:
+                return
+            self._made = (None, None)
+        if made is not None and self.close:
+            self.close(made)
+
+
+def _start_thread_pool():
+    log.info('starting a pool of {} threads'
+             .format(settings.THREAD_POOL_SIZE))
+    return ThreadPool(processes=settings.THREAD_POOL_SIZE)
+
+
+_pool = ProcessSingleton(_start_thread_pool)
+
+
+def thread_pool():
+    """
+    Returns the thread pool shared by all requests in this process.
+
+    The pool is created on first use and has settings.THREAD_POOL_SIZE
+    threads.
+    """
+    return _pool.get()
+
+
+def bounded_map(func, items, limit):
+    """
+    Returns a list of func(item) for each item, like map().
+
+    Up to `limit` items are processed at the same time on the shared
+    thread pool. The results are in the same order as the items.
+    If any call raises an exception, the exception of the first failing
+    item is re-raised once all calls have finished.
+
+    The calling thread works through items too. This means that it always
+    makes progress, even when every thread in the pool is busy.
+
+    Each call runs within the request context of the calling thread.
+    """
+    items = list(items)
+    if limit <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    batch = _Batch(func, items, context.current())
+    pool = thread_pool()
+    for i in range(min(limit, len(items)) - 1):
+        pool.apply_async(batch.work)
+    batch.work()
+    return batch.wait()
+
+
+class _Batch(object):
+    """
+    A list of items that several threads call a function on.
+    """
+
+    def __init__(self, func, items, context_values):
+        self.func = func
+        self.context_values = context_values
+        self.pending = deque(enumerate(items))
+        self.results = [None] * len(items)
+        self.errors = []
+        self.active = 0
+        self.done = threading.Condition()
+
+    def work(self):
+        with self.done:
+            self.active += 1
+        try:
+            while True:
+                with self.done:
+                    if not self.pending:
+                        return
+                    index, item = self.pending.popleft()
+                try:
+                    with context.inherit(self.context_values):
+                        self.results[index] = self.func(item)
+                except Exception:
+                    self.errors.append((index, sys.exc_info()))
+        finally:
+            with self.done:
+                self.active -= 1
+                self.done.notify_all()
+
+    def wait(self):
+        # Only wait for threads that picked up an item. Threads that
+        # start later will find nothing left to do.
+        with self.done:
+            while self.active:
+                self.done.wait()
+
+        if self.errors:
+            index, exc_info = min(self.errors)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return self.results
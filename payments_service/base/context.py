@@ -0,0 +1,70 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def current():
+    """
+    Returns the dict of values that live as long as the current request.
+
+    RequestContextMiddleware starts a context when a request comes in and
+    ends it when the response goes out. Code running outside of a request,
+    such as a management command, has no context and this returns None.
+    """
+    return getattr(_local, 'values', None)
+
+
+def start():
+    """
+    Starts a new context for the request handled by this thread.
+    """
+    _local.values = {}
+    return _local.values
+
+
+def end():
+    """
+    Ends the context of the current request.
+
+    Any value with a close() method will be closed. This lets request
+    scoped objects report on themselves or release resources.
+    """
+    values = current()
+    _local.values = None
+    close(values)
+
+
+def close(values):
+    """
+    Closes every value of a context that has a close() method.
+    """
+    if not values:
+        return
+    for key, value in values.items():
+        close = getattr(value, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception:
+                log.exception('closing request context value {}'
+                              .format(key))
+
+
+@contextmanager
+def inherit(values):
+    """
+    Runs a block of code within the context of another thread.
+
+    This is how worker threads share the context of the request that
+    submitted their work.
+    """
+    previous = current()
+    _local.values = values
+    try:
+        yield values
+    finally:
+        _local.values = previous
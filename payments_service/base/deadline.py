@@ -0,0 +1,99 @@
+import logging
+import time
+
+from django_statsd.clients import statsd
+
+from . import context
+
+log = logging.getLogger(__name__)
+
+CONTEXT_KEY = 'deadline'
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised instead of calling a downstream service when the current
+    request has no time left.
+    """
+
+
+class Deadline(object):
+    """
+    The time by which the current request should have a response.
+
+    Every downstream call draws from the same budget so that a chain of
+    slow calls can't hold on to a worker for longer than the deadline.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.time() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.time()
+
+    def timeout(self, default=None, call='downstream call'):
+        """
+        Returns the timeout to use for the next downstream call.
+
+        This is whatever time is left or the call's own default timeout,
+        whichever is shorter. If no time is left, DeadlineExceeded is
+        raised so that the call is never made.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            log.warning('skipping {call}; the deadline of {seconds}s was '
+                        'exceeded by {over:.3f}s'
+                        .format(call=call, seconds=self.seconds,
+                                over=-remaining))
+            statsd.incr('deadline.exceeded')
+            raise DeadlineExceeded(
+                '{} skipped: request deadline exceeded'.format(call))
+        if default is None:
+            return remaining
+        return min(remaining, default)
+
+
+def current():
+    """
+    Returns the Deadline of the current request or None if there isn't one.
+    """
+    values = context.current()
+    if values is None:
+        return None
+    return values.get(CONTEXT_KEY)
+
+
+def start(seconds):
+    """
+    Sets a deadline for the current request, seconds from now.
+    """
+    values = context.current()
+    if values is None:
+        raise RuntimeError('cannot set a deadline outside of a request')
+    values[CONTEXT_KEY] = Deadline(seconds)
+    return values[CONTEXT_KEY]
+
+
+def timeout(default=None, call='downstream call'):
+    """
+    Returns the timeout to use for a downstream call.
+
+    Within a request that has a deadline, see Deadline.timeout().
+    Otherwise, this is just the default.
+    """
+    deadline = current()
+    if deadline is None:
+        return default
+    return deadline.timeout(default, call=call)
+
+
+def remaining():
+    """
+    Returns the seconds left before the deadline of the current request,
+    or None if there is no deadline.
+    """
+    deadline = current()
+    if deadline is None:
+        return None
+    return deadline.remaining()
@@ -1,13 +1,30 @@
 import logging
 import re
+import smtplib
+import socket
+import threading
+import time
 
 from django.conf import settings
 from django.core.mail.backends import locmem
 from django.core.mail.backends import smtp
 
+from django_statsd.clients import statsd
+
+from .concurrency import ProcessSingleton
+
 log = logging.getLogger(__name__)
 
 
+def _clear_pools(pools):
+    for pool in pools.values():
+        pool.clear()
+
+
+# Connection pools, keyed by server and credentials.
+_pools = ProcessSingleton(dict, close=_clear_pools)
+
+
 def allowed(email_messages):
     for email_message in email_messages:
         for recipient in email_message.recipients():
@@ -38,6 +55,199 @@ class FilteredEmailBackend(smtp.EmailBackend):
         return False
 
 
+class PooledEmailBackend(FilteredEmailBackend):
+    """
+    A FilteredEmailBackend that keeps its connection open after sending.
+
+    Connections, which are already through STARTTLS and logged in, are
+    kept in a pool shared by all backends in this process, so most emails
+    are sent without connecting to the SMTP server. A message sent on a
+    pooled connection that the server has since closed is sent again on a
+    new connection. See SMTPConnectionPool for how long connections are
+    kept.
+
+    A connection is given back to the pool after sending even when the
+    server refused a message, but one that failed is closed instead.
+    """
+
+    def __init__(self, *args, **kw):
+        super(PooledEmailBackend, self).__init__(*args, **kw)
+        self.pool = connection_pool(self.host, self.port, self.username,
+                                    self.use_tls, self.use_ssl)
+        self.reused = False
+        self.sent = 0
+
+    def open(self):
+        if self.connection:
+            return False
+        self.connection, self.sent = self.pool.get()
+        self.reused = self.connection is not None
+        if not self.reused:
+            self.connect()
+        # Always close() so that the connection goes back to the pool.
+        return True
+
+    def connect(self):
+        statsd.incr('email.pool.connect')
+        self.sent = 0
+        try:
+            super(PooledEmailBackend, self).open()
+        except Exception:
+            self.discard()
+            raise
+
+    def send_messages(self, email_messages):
+        # Django only closes the connection when every message was sent.
+        try:
+            return (super(PooledEmailBackend, self)
+                    .send_messages(email_messages))
+        finally:
+            self.close()
+
+    def close(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            self.pool.put(connection, self.sent)
+
+    def discard(self):
+        """
+        Closes the connection instead of giving it back to the pool.
+        """
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            self.pool.discard(connection)
+
+    def _send(self, email_message):
+        if self.sent >= self.pool.max_messages:
+            # Start a new session before the server ends this one.
+            self.pool.quit(self.connection)
+            self.connection = None
+            self.reused = False
+            self.connect()
+        try:
+            sent = super(PooledEmailBackend, self)._send(email_message)
+        except (smtplib.SMTPServerDisconnected, socket.error), exc:
+            self.discard()
+            if not self.reused:
+                raise
+            log.info(u'pooled SMTP connection failed, reconnecting: '
+                     u'{e.__class__.__name__}: {e}'.format(e=exc))
+            statsd.incr('email.pool.reconnect')
+            self.reused = False
+            self.connect()
+            try:
+                sent = super(PooledEmailBackend, self)._send(email_message)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                self.discard()
+                raise
+        if sent:
+            self.sent += 1
+        return sent
+
+
+def connection_pool(host, port, username, use_tls, use_ssl):
+    """
+    Returns the pool of connections to an SMTP server for this process.
+    """
+    key = (host, port, username, use_tls, use_ssl)
+    pools = _pools.get()
+    pool = pools.get(key)
+    if pool is None:
+        # Another thread may add one first, which is then used instead of
+        # this one; neither has connections yet.
+        pool = pools.setdefault(key, SMTPConnectionPool(
+            '{}:{}'.format(host, port),
+            maxsize=settings.EMAIL_POOL_SIZE,
+            max_idle=settings.EMAIL_POOL_MAX_IDLE,
+            max_messages=settings.EMAIL_POOL_MAX_MESSAGES))
+    return pool
+
+
+def reset_connection_pools():
+    """
+    Closes all pooled SMTP connections.
+    """
+    _pools.reset()
+
+
+class SMTPConnectionPool(object):
+    """
+    Idle connections to an SMTP server.
+
+    Up to `maxsize` connections are kept. A connection that has been idle
+    for `max_idle` seconds, which servers tend to close, or that has sent
+    `max_messages` messages is closed instead of being used again.
+    """
+
+    def __init__(self, name, maxsize=4, max_idle=60, max_messages=100):
+        self.name = name
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def get(self):
+        """
+        Returns the most recently used idle connection and the number of
+        messages it has sent, or (None, 0) if there isn't one.
+        """
+        expired = []
+        found = (None, 0)
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                idle_since, connection, sent = self._idle.pop()
+                if now - idle_since < self.max_idle:
+                    found = (connection, sent)
+                    break
+                expired.append(connection)
+        for connection in expired:
+            self.quit(connection)
+        if found[0] is not None:
+            statsd.incr('email.pool.reuse')
+        return found
+
+    def put(self, connection, sent):
+        """
+        Makes a connection available to get(), or closes it.
+        """
+        if sent < self.max_messages:
+            with self._lock:
+                if len(self._idle) < self.maxsize:
+                    self._idle.append((time.time(), connection, sent))
+                    return
+        self.quit(connection)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for idle_since, connection, sent in idle:
+            self.quit(connection)
+
+    def quit(self, connection):
+        """
+        Ends the SMTP session of a connection, ignoring errors.
+        """
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, socket.error):
+            self.discard(connection)
+
+    def discard(self, connection):
+        """
+        Closes a connection that can no longer be used.
+        """
+        try:
+            connection.close()
+        except socket.error:
+            log.debug('{}: closing a broken connection'.format(self.name),
+                      exc_info=True)
+
+    def __len__(self):
+        return len(self._idle)
+
+
 # Used for tests.
 class FilteredLocEmailBackend(locmem.EmailBackend):
 
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from django_statsd.clients import statsd
+
+log = logging.getLogger(__name__)
+
+# Cache backends whose values are only seen by the process that set them.
+PER_PROCESS_BACKENDS = (
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def content_etag(content):
+    """
+    Returns a strong ETag for a response body.
+    """
+    return '"{}"'.format(hashlib.sha1(content).hexdigest())
+
+
+def version_etag(version, request):
+    """
+    Returns a strong ETag for the representation at the request's full
+    path (including its query string) as of a version stamp.
+    """
+    return '"v-{}"'.format(hashlib.sha1(
+        '{} {}'.format(version, request.get_full_path())).hexdigest())
+
+
+def if_none_match(request, etag):
+    """
+    Returns True if the request's If-None-Match header matches etag,
+    meaning that the client already has this representation.
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison.
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            statsd.incr('etag.not_modified')
+            return True
+    return False
+
+
+def shared_cache(name):
+    """
+    Returns True if every process sees the values in the named cache.
+    """
+    return settings.CACHES[name]['BACKEND'] not in PER_PROCESS_BACKENDS
+
+
+def _cache():
+    return caches[settings.ETAG_VERSION_CACHE]
+
+
+def _version_key(buyer_uuid):
+    return 'etag-version:{}'.format(buyer_uuid)
+
+
+def buyer_version(buyer_uuid):
+    """
+    Returns the current version stamp of a buyer's data.
+
+    A new stamp is made when there isn't one, which happens after
+    bump_buyer_version() or once settings.ETAG_VERSION_TTL runs out.
+    """
+    cache = _cache()
+    key = _version_key(buyer_uuid)
+    version = cache.get(key)
+    if version is None:
+        new_version = uuid.uuid4().hex
+        cache.add(key, new_version, settings.ETAG_VERSION_TTL)
+        # Another process may have added its own stamp first.
+        version = cache.get(key) or new_version
+    return version
+
+
+def bump_buyer_version(buyer_uuid):
+    """
+    Invalidates every version ETag handed out for a buyer's data. Call
+    this whenever the buyer's data in Solitude may have changed.
+    """
+    if not settings.ETAG_VERSION_STAMPS or not buyer_uuid:
+        return
+    log.debug('bumping ETag version of buyer {}'.format(buyer_uuid))
+    _cache().delete(_version_key(buyer_uuid))
@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+
+import requests
+from django_statsd.clients import statsd
+from requests.adapters import HTTPAdapter
+
+from . import deadline
+from .deadline import DeadlineExceeded
+
+log = logging.getLogger(__name__)
+
+
+class PooledSession(requests.Session):
+    """
+    HTTP session that keeps a bounded pool of keep-alive connections.
+
+    One instance is meant to be shared by all threads of a worker process
+    so that requests to the same service reuse TCP/TLS connections.
+
+    Arguments:
+
+    *name*
+        Short name of the service, used as the metrics prefix.
+        Example: ``solitude``
+
+    *pool_connections*
+        Number of per-host connection pools to keep.
+
+    *pool_maxsize*
+        Maximum number of connections in each pool. This is also the
+        maximum number of concurrent requests; additional requests will
+        wait for a free connection, but no longer than the deadline of
+        the current request allows.
+
+    *max_retries*
+        Passed to the transport adapter. This can be an integer or a
+        ``Retry`` object.
+    """
+
+    def __init__(self, name, pool_connections=1, pool_maxsize=10,
+                 max_retries=0):
+        super(PooledSession, self).__init__()
+        self.name = name
+        self.pool_maxsize = pool_maxsize
+        # Ask for compressed responses. This is already a requests default
+        # but we depend on it so it's declared explicitly.
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=max_retries,
+                              pool_block=True)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+        self._stats_lock = threading.Lock()
+        self._free = threading.Condition(self._stats_lock)
+        self._in_use = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def request(self, method, url, **kw):
+        start = time.time()
+        timeout = deadline.remaining()
+        with self._free:
+            while self._in_use >= self.pool_maxsize:
+                waited = time.time() - start
+                if timeout is not None and waited >= timeout:
+                    log.warning('{}: no free connection for {} {} before the '
+                                'request deadline'.format(self.name, method,
+                                                          url))
+                    statsd.incr('deadline.exceeded')
+                    raise DeadlineExceeded(
+                        '{} {} {} skipped: request deadline exceeded while '
+                        'waiting for a connection'.format(self.name, method,
+                                                          url))
+                self._free.wait(None if timeout is None else
+                                timeout - waited)
+            waited = time.time() - start
+            self._in_use += 1
+            self._waits += 1
+            self._wait_time += waited
+            in_use = self._in_use
+
+        statsd.timing('{}.pool.wait'.format(self.name), waited * 1000)
+        statsd.gauge('{}.pool.in_use'.format(self.name), in_use)
+        try:
+            return super(PooledSession, self).request(method, url, **kw)
+        finally:
+            with self._free:
+                self._in_use -= 1
+                self._free.notify()
+            statsd.gauge('{}.pool.idle'.format(self.name), self.idle())
+
+    def idle(self):
+        """
+        Returns the number of open connections waiting to be reused.
+        """
+        idle = 0
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                try:
+                    pool = pools[key]
+                except KeyError:
+                    # The pool was evicted after we read the keys.
+                    continue
+                idle += len([conn for conn in list(pool.pool.queue)
+                             if conn is not None and conn.sock is not None])
+        return idle
+
+    def stats(self):
+        """
+        Returns a dict of connection pool metrics.
+
+        * `in_use`: connections currently serving a request.
+        * `idle`: open connections waiting to be reused.
+        * `max_size`: maximum number of connections.
+        * `wait_ms`: average time a request waited for a connection.
+        """
+        with self._stats_lock:
+            in_use = self._in_use
+            waits = self._waits
+            wait_time = self._wait_time
+        return {
+            'in_use': in_use,
+            'idle': self.idle(),
+            'max_size': self.pool_maxsize,
+            'wait_ms': (wait_time / waits * 1000) if waits else 0.0,
+        }
@@ -3,6 +3,8 @@ import logging
 from django.conf import settings
 from django.http import HttpResponse
 
+from . import context, deadline, etags
+
 log = logging.getLogger(__name__)
 
 
@@ -41,3 +43,51 @@ class CORSMiddleware(object):
         log.warn('CORS requests are enabled for {}'
                  .format(settings.ENABLE_CORS_FOR_ORIGIN))
         return self.corsify_response(response)
+
+
+class RequestContextMiddleware(object):
+    """
+    Middleware that keeps a context of values for the lifetime of each
+    request. See payments_service.base.context.
+    """
+
+    def process_request(self, request):
+        context.start()
+
+    def process_response(self, request, response):
+        context.end()
+        return response
+
+
+class DeadlineMiddleware(object):
+    """
+    Middleware that gives each request a deadline. Downstream calls
+    made by the view draw from it. See payments_service.base.deadline.
+
+    The deadline is settings.REQUEST_DEADLINE seconds unless the route
+    has its own in settings.REQUEST_DEADLINE_BY_ROUTE.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route = getattr(request.resolver_match, 'view_name', None)
+        seconds = settings.REQUEST_DEADLINE_BY_ROUTE.get(
+            route, settings.REQUEST_DEADLINE)
+        if seconds:
+            deadline.start(seconds)
+
+
+class BuyerVersionMiddleware(object):
+    """
+    Middleware that invalidates the ETag version stamp of the signed-in
+    buyer after any request that may have changed their data. See
+    payments_service.base.etags.
+    """
+
+    def process_response(self, request, response):
+        if request.method.upper() in ('GET', 'HEAD', 'OPTIONS'):
+            return response
+        session = getattr(request, 'session', None)
+        buyer = session.get('buyer') if session is not None else None
+        if buyer:
+            etags.bump_buyer_version(buyer.get('uuid'))
+        return response
@@ -0,0 +1,186 @@
+import json
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import closing
+
+log = logging.getLogger(__name__)
+
+# An item handed out by SQLiteQueue.claim(). attempts includes this one.
+# state is whatever was last saved with save_state(), or None.
+Item = namedtuple('Item', 'id data created attempts state')
+
+
+class QueueFull(Exception):
+    """
+    Raised by SQLiteQueue.put() when the queue already holds max_depth
+    items.
+    """
+
+
+class SQLiteQueue(object):
+    """
+    A durable first in, first out queue kept in a SQLite database file.
+
+    Several processes can share the same file. Each item is JSON data. An
+    item handed out by claim() is leased for `lease` seconds; if it has
+    not been marked done(), failed() or retried by then, for example
+    because the worker died, it is handed out again. Failed items are kept
+    in the file's failed table for someone to look at.
+    """
+
+    def __init__(self, path, lease=300, max_depth=None):
+        self.path = path
+        self.lease = lease
+        self.max_depth = max_depth
+        self._create()
+
+    def put(self, data):
+        """
+        Adds data to the queue and returns its ID.
+
+        Raises QueueFull if the queue already holds max_depth items.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # Count and insert in one transaction so that the queue can't
+            # grow past max_depth.
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self.max_depth is not None:
+                    depth = conn.execute(
+                        'SELECT COUNT(*) FROM items').fetchone()[0]
+                    if depth >= self.max_depth:
+                        raise QueueFull('{} holds {} items'
+                                        .format(self.path, depth))
+                cursor = conn.execute(
+                    'INSERT INTO items (data, created, available, attempts) '
+                    'VALUES (?, ?, ?, 0)', (json.dumps(data), now, now))
+            finally:
+                conn.execute('COMMIT')
+            return cursor.lastrowid
+
+    def claim(self):
+        """
+        Leases the oldest available item and returns it, or returns None
+        if no item is available.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # Take the write lock up front so that two workers can't claim
+            # the same item.
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT id, data, created, attempts, state FROM items '
+                    'WHERE available <= ? ORDER BY id LIMIT 1',
+                    (now,)).fetchone()
+                if row is None:
+                    return None
+                item_id, data, created, attempts, state = row
+                conn.execute(
+                    'UPDATE items SET available = ?, attempts = ? '
+                    'WHERE id = ?', (now + self.lease, attempts + 1, item_id))
+            finally:
+                conn.execute('COMMIT')
+        return Item(item_id, json.loads(data), created, attempts + 1,
+                    json.loads(state) if state else None)
+
+    def save_state(self, item_id, state):
+        """
+        Saves JSON state for an item that the next claim() of it returns,
+        such as how far processing it got.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('UPDATE items SET state = ? WHERE id = ?',
+                         (json.dumps(state), item_id))
+
+    def done(self, item_id):
+        """
+        Removes an item from the queue.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('DELETE FROM items WHERE id = ?', (item_id,))
+
+    def fail(self, item_id, error):
+        """
+        Moves an item out of the queue into the failed table, along with
+        the error that it failed with.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'INSERT INTO failed (id, data, created, attempts, '
+                    'failed, error) SELECT id, data, created, attempts, ?, ? '
+                    'FROM items WHERE id = ?', (time.time(), error, item_id))
+                conn.execute('DELETE FROM items WHERE id = ?', (item_id,))
+            finally:
+                conn.execute('COMMIT')
+
+    def retry(self, item_id, delay):
+        """
+        Makes a claimed item available again after delay seconds.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('UPDATE items SET available = ? WHERE id = ?',
+                         (time.time() + delay, item_id))
+
+    def depth(self):
+        """
+        Returns the number of items in the queue, including claimed ones.
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def failed_depth(self):
+        """
+        Returns the number of items in the failed table.
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM failed').fetchone()[0]
+
+    def lag(self):
+        """
+        Returns how many seconds the oldest item has been queued for.
+        """
+        with closing(self._connect()) as conn:
+            oldest = conn.execute(
+                'SELECT MIN(created) FROM items').fetchone()[0]
+        if oldest is None:
+            return 0
+        return max(time.time() - oldest, 0)
+
+    def _connect(self):
+        # Autocommit; claim() manages its own transaction.
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _create(self):
+        with closing(self._connect()) as conn:
+            # Let workers read while web processes write.
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS items ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'data TEXT NOT NULL, '
+                'created REAL NOT NULL, '
+                'available REAL NOT NULL, '
+                'attempts INTEGER NOT NULL, '
+                'state TEXT)')
+            columns = [row[1] for row in
+                       conn.execute('PRAGMA table_info(items)')]
+            if 'state' not in columns:
+                # The file was created before items had a state.
+                conn.execute('ALTER TABLE items ADD COLUMN state TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS items_available '
+                         'ON items (available)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS failed ('
+                'id INTEGER PRIMARY KEY, '
+                'data TEXT NOT NULL, '
+                'created REAL NOT NULL, '
+                'attempts INTEGER NOT NULL, '
+                'failed REAL NOT NULL, '
+                'error TEXT NOT NULL)')
+        log.info('using queue at {}'.format(self.path))
@@ -3,6 +3,7 @@ import re
 
 from django.conf import settings
 from django.conf.urls import patterns, url
+from django.core.cache import caches
 from django.test import TestCase as DjangoTestCase
 from django.test.utils import override_settings
 
@@ -43,6 +44,10 @@ class TestCase(DjangoTestCase):
         self.solitude = APIMock()
         api.return_value = self.solitude
 
+        # Don't let cached values leak from one test to another.
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
     def assert_error_response(self, res, msg_patterns=None):
         """
         Make assertions about errors in the endpoint's JSON response.
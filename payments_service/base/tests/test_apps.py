@@ -38,3 +38,16 @@ class TestBaseApp(TestCase):
     def test_default_secret_key(self):
         with self.overrides(SECRET_KEY=settings.SECRET_KEY):
             self.app.ready()
+
+    @raises(ImproperlyConfigured)
+    def test_version_stamps_with_local_cache(self):
+        with self.overrides(ETAG_VERSION_STAMPS=True):
+            self.app.ready()
+
+    def test_version_stamps_with_shared_cache(self):
+        caches = {'shared': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211'}}
+        with self.overrides(ETAG_VERSION_STAMPS=True, CACHES=caches,
+                            ETAG_VERSION_CACHE='shared'):
+            self.app.ready()
@@ -1,11 +1,19 @@
+import asyncore
+import smtpd
+import smtplib
+import threading
+
 from django.core import mail
 from django.test.utils import override_settings
 
+import mock
 from nose.tools import eq_
 
+from payments_service.base import email
 from payments_service.base.tests import TestCase
 
 filtered = 'payments_service.base.email.FilteredLocEmailBackend'
+pooled = 'payments_service.base.email.PooledEmailBackend'
 
 
 @override_settings(EMAIL_BACKEND=filtered)
@@ -34,3 +42,235 @@ class TestAllowedToEmail(TestCase):
     def test_multiple(self):
         self.send(['a@m.o', 'a@m.c'])
         eq_(len(mail.outbox), 0)
+
+
+def move_to_map(dispatcher, map):
+    # smtpd always adds its dispatchers to the global asyncore map.
+    del asyncore.socket_map[dispatcher._fileno]
+    dispatcher._map = map
+    map[dispatcher._fileno] = dispatcher
+
+
+class SMTPServer(smtpd.SMTPServer):
+    """
+    A local SMTP server that keeps the messages it receives.
+    """
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        # Use a map of our own so that the loop of an earlier server
+        # that is still stopping can't serve this one.
+        self.map = {}
+        move_to_map(self, self.map)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.channels = []
+        # SMTPChannel sends the greeting before handle_accept can keep
+        # it, so a client can be connected before it is in channels.
+        self.channels_lock = threading.Lock()
+        # The reply to a message; None accepts it.
+        self.reply = None
+        self.thread = threading.Thread(target=asyncore.loop,
+                                       kwargs={'timeout': 0.01,
+                                               'map': self.map})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            conn, addr = pair
+            with self.channels_lock:
+                channel = smtpd.SMTPChannel(self, conn, addr)
+                move_to_map(channel, self.map)
+                self.channels.append(channel)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.reply:
+            return self.reply
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def drop_connections(self):
+        with self.channels_lock:
+            for channel in self.channels:
+                channel.close()
+
+    def stop(self):
+        self.drop_connections()
+        self.close()
+        self.thread.join(5)
+
+
+@override_settings(EMAIL_ALLOWED_LIST=['.*@mozilla\\.com$'],
+                   EMAIL_POOL_SIZE=2)
+class TestPooledEmailBackend(TestCase):
+
+    def setUp(self):
+        super(TestPooledEmailBackend, self).setUp()
+        self.server = SMTPServer()
+        self.addCleanup(self.server.stop)
+        email.reset_connection_pools()
+        self.addCleanup(email.reset_connection_pools)
+
+    def connection(self):
+        return mail.get_connection(pooled, host='127.0.0.1',
+                                   port=self.server.port, use_tls=False)
+
+    def send(self, to='buyer@mozilla.com', connection=None):
+        mail.send_mail('subject', 'msg', 'a@mozilla.com', [to],
+                       connection=connection or self.connection())
+
+    def test_send(self):
+        self.send()
+        eq_(len(self.server.messages), 1)
+        eq_(self.server.messages[0][1], ['buyer@mozilla.com'])
+
+    def test_reuse_connection(self):
+        for i in range(3):
+            self.send()
+        eq_(len(self.server.messages), 3)
+        eq_(len(self.server.channels), 1)
+
+    def test_filtered(self):
+        self.send(to='buyer@example.com')
+        eq_(len(self.server.messages), 0)
+
+    def test_batch(self):
+        messages = [mail.EmailMessage('subject', 'msg', 'a@mozilla.com',
+                                      ['buyer@mozilla.com'])
+                    for i in range(3)]
+        eq_(self.connection().send_messages(messages), 3)
+        eq_(len(self.server.messages), 3)
+        eq_(len(self.server.channels), 1)
+
+    def test_reconnect(self):
+        self.send()
+        self.server.drop_connections()
+        self.send()
+        eq_(len(self.server.messages), 2)
+        eq_(len(self.server.channels), 2)
+
+    @override_settings(EMAIL_POOL_MAX_IDLE=0)
+    def test_idle_connections_expire(self):
+        self.send()
+        self.send()
+        eq_(len(self.server.channels), 2)
+
+    @override_settings(EMAIL_POOL_MAX_MESSAGES=2)
+    def test_max_messages(self):
+        for i in range(3):
+            self.send()
+        eq_(len(self.server.messages), 3)
+        eq_(len(self.server.channels), 2)
+
+    def test_pool_size(self):
+        backends = [self.connection() for i in range(3)]
+        for backend in backends:
+            backend.open()
+        for backend in backends:
+            backend.close()
+        eq_(len(backends[0].pool), 2)
+
+    def test_concurrent_sends(self):
+        threads = [threading.Thread(target=self.send) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        eq_(len(self.server.messages), 4)
+        assert len(self.server.channels) <= 4
+
+    def test_shared_pool(self):
+        eq_(self.connection().pool, self.connection().pool)
+
+    def test_do_not_retry_new_connections(self):
+        backend = self.connection()
+        backend.open()
+        self.server.drop_connections()
+        with self.assertRaises(Exception):
+            self.send(connection=backend)
+
+    def test_discard_failed_connection(self):
+        backend = self.connection()
+        backend.open()
+        connection = backend.connection
+        self.server.drop_connections()
+        with self.assertRaises(Exception):
+            self.send(connection=backend)
+        eq_(backend.connection, None)
+        eq_(len(backend.pool), 0)
+        eq_(connection.sock, None)
+
+    def test_discard_after_failed_reconnect(self):
+        self.send()
+        self.server.drop_connections()
+        self.server.stop()
+        backend = self.connection()
+        with self.assertRaises(Exception):
+            self.send(connection=backend)
+        eq_(backend.connection, None)
+        eq_(len(backend.pool), 0)
+
+    def test_keep_connection_after_refused_message(self):
+        self.server.reply = '554 rejected'
+        backend = self.connection()
+        with self.assertRaises(smtplib.SMTPDataError):
+            self.send(connection=backend)
+        eq_(backend.connection, None)
+        eq_(len(backend.pool), 1)
+        self.server.reply = None
+        self.send()
+        eq_(len(self.server.messages), 1)
+        eq_(len(self.server.channels), 1)
+
+
+class TestSMTPConnectionPool(TestCase):
+
+    def setUp(self):
+        super(TestSMTPConnectionPool, self).setUp()
+        self.pool = email.SMTPConnectionPool('test', maxsize=1, max_idle=10,
+                                             max_messages=5)
+
+    def test_empty(self):
+        eq_(self.pool.get(), (None, 0))
+
+    def test_get(self):
+        connection = mock.Mock()
+        self.pool.put(connection, 2)
+        eq_(self.pool.get(), (connection, 2))
+        eq_(len(self.pool), 0)
+
+    def test_full(self):
+        first, second = mock.Mock(), mock.Mock()
+        self.pool.put(first, 0)
+        self.pool.put(second, 0)
+        assert second.quit.called
+        eq_(self.pool.get(), (first, 0))
+
+    def test_max_messages(self):
+        connection = mock.Mock()
+        self.pool.put(connection, 5)
+        assert connection.quit.called
+        eq_(len(self.pool), 0)
+
+    @mock.patch('payments_service.base.email.time')
+    def test_expired(self, time):
+        connection = mock.Mock()
+        time.time.return_value = 100
+        self.pool.put(connection, 0)
+        time.time.return_value = 110
+        eq_(self.pool.get(), (None, 0))
+        assert connection.quit.called
+
+    def test_quit_broken_connection(self):
+        connection = mock.Mock()
+        connection.quit.side_effect = email.socket.error
+        self.pool.quit(connection)
+        assert connection.close.called
+
+    def test_clear(self):
+        connection = mock.Mock()
+        self.pool.put(connection, 0)
+        self.pool.clear()
+        assert connection.quit.called
+        eq_(len(self.pool), 0)
@@ -0,0 +1,101 @@
+import unittest
+
+import mock
+from nose.tools import eq_, raises
+
+from ..breaker import CircuitBreaker, CircuitOpen, CLOSED, HALF_OPEN, OPEN
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        p = mock.patch('payments_service.base.breaker.time.time')
+        self.time = p.start()
+        self.addCleanup(p.stop)
+        self.time.return_value = 1000.0
+        self.breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=4,
+                                      window=30, cooldown=10)
+
+    def succeed(self):
+        return self.breaker.call(lambda: 'ok')
+
+    def fail(self):
+        with self.assertRaises(RuntimeError):
+            self.breaker.call(mock.Mock(side_effect=RuntimeError))
+
+    def trip(self):
+        for i in range(4):
+            self.fail()
+
+    def test_closed(self):
+        eq_(self.succeed(), 'ok')
+        eq_(self.breaker.state, CLOSED)
+
+    def test_open_after_failures(self):
+        self.trip()
+        eq_(self.breaker.state, OPEN)
+
+    def test_stay_closed_below_min_calls(self):
+        for i in range(3):
+            self.fail()
+        eq_(self.breaker.state, CLOSED)
+
+    def test_stay_closed_below_failure_rate(self):
+        for i in range(3):
+            self.succeed()
+        for i in range(2):
+            self.fail()
+        eq_(self.breaker.state, CLOSED)
+
+    def test_forget_old_calls(self):
+        for i in range(3):
+            self.fail()
+        self.time.return_value += 31
+        self.fail()
+        eq_(self.breaker.state, CLOSED)
+
+    def test_failing_result(self):
+        for i in range(4):
+            self.breaker.call(lambda: 500, is_failure=lambda res: res >= 500)
+        eq_(self.breaker.state, OPEN)
+
+    def test_fail_fast_when_open(self):
+        self.trip()
+        func = mock.Mock()
+        with self.assertRaises(CircuitOpen) as cm:
+            self.breaker.call(func)
+        assert not func.called
+        eq_(cm.exception.retry_after, 10)
+
+    def test_half_open_after_cooldown(self):
+        self.trip()
+        self.time.return_value += 10
+        eq_(self.breaker.state, HALF_OPEN)
+
+    def test_close_after_successful_probe(self):
+        self.trip()
+        self.time.return_value += 10
+        eq_(self.succeed(), 'ok')
+        eq_(self.breaker.state, CLOSED)
+        eq_(self.breaker.stats()['calls'], 0)
+
+    def test_reopen_after_failed_probe(self):
+        self.trip()
+        self.time.return_value += 10
+        self.fail()
+        eq_(self.breaker.state, OPEN)
+        eq_(self.breaker.stats()['retry_after'], 10)
+
+    @raises(CircuitOpen)
+    def test_one_probe_at_a_time(self):
+        self.trip()
+        self.time.return_value += 10
+        # Start a probe that has not finished yet.
+        self.breaker._before_call()
+        self.succeed()
+
+    def test_stats(self):
+        self.succeed()
+        self.fail()
+        eq_(self.breaker.stats(), {'state': CLOSED, 'calls': 2,
+                                   'failures': 1, 'retry_after': 0})
@@ -0,0 +1,277 @@
+import threading
+import time
+import unittest
+
+import mock
+from nose.tools import eq_, raises
+
+from ..cache import LRUCache, SingleFlight
+from ..deadline import DeadlineExceeded
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache('test', 2)
+
+    def test_get_missing(self):
+        eq_(self.cache.get('a'), None)
+        eq_(self.cache.get('a', 'default'), 'default')
+
+    def test_set(self):
+        self.cache.set('a', 1, 60)
+        eq_(self.cache.get('a'), 1)
+
+    def test_delete(self):
+        self.cache.set('a', 1, 60)
+        self.cache.delete('a')
+        eq_(self.cache.get('a'), None)
+
+    def test_clear(self):
+        self.cache.set('a', 1, 60)
+        self.cache.clear()
+        eq_(self.cache.get('a'), None)
+
+    @mock.patch('payments_service.base.cache.time.time')
+    def test_expire(self, time):
+        time.return_value = 100
+        self.cache.set('a', 1, 60)
+        time.return_value = 159
+        eq_(self.cache.get('a'), 1)
+        time.return_value = 160
+        eq_(self.cache.get('a'), None)
+
+    def test_evict_least_recently_used(self):
+        self.cache.set('a', 1, 60)
+        self.cache.set('b', 2, 60)
+        self.cache.get('a')
+        self.cache.set('c', 3, 60)
+        eq_(self.cache.get('a'), 1)
+        eq_(self.cache.get('b'), None)
+        eq_(self.cache.get('c'), 3)
+        eq_(self.cache.evictions, 1)
+
+    def test_disabled(self):
+        cache = LRUCache('test', 0)
+        cache.set('a', 1, 60)
+        eq_(cache.get('a'), None)
+
+    def test_stats(self):
+        self.cache.set('a', 1, 60)
+        self.cache.get('a')
+        self.cache.get('b')
+        eq_(self.cache.stats(), {'size': 1, 'max_size': 2, 'hits': 1,
+                                 'misses': 1, 'evictions': 0})
+
+    def test_get_or_load(self):
+        load = mock.Mock(return_value=1)
+        eq_(self.cache.get_or_load('a', load, 60), 1)
+        eq_(self.cache.get_or_load('a', load, 60), 1)
+        eq_(load.call_count, 1)
+
+    def test_do_not_keep(self):
+        load = mock.Mock(return_value=1)
+        self.cache.get_or_load('a', load, 60, keep=lambda value: False)
+        self.cache.get_or_load('a', load, 60, keep=lambda value: False)
+        eq_(load.call_count, 2)
+
+    @raises(RuntimeError)
+    def test_load_error(self):
+        self.cache.get_or_load('a', mock.Mock(side_effect=RuntimeError), 60)
+
+    def test_do_not_keep_errors(self):
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_load('a', mock.Mock(side_effect=RuntimeError),
+                                   60)
+        eq_(self.cache.get_or_load('a', lambda: 1, 60), 1)
+
+    def test_load_once_for_concurrent_misses(self):
+        loading = threading.Event()
+        finish = threading.Event()
+        calls = []
+        results = []
+
+        def load():
+            calls.append(1)
+            loading.set()
+            finish.wait()
+            return 'value'
+
+        def get():
+            results.append(self.cache.get_or_load('a', load, 60))
+
+        threads = [threading.Thread(target=get) for i in range(3)]
+        threads[0].start()
+        loading.wait()
+        for thread in threads[1:]:
+            thread.start()
+        finish.set()
+        for thread in threads:
+            thread.join()
+
+        eq_(len(calls), 1)
+        eq_(results, ['value'] * 3)
+
+    def test_do_not_store_loads_started_before_clear(self):
+        def load():
+            self.cache.clear()
+            return 'old'
+
+        eq_(self.cache.get_or_load('a', load, 60), 'old')
+        eq_(self.cache.get('a'), None)
+        eq_(self.cache.get_or_load('a', lambda: 'new', 60), 'new')
+        eq_(self.cache.get('a'), 'new')
+
+    def test_do_not_share_loads_started_before_clear(self):
+        loading = threading.Event()
+        finish = threading.Event()
+
+        def slow():
+            loading.set()
+            finish.wait()
+            return 'old'
+
+        thread = threading.Thread(target=self.cache.get_or_load,
+                                  args=('a', slow, 60))
+        thread.start()
+        loading.wait()
+        self.cache.clear()
+        try:
+            eq_(self.cache.get_or_load('a', lambda: 'new', 60), 'new')
+        finally:
+            finish.set()
+            thread.join()
+        eq_(self.cache.get('a'), 'new')
+
+    def test_stop_waiting_for_load_after_timeout(self):
+        loading = threading.Event()
+        finish = threading.Event()
+
+        def slow():
+            loading.set()
+            finish.wait()
+
+        thread = threading.Thread(target=self.cache.get_or_load,
+                                  args=('a', slow, 60))
+        thread.start()
+        loading.wait()
+        try:
+            with self.assertRaises(DeadlineExceeded):
+                self.cache.get_or_load('a', slow, 60, timeout=0.01)
+        finally:
+            finish.set()
+            thread.join()
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.in_flight = SingleFlight('test')
+
+    def test_call(self):
+        eq_(self.in_flight.do('a', lambda: 1), 1)
+
+    def test_do_not_keep_results(self):
+        func = mock.Mock(return_value=1)
+        self.in_flight.do('a', func)
+        self.in_flight.do('a', func)
+        eq_(func.call_count, 2)
+        eq_(self.in_flight.coalesced, 0)
+
+    @raises(RuntimeError)
+    def test_error(self):
+        self.in_flight.do('a', mock.Mock(side_effect=RuntimeError))
+
+    def run_concurrently(self, func, keys):
+        started = threading.Event()
+        finish = threading.Event()
+        results = []
+        errors = []
+
+        def slow():
+            started.set()
+            finish.wait()
+            return func()
+
+        def call(key):
+            try:
+                results.append(self.in_flight.do(key, slow))
+            except Exception, exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call, args=(key,))
+                   for key in keys]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # Give the other threads a chance to join the call in flight.
+        while (self.in_flight.coalesced < keys.count(keys[0]) - 1):
+            time.sleep(0.001)
+        finish.set()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_coalesce_concurrent_calls(self):
+        func = mock.Mock(return_value='value')
+        results, errors = self.run_concurrently(func, ['a'] * 3)
+        eq_(func.call_count, 1)
+        eq_(results, ['value'] * 3)
+        eq_(self.in_flight.coalesced, 2)
+
+    def test_share_errors(self):
+        func = mock.Mock(side_effect=RuntimeError)
+        results, errors = self.run_concurrently(func, ['a'] * 3)
+        eq_(func.call_count, 1)
+        eq_(len(errors), 3)
+
+    def test_different_keys(self):
+        func = mock.Mock(return_value='value')
+        self.run_concurrently(func, ['a', 'b'])
+        eq_(func.call_count, 2)
+
+    def test_stop_waiting_after_timeout(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow():
+            started.set()
+            finish.wait()
+
+        leader = threading.Thread(target=self.in_flight.do, args=('a', slow))
+        leader.start()
+        started.wait()
+        try:
+            with self.assertRaises(DeadlineExceeded):
+                self.in_flight.do('a', slow, timeout=0.01)
+        finally:
+            finish.set()
+            leader.join()
+
+    def test_do_not_share_deadline_failures(self):
+        func = mock.Mock(side_effect=[DeadlineExceeded, 'value', 'value'])
+        results, errors = self.run_concurrently(func, ['a'] * 3)
+        eq_(len(errors), 1)
+        eq_(results, ['value'] * 2)
+        eq_(func.call_count, 3)
+
+    def test_do_not_share_calls_started_before_mark(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow():
+            started.set()
+            finish.wait()
+            return 'old'
+
+        leader = threading.Thread(target=self.in_flight.do, args=('a', slow))
+        leader.start()
+        started.wait()
+        since = self.in_flight.mark()
+        try:
+            eq_(self.in_flight.do('a', lambda: 'new', since=since), 'new')
+        finally:
+            finish.set()
+            leader.join()
+        eq_(self.in_flight.coalesced, 0)
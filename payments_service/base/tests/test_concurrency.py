@@ -0,0 +1,120 @@
+import threading
+import unittest
+
+import mock
+from nose.tools import eq_, raises
+
+from ..concurrency import ProcessSingleton, bounded_map
+
+
+class TestBoundedMap(unittest.TestCase):
+
+    def test_preserve_order(self):
+        eq_(bounded_map(lambda x: x * 2, range(10), 4),
+            [x * 2 for x in range(10)])
+
+    def test_empty(self):
+        eq_(bounded_map(lambda x: x, [], 4), [])
+
+    def test_serial(self):
+        threads = set()
+
+        def record(x):
+            threads.add(threading.current_thread())
+
+        bounded_map(record, range(5), 1)
+        eq_(threads, set([threading.current_thread()]))
+
+    def test_run_concurrently(self):
+        started = threading.Event()
+        seen_concurrent = []
+
+        def wait_for_other(x):
+            if x == 0:
+                # The second item has to start while this one waits.
+                seen_concurrent.append(started.wait(5))
+            else:
+                started.set()
+
+        bounded_map(wait_for_other, [0, 1], 2)
+        eq_(seen_concurrent, [True])
+
+    def test_respect_limit(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def track(x):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            threading.Event().wait(0.01)
+            with lock:
+                running[0] -= 1
+
+        bounded_map(track, range(12), 3)
+        assert peak[0] <= 3, 'ran {} at once'.format(peak[0])
+
+    @raises(ValueError)
+    def test_reraise_exceptions(self):
+
+        def fail(x):
+            if x == 3:
+                raise ValueError('bad item')
+            return x
+
+        bounded_map(fail, range(6), 3)
+
+    @mock.patch('payments_service.base.concurrency.thread_pool')
+    def test_make_progress_when_pool_is_busy(self, thread_pool):
+        # Simulate a pool where every thread is busy so that
+        # submitted work never starts.
+        thread_pool.return_value.apply_async.return_value = None
+        eq_(bounded_map(lambda x: x, range(5), 3), range(5))
+
+
+class TestProcessSingleton(unittest.TestCase):
+
+    def setUp(self):
+        self.close = mock.Mock()
+        self.singleton = ProcessSingleton(object, close=self.close)
+
+    def test_shared(self):
+        eq_(self.singleton.get(), self.singleton.get())
+
+    def test_made_on_first_use(self):
+        eq_(self.singleton.peek(), None)
+        value = self.singleton.get()
+        eq_(self.singleton.peek(), value)
+
+    def test_reset(self):
+        value = self.singleton.get()
+        self.singleton.reset()
+        self.close.assert_called_with(value)
+        assert self.singleton.get() is not value
+
+    def test_reset_unused(self):
+        self.singleton.reset()
+        assert not self.close.called
+
+    def test_reset_replaced_value(self):
+        value = self.singleton.get()
+        self.singleton.reset()
+        new = self.singleton.get()
+        self.close.reset_mock()
+        # Only the value that was asked for is forgotten.
+        self.singleton.reset(value)
+        assert not self.close.called
+        eq_(self.singleton.get(), new)
+
+    def test_new_value_after_fork(self):
+        value = self.singleton.get()
+        # As if this process was forked from the one that made the value.
+        self.singleton._made = (-1, value)
+        eq_(self.singleton.peek(), None)
+        assert self.singleton.get() is not value
+
+    def test_do_not_close_value_of_other_process(self):
+        self.singleton._made = (-1, object())
+        self.singleton.reset()
+        assert not self.close.called
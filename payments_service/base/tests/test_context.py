@@ -0,0 +1,61 @@
+import threading
+import unittest
+
+import mock
+from nose.tools import eq_
+
+from .. import context
+from ..concurrency import bounded_map
+
+
+class TestContext(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(context.end)
+
+    def test_no_context(self):
+        eq_(context.current(), None)
+
+    def test_start(self):
+        context.start()['thing'] = 1
+        eq_(context.current(), {'thing': 1})
+
+    def test_end(self):
+        context.start()
+        context.end()
+        eq_(context.current(), None)
+
+    def test_close_values_on_end(self):
+        value = mock.Mock()
+        context.start()['thing'] = value
+        context.end()
+        assert value.close.called
+
+    def test_close_all_values_despite_errors(self):
+        broken = mock.Mock()
+        broken.close.side_effect = RuntimeError
+        value = mock.Mock()
+        context.start().update({'broken': broken, 'value': value})
+        context.end()
+        assert value.close.called
+
+    def test_not_shared_with_other_threads(self):
+        context.start()
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(
+            context.current()))
+        thread.start()
+        thread.join()
+        eq_(seen, [None])
+
+    def test_inherit(self):
+        values = {'thing': 1}
+        with context.inherit(values):
+            eq_(context.current(), values)
+        eq_(context.current(), None)
+
+    def test_inherit_in_bounded_map(self):
+        values = context.start()
+        seen = bounded_map(lambda x: context.current(), range(4), 4)
+        for value in seen:
+            assert value is values
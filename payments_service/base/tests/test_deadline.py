@@ -0,0 +1,66 @@
+import unittest
+
+import mock
+from nose.tools import eq_, raises
+
+from .. import context, deadline
+from ..deadline import Deadline, DeadlineExceeded
+
+
+class TestDeadline(unittest.TestCase):
+
+    def setUp(self):
+        p = mock.patch('payments_service.base.deadline.time.time')
+        self.time = p.start()
+        self.addCleanup(p.stop)
+        self.time.return_value = 1000.0
+
+    def test_remaining(self):
+        d = Deadline(10)
+        self.time.return_value += 4
+        eq_(d.remaining(), 6)
+
+    def test_timeout_is_remaining_time(self):
+        d = Deadline(10)
+        self.time.return_value += 4
+        eq_(d.timeout(), 6)
+
+    def test_shorter_default_timeout(self):
+        eq_(Deadline(10).timeout(3), 3)
+
+    def test_longer_default_timeout(self):
+        d = Deadline(10)
+        self.time.return_value += 8
+        eq_(d.timeout(5), 2)
+
+    @raises(DeadlineExceeded)
+    def test_exceeded(self):
+        d = Deadline(10)
+        self.time.return_value += 10
+        d.timeout(5)
+
+
+class TestCurrentDeadline(unittest.TestCase):
+
+    def setUp(self):
+        context.start()
+        self.addCleanup(context.end)
+
+    def test_no_deadline(self):
+        eq_(deadline.current(), None)
+        eq_(deadline.timeout(5), 5)
+
+    def test_start(self):
+        d = deadline.start(10)
+        eq_(deadline.current(), d)
+        assert deadline.timeout(20) <= 10
+
+    @raises(RuntimeError)
+    def test_start_without_request(self):
+        context.end()
+        deadline.start(10)
+
+    def test_no_request(self):
+        context.end()
+        eq_(deadline.current(), None)
+        eq_(deadline.timeout(5), 5)
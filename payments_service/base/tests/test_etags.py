@@ -0,0 +1,75 @@
+from django.core.cache import caches
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from nose.tools import eq_
+
+from payments_service.base.tests import TestCase
+
+from .. import etags
+
+
+class TestETags(TestCase):
+
+    def request(self, if_none_match=None, path='/thing?a=1'):
+        headers = {}
+        if if_none_match:
+            headers['HTTP_IF_NONE_MATCH'] = if_none_match
+        return RequestFactory().get(path, **headers)
+
+    def test_content_etag(self):
+        etag = etags.content_etag('{}')
+        eq_(etag, etags.content_etag('{}'))
+        assert etag.startswith('"') and etag.endswith('"'), etag
+        assert etag != etags.content_etag('[]')
+
+    def test_version_etag_depends_on_path(self):
+        eq_(etags.version_etag('v1', self.request()),
+            etags.version_etag('v1', self.request()))
+        assert (etags.version_etag('v1', self.request()) !=
+                etags.version_etag('v1', self.request(path='/thing?a=2')))
+        assert (etags.version_etag('v1', self.request()) !=
+                etags.version_etag('v2', self.request()))
+
+    def test_match(self):
+        assert etags.if_none_match(self.request('"a"'), '"a"')
+
+    def test_no_match(self):
+        assert not etags.if_none_match(self.request('"b"'), '"a"')
+
+    def test_no_header(self):
+        assert not etags.if_none_match(self.request(), '"a"')
+
+    def test_match_any_of_several(self):
+        assert etags.if_none_match(self.request('"b", "a"'), '"a"')
+
+    def test_match_weak(self):
+        assert etags.if_none_match(self.request('W/"a"'), '"a"')
+
+    def test_match_star(self):
+        assert etags.if_none_match(self.request('*'), '"a"')
+
+
+@override_settings(ETAG_VERSION_STAMPS=True)
+class TestBuyerVersion(TestCase):
+
+    def setUp(self):
+        super(TestBuyerVersion, self).setUp()
+        caches['default'].clear()
+
+    def test_stable(self):
+        eq_(etags.buyer_version('uuid'), etags.buyer_version('uuid'))
+
+    def test_per_buyer(self):
+        assert etags.buyer_version('one') != etags.buyer_version('two')
+
+    def test_bump(self):
+        version = etags.buyer_version('uuid')
+        etags.bump_buyer_version('uuid')
+        assert etags.buyer_version('uuid') != version
+
+    def test_bump_when_disabled(self):
+        version = etags.buyer_version('uuid')
+        with self.settings(ETAG_VERSION_STAMPS=False):
+            etags.bump_buyer_version('uuid')
+        eq_(etags.buyer_version('uuid'), version)
@@ -0,0 +1,132 @@
+import threading
+import unittest
+
+import mock
+from nose.tools import eq_
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+
+from .. import context, deadline
+from ..deadline import DeadlineExceeded
+from ..http import PooledSession
+
+
+def fake_response(request, **kw):
+    response = Response()
+    response.status_code = 200
+    response._content = '{}'
+    response.request = request
+    response.url = request.url
+    return response
+
+
+class TestPooledSession(unittest.TestCase):
+
+    def setUp(self):
+        p = mock.patch.object(HTTPAdapter, 'send')
+        self.send = p.start()
+        self.addCleanup(p.stop)
+        self.send.side_effect = fake_response
+
+    def test_share_one_adapter(self):
+        session = PooledSession('service', pool_maxsize=3)
+        adapter = session.get_adapter('http://service/')
+        eq_(adapter, session.get_adapter('https://service/'))
+        eq_(adapter._pool_maxsize, 3)
+        eq_(adapter._pool_block, True)
+
+    def test_ask_for_gzip(self):
+        session = PooledSession('service')
+        session.get('http://service/')
+        request = self.send.call_args[0][0]
+        assert 'gzip' in request.headers['Accept-Encoding']
+
+    def test_stats(self):
+        session = PooledSession('service', pool_maxsize=5)
+        session.get('http://service/')
+        stats = session.stats()
+        eq_(stats['in_use'], 0)
+        eq_(stats['idle'], 0)
+        eq_(stats['max_size'], 5)
+        assert stats['wait_ms'] >= 0
+
+    def test_count_connections_in_use(self):
+        session = PooledSession('service')
+        in_use = []
+
+        def send(request, **kw):
+            in_use.append(session.stats()['in_use'])
+            return fake_response(request)
+
+        self.send.side_effect = send
+        session.get('http://service/')
+        eq_(in_use, [1])
+        eq_(session.stats()['in_use'], 0)
+
+    def test_release_connection_slot_on_error(self):
+        session = PooledSession('service', pool_maxsize=1)
+        self.send.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            session.get('http://service/')
+        eq_(session.stats()['in_use'], 0)
+
+        # The slot was released so this does not block.
+        self.send.side_effect = fake_response
+        eq_(session.get('http://service/').status_code, 200)
+
+    def test_wait_for_a_free_connection(self):
+        session = PooledSession('service', pool_maxsize=1)
+        sending = threading.Event()
+        finish = threading.Event()
+
+        def slow_send(request, **kw):
+            sending.set()
+            finish.wait()
+            return fake_response(request)
+
+        self.send.side_effect = slow_send
+        thread = threading.Thread(target=session.get,
+                                  args=['http://service/'])
+        thread.start()
+        sending.wait()
+
+        waiter = threading.Thread(target=session.get,
+                                  args=['http://service/'])
+        waiter.start()
+        waiter.join(0.05)
+        # The second request is blocked waiting on the first.
+        assert waiter.is_alive()
+        eq_(self.send.call_count, 1)
+
+        finish.set()
+        thread.join()
+        waiter.join()
+        eq_(self.send.call_count, 2)
+
+    def test_stop_waiting_at_deadline(self):
+        session = PooledSession('service', pool_maxsize=1)
+        sending = threading.Event()
+        finish = threading.Event()
+
+        def slow_send(request, **kw):
+            sending.set()
+            finish.wait()
+            return fake_response(request)
+
+        self.send.side_effect = slow_send
+        thread = threading.Thread(target=session.get,
+                                  args=['http://service/'])
+        thread.start()
+        sending.wait()
+
+        context.start()
+        try:
+            deadline.start(0.05)
+            with self.assertRaises(DeadlineExceeded):
+                session.get('http://service/')
+        finally:
+            context.end()
+            finish.set()
+            thread.join()
+        eq_(self.send.call_count, 1)
+        eq_(session.stats()['in_use'], 0)
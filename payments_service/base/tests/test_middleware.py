@@ -1,11 +1,14 @@
 from django.http import HttpResponse
 from django.test import RequestFactory
 
+import mock
 from nose.tools import eq_
 
 from payments_service.base.tests import TestCase
 
-from ..middleware import CORSMiddleware
+from .. import context, deadline
+from ..middleware import (BuyerVersionMiddleware, CORSMiddleware,
+                          DeadlineMiddleware, RequestContextMiddleware)
 
 
 class TestCORSMiddleware(TestCase):
@@ -41,3 +44,76 @@ class TestCORSMiddleware(TestCase):
         with self.settings(ENABLE_CORS_FOR_ORIGIN=None):
             new_res = CORSMiddleware().process_response(req, res)
             assert 'Access-Control-Allow-Origin' not in new_res
+
+
+class TestRequestContextMiddleware(TestCase):
+
+    def test_start_context(self):
+        RequestContextMiddleware().process_request(RequestFactory().get('/'))
+        self.addCleanup(context.end)
+        eq_(context.current(), {})
+
+    def test_end_context(self):
+        req = RequestFactory().get('/')
+        context.start()
+        RequestContextMiddleware().process_response(req, HttpResponse())
+        eq_(context.current(), None)
+
+    def test_end_without_context(self):
+        req = RequestFactory().get('/')
+        res = HttpResponse()
+        eq_(RequestContextMiddleware().process_response(req, res), res)
+
+
+class TestDeadlineMiddleware(TestCase):
+
+    def setUp(self):
+        super(TestDeadlineMiddleware, self).setUp()
+        context.start()
+        self.addCleanup(context.end)
+
+    def process_view(self, view_name=None):
+        req = RequestFactory().get('/')
+        req.resolver_match = mock.Mock(view_name=view_name)
+        DeadlineMiddleware().process_view(req, mock.Mock(), [], {})
+        return deadline.current()
+
+    def test_default_deadline(self):
+        with self.settings(REQUEST_DEADLINE=5,
+                           REQUEST_DEADLINE_BY_ROUTE={}):
+            eq_(self.process_view('auth:sign-in').seconds, 5)
+
+    def test_route_deadline(self):
+        with self.settings(REQUEST_DEADLINE=5,
+                           REQUEST_DEADLINE_BY_ROUTE={'auth:sign-in': 2}):
+            eq_(self.process_view('auth:sign-in').seconds, 2)
+
+    def test_disabled(self):
+        with self.settings(REQUEST_DEADLINE=None,
+                           REQUEST_DEADLINE_BY_ROUTE={}):
+            eq_(self.process_view('auth:sign-in'), None)
+
+
+class TestBuyerVersionMiddleware(TestCase):
+
+    def process_response(self, method='post', buyer=None):
+        req = getattr(RequestFactory(), method)('/')
+        req.session = {}
+        if buyer:
+            req.session['buyer'] = buyer
+        res = HttpResponse()
+        with mock.patch('payments_service.base.middleware.etags') as etags:
+            eq_(BuyerVersionMiddleware().process_response(req, res), res)
+        return etags.bump_buyer_version
+
+    def test_bump_after_write(self):
+        bump = self.process_response(buyer={'uuid': 'buyer-uuid', 'pk': 1})
+        bump.assert_called_with('buyer-uuid')
+
+    def test_ignore_reads(self):
+        bump = self.process_response(method='get',
+                                     buyer={'uuid': 'buyer-uuid', 'pk': 1})
+        assert not bump.called
+
+    def test_ignore_anonymous_writes(self):
+        assert not self.process_response().called
@@ -0,0 +1,126 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import mock
+from nose.tools import eq_, raises
+
+from payments_service.base.sqlite_queue import QueueFull, SQLiteQueue
+
+
+class TestSQLiteQueue(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'queue.db')
+        self.queue = SQLiteQueue(self.path, lease=30)
+
+        p = mock.patch('payments_service.base.sqlite_queue.time')
+        self.time = p.start()
+        self.time.time.return_value = 1000
+        self.addCleanup(p.stop)
+
+    def test_empty(self):
+        eq_(self.queue.claim(), None)
+        eq_(self.queue.depth(), 0)
+        eq_(self.queue.lag(), 0)
+
+    def test_put_and_claim(self):
+        self.queue.put({'bt_payload': 'p'})
+        item = self.queue.claim()
+        eq_(item.data, {'bt_payload': 'p'})
+        eq_(item.created, 1000)
+        eq_(item.attempts, 1)
+
+    def test_first_in_first_out(self):
+        self.queue.put(1)
+        self.queue.put(2)
+        eq_(self.queue.claim().data, 1)
+        eq_(self.queue.claim().data, 2)
+        eq_(self.queue.claim(), None)
+
+    def test_done(self):
+        self.queue.put(1)
+        self.queue.done(self.queue.claim().id)
+        eq_(self.queue.depth(), 0)
+        self.time.time.return_value = 2000
+        eq_(self.queue.claim(), None)
+
+    def test_lease_expires(self):
+        self.queue.put(1)
+        first = self.queue.claim()
+        self.time.time.return_value = 1029
+        eq_(self.queue.claim(), None)
+        self.time.time.return_value = 1030
+        second = self.queue.claim()
+        eq_(second.id, first.id)
+        eq_(second.attempts, 2)
+
+    def test_retry(self):
+        self.queue.put(1)
+        self.queue.retry(self.queue.claim().id, 5)
+        self.time.time.return_value = 1004
+        eq_(self.queue.claim(), None)
+        self.time.time.return_value = 1005
+        eq_(self.queue.claim().data, 1)
+
+    def test_fail(self):
+        self.queue.put(1)
+        self.queue.fail(self.queue.claim().id, 'ValueError')
+        eq_(self.queue.depth(), 0)
+        eq_(self.queue.failed_depth(), 1)
+        self.time.time.return_value = 2000
+        eq_(self.queue.claim(), None)
+
+    def test_depth_and_lag(self):
+        self.queue.put(1)
+        self.time.time.return_value = 1010
+        self.queue.put(2)
+        self.queue.claim()
+        self.time.time.return_value = 1015
+        eq_(self.queue.depth(), 2)
+        eq_(self.queue.lag(), 15)
+
+    def test_durable(self):
+        self.queue.put(1)
+        eq_(SQLiteQueue(self.path).claim().data, 1)
+
+    @raises(QueueFull)
+    def test_full(self):
+        queue = SQLiteQueue(self.path, max_depth=2)
+        queue.put(1)
+        queue.put(2)
+        queue.put(3)
+
+    def test_room_after_done(self):
+        queue = SQLiteQueue(self.path, max_depth=1)
+        queue.put(1)
+        queue.done(queue.claim().id)
+        queue.put(2)
+        eq_(queue.depth(), 1)
+
+    def test_save_state(self):
+        self.queue.put(1)
+        item = self.queue.claim()
+        eq_(item.state, None)
+        self.queue.save_state(item.id, {'verified': True})
+        self.queue.retry(item.id, 0)
+        eq_(self.queue.claim().state, {'verified': True})
+
+    def test_add_state_to_old_file(self):
+        path = self.path + '.old'
+        conn = sqlite3.connect(path)
+        conn.execute(
+            'CREATE TABLE items (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'data TEXT NOT NULL, created REAL NOT NULL, '
+            'available REAL NOT NULL, attempts INTEGER NOT NULL)')
+        conn.execute('INSERT INTO items (data, created, available, attempts) '
+                     'VALUES (?, 0, 0, 0)', ('1',))
+        conn.commit()
+        conn.close()
+        item = SQLiteQueue(path).claim()
+        eq_(item.data, 1)
+        eq_(item.state, None)
@@ -4,8 +4,11 @@ from mock import Mock
 from nose.tools import eq_
 from slumber.exceptions import HttpServerError
 
-from . import TestCase
-from ..views import composed_view, error_404, error_500
+from . import TestCase, WithDynamicEndpoints
+from ..breaker import CircuitOpen
+from ..deadline import DeadlineExceeded
+from ..views import (composed_view, error_404, error_500, error_503,
+                     UnprotectedAPIView)
 
 
 class TestErrorHandlers(TestCase):
@@ -46,6 +49,40 @@ class TestErrorHandlers(TestCase):
         res, data = self.json(error_500(self.request, response=response))
         eq_(data['error_response'], response)
 
+    def test_503(self):
+        res, data = self.json(error_503(self.request, retry_after=5))
+        eq_(res.status_code, 503, res)
+        eq_(data['error_message'], 'Service Unavailable')
+        eq_(res['Retry-After'], '5')
+
+
+class TestExceptionHandler(WithDynamicEndpoints, TestCase):
+
+    def test_circuit_open(self):
+
+        class Unavailable(UnprotectedAPIView):
+
+            def get(self, request):
+                raise CircuitOpen('solitude', 7)
+
+        self.endpoint(Unavailable)
+        res, data = self.json(self.client.get('/dynamic-endpoint'))
+        eq_(res.status_code, 503, res)
+        eq_(res['Retry-After'], '7')
+        eq_(data['error_message'], 'Service Unavailable')
+
+    def test_deadline_exceeded(self):
+
+        class TooSlow(UnprotectedAPIView):
+
+            def get(self, request):
+                raise DeadlineExceeded('solitude GET skipped')
+
+        self.endpoint(TooSlow)
+        res, data = self.json(self.client.get('/dynamic-endpoint'))
+        eq_(res.status_code, 504, res)
+        eq_(data['error_message'], 'Gateway Timeout')
+
 
 class TestComposedView(TestCase):
 
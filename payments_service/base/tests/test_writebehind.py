@@ -0,0 +1,132 @@
+import threading
+import unittest
+
+import mock
+from nose.tools import eq_
+from slumber.exceptions import HttpClientError
+
+from .. import writebehind
+from ..concurrency import ProcessSingleton
+from ..writebehind import WriteBehindQueue
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+
+    def setUp(self):
+        # Patch the module rather than time.sleep() itself, which other
+        # threads (such as the thread pool's) use too.
+        p = mock.patch('payments_service.base.writebehind.time')
+        self.sleep = p.start().sleep
+        self.addCleanup(p.stop)
+
+    def test_write_in_background(self):
+        queue = WriteBehindQueue('test')
+        threads = []
+        queue.put('write', lambda: threads.append(threading.current_thread()))
+        queue.drain()
+        eq_(len(threads), 1)
+        assert threads[0] is not threading.current_thread()
+
+    def test_keep_order(self):
+        queue = WriteBehindQueue('test')
+        written = []
+        for i in range(5):
+            queue.put('write', lambda i=i: written.append(i))
+        queue.drain()
+        eq_(written, range(5))
+
+    def test_retry(self):
+        queue = WriteBehindQueue('test', retries=2, backoff=1)
+        write = mock.Mock(side_effect=[ValueError, ValueError, None])
+        queue.put('write', write)
+        queue.drain()
+        eq_(write.call_count, 3)
+        eq_([call[0][0] for call in self.sleep.call_args_list], [1, 2])
+
+    def test_give_up(self):
+        queue = WriteBehindQueue('test', retries=1)
+        write = mock.Mock(side_effect=ValueError)
+        queue.put('write', write)
+        queue.put('next write', lambda: None)
+        queue.drain()
+        eq_(write.call_count, 2)
+
+    def test_do_not_retry_client_errors(self):
+        queue = WriteBehindQueue('test', retries=3)
+        write = mock.Mock(side_effect=HttpClientError)
+        queue.put('write', write)
+        queue.drain()
+        eq_(write.call_count, 1)
+
+    def test_write_now_when_full(self):
+        queue = WriteBehindQueue('test', maxsize=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_write():
+            started.set()
+            release.wait(5)
+
+        queue.put('blocking write', blocking_write)
+        started.wait(5)
+        queue.put('queued write', lambda: None)
+        threads = []
+        queue.put('write', lambda: threads.append(threading.current_thread()))
+        eq_(threads, [threading.current_thread()])
+        release.set()
+        queue.drain()
+
+
+class TestQueue(unittest.TestCase):
+
+    def test_share_one_queue(self):
+        eq_(writebehind.queue(), writebehind.queue())
+
+    def test_put(self):
+        write = mock.Mock()
+        writebehind.put('write', write)
+        writebehind.drain()
+        assert write.called
+
+
+class TestFlush(unittest.TestCase):
+
+    def test_wait_for_writes(self):
+        queue = WriteBehindQueue('test')
+        written = []
+        queue.put('write', lambda: written.append(1))
+        eq_(queue.flush(5), 0)
+        eq_(written, [1])
+
+    def test_give_up_after_timeout(self):
+        queue = WriteBehindQueue('test')
+        release = threading.Event()
+        queue.put('slow write', release.wait)
+        queue.put('write', lambda: None)
+        try:
+            eq_(queue.flush(0.01), 2)
+        finally:
+            release.set()
+        eq_(queue.flush(5), 0)
+
+    @mock.patch('payments_service.base.writebehind._queue')
+    def test_flush_at_exit(self, singleton):
+        queue = singleton.peek.return_value
+        queue.flush.return_value = 0
+        with mock.patch('payments_service.base.writebehind.settings') as s:
+            s.WRITE_BEHIND_SHUTDOWN_TIMEOUT = 7
+            writebehind.flush()
+        queue.flush.assert_called_with(7)
+
+    @mock.patch('payments_service.base.writebehind._queue')
+    def test_flush_without_queue(self, singleton):
+        singleton.peek.return_value = None
+        writebehind.flush()
+        assert not singleton.get.called
+
+    @mock.patch('payments_service.base.writebehind.atexit')
+    def test_register_flush(self, atexit):
+        with mock.patch('payments_service.base.writebehind._queue',
+                        ProcessSingleton(writebehind._start_queue)):
+            writebehind.queue()
+        atexit.register.assert_called_with(writebehind.flush)
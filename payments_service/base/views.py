@@ -4,6 +4,10 @@ from django.http import HttpResponseNotAllowed, JsonResponse
 
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from .breaker import CircuitOpen
+from .deadline import DeadlineExceeded
 
 log = logging.getLogger(__name__)
 
@@ -63,6 +67,32 @@ def error_500(request=None, **kw):
     return error_response(message='Internal Error', status=500, **kw)
 
 
+def error_503(request=None, retry_after=None, **kw):
+    response = error_response(message='Service Unavailable', status=503,
+                              **kw)
+    if retry_after:
+        response['Retry-After'] = str(retry_after)
+    return response
+
+
+def error_504(request=None, **kw):
+    return error_response(message='Gateway Timeout', status=504, **kw)
+
+
+def exception_handler(exc, context):
+    """
+    DRF exception handler that also turns unavailable dependencies
+    into a 503 and exceeded deadlines into a 504.
+    """
+    if isinstance(exc, CircuitOpen):
+        log.warning('failing fast: {}'.format(exc))
+        return error_503(response=str(exc), retry_after=exc.retry_after)
+    if isinstance(exc, DeadlineExceeded):
+        log.warning('failing fast: {}'.format(exc))
+        return error_504(response=str(exc))
+    return drf_exception_handler(exc, context)
+
+
 def error_response(message='Unknown error', status=500, response=None,
                    exception=None):
     if not response and getattr(exception, 'content', None):
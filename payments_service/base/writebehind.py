@@ -0,0 +1,160 @@
+import atexit
+import logging
+import Queue
+import threading
+import time
+
+from django.conf import settings
+
+from django_statsd.clients import statsd
+from slumber.exceptions import HttpClientError
+
+from .concurrency import ProcessSingleton
+
+log = logging.getLogger(__name__)
+
+
+def _start_queue():
+    q = WriteBehindQueue('write_behind', maxsize=settings.WRITE_BEHIND_MAXSIZE,
+                         retries=settings.WRITE_BEHIND_RETRIES,
+                         backoff=settings.WRITE_BEHIND_BACKOFF)
+    atexit.register(flush)
+    return q
+
+
+_queue = ProcessSingleton(_start_queue)
+
+
+def queue():
+    """
+    Returns the write-behind queue for this process.
+    """
+    return _queue.get()
+
+
+def put(description, func):
+    """
+    Calls func() soon, outside of the current request. See
+    WriteBehindQueue.put().
+    """
+    queue().put(description, func)
+
+
+def drain():
+    """
+    Waits until every queued write has been made or given up on.
+    """
+    q = _queue.peek()
+    if q is not None:
+        q.drain()
+
+
+def flush():
+    """
+    Waits up to settings.WRITE_BEHIND_SHUTDOWN_TIMEOUT seconds for queued
+    writes to be made. This runs when the process exits.
+    """
+    q = _queue.peek()
+    if q is None:
+        return
+    left = q.flush(settings.WRITE_BEHIND_SHUTDOWN_TIMEOUT)
+    if left:
+        log.error('{}: exiting with {} writes not made'
+                  .format(q.name, left))
+        statsd.incr('{}.lost'.format(q.name), left)
+
+
+class WriteBehindQueue(object):
+    """
+    Makes writes that a response doesn't have to wait for on a background
+    thread.
+
+    A write that fails is tried again up to `retries` more times, waiting
+    `backoff` seconds before the first retry and twice as long before each
+    next one. Client errors (4xx) are never retried since they would fail
+    again. Writes are kept in memory, so writes that are still queued when
+    the process exits are lost; see flush().
+    """
+
+    def __init__(self, name, maxsize=1000, retries=3, backoff=1):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = Queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self, description, func):
+        """
+        Queues func() to be called on the background thread.
+
+        If the queue is full, func() is called right away instead.
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((description, func))
+        except Queue.Full:
+            log.warning('{}: queue is full, writing {} now'
+                        .format(self.name, description))
+            statsd.incr('{}.full'.format(self.name))
+            self._write(description, func)
+            return
+        statsd.incr('{}.queued'.format(self.name))
+
+    def drain(self):
+        self._queue.join()
+
+    def flush(self, timeout):
+        """
+        Like drain() but waits at most timeout seconds. Returns the number
+        of writes that were not made yet.
+        """
+        done = self._queue.all_tasks_done
+        give_up_at = time.time() + timeout
+        with done:
+            while self._queue.unfinished_tasks:
+                remaining = give_up_at - time.time()
+                if remaining <= 0:
+                    break
+                done.wait(remaining)
+            return self._queue.unfinished_tasks
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work,
+                                                name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            description, func = self._queue.get()
+            try:
+                self._write(description, func)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, description, func):
+        for attempt in range(self.retries + 1):
+            try:
+                func()
+            except HttpClientError:
+                log.exception('{}: {} was rejected'
+                              .format(self.name, description))
+                statsd.incr('{}.failed'.format(self.name))
+                return
+            except Exception:
+                if attempt == self.retries:
+                    log.exception('{}: giving up on {} after {} attempts'
+                                  .format(self.name, description,
+                                          attempt + 1))
+                    statsd.incr('{}.failed'.format(self.name))
+                    return
+                log.warning('{}: {} failed, retrying'
+                            .format(self.name, description), exc_info=True)
+                statsd.incr('{}.retried'.format(self.name))
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                statsd.incr('{}.written'.format(self.name))
+                return
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class BraintreeApp(AppConfig):
+    name = 'payments_service.braintree'
+
+    def ready(self):
+        from .products import catalog
+        catalog.build()
+
+        if settings.PREMAIL_TEMPLATES and settings.PREMAIL_AT_STARTUP:
+            from .emails import compile_all
+            compile_all()
@@ -0,0 +1,591 @@
+import glob
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import traceback
+from urlparse import urljoin
+
+from django.conf import settings
+from django.template import Context, Engine, engines
+from django.template.loader import get_template
+from django.utils.html import escape
+
+from django_statsd.clients import statsd
+from lxml import etree
+from premailer import Premailer
+from premailer.merge_style import csstext_to_pairs, merge_styles
+
+from ..base.concurrency import ProcessSingleton
+
+log = logging.getLogger(__name__)
+
+# Kinds of email that are sent as premailed HTML.
+PREMAILED_KINDS = (
+    'subscription_canceled',
+    'subscription_charged_successfully',
+    'subscription_charged_unsuccessfully',
+)
+
+# Variables that Webhook.build_context() puts in the context of an email.
+CONTEXT_NAMES = (
+    'bill_end', 'bill_start', 'cc_truncated_id', 'cc_type', 'date', 'kind',
+    'management_url', 'moz_trans', 'next_pay_date', 'product',
+    'recurring_amount', 'root_url', 'seller', 'transaction',
+)
+
+# Template tags that a premailed template may use.
+COMPILED_TAGS = ('extends', 'block', 'endblock')
+
+# Filters that may be applied to CONTEXT_NAMES variables in a premailed
+# template. They turn text into text, which premailing leaves alone.
+COMPILED_FILTERS = ('capfirst', 'lower', 'title', 'upper')
+
+# A value that verify_compiled() renders for every variable, with the
+# characters that premailing escapes. It is also used in CSS URLs, so it
+# must be a valid one.
+SAMPLE_VALUE = u'https://example.com/caf\xe9.png?a=<b>&c=\u2019%20d'
+
+# Compiled templates, keyed by kind.
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+# A variable in a template.
+_variable = re.compile(r'\{\{(.*?)\}\}')
+# A block tag in a template.
+_tag = re.compile(r'\{%\s*(\w+)')
+# A variable in a premailed template.
+_marker = re.compile(r'premailvar(?P<index>\d+)x')
+# An element of a premailed template whose attributes use variables.
+_element = re.compile(r'<(?P<tag>\w+) premailelement="(?P<index>\d+)"')
+# The first line of a template written by write_compiled().
+_header = re.compile(
+    r'\{# premailed from templates with sha1 (?P<sha1>\w+) #\}')
+# Template syntax that premailed HTML must not be read as.
+_template_syntax = re.compile(r'\{\{|\}\}|\{%|%\}|\{#|#\}')
+_template_tags = {
+    '{{': '{% templatetag openvariable %}',
+    '}}': '{% templatetag closevariable %}',
+    '{%': '{% templatetag openblock %}',
+    '%}': '{% templatetag closeblock %}',
+    '{#': '{% templatetag opencomment %}',
+    '#}': '{% templatetag closecomment %}',
+}
+
+
+def premailer(html):
+    return Premailer(
+        html=html,
+        preserve_internal_links=True,
+        exclude_pseudoclasses=False,
+        keep_style_tags=False,
+        include_star_selectors=True,
+        remove_classes=False,
+        strip_important=False,
+        method='html',
+        base_path=settings.EMAIL_URL_ROOT,
+        base_url=settings.EMAIL_URL_ROOT,
+        disable_basic_attributes=[],
+        disable_validation=True
+    )
+
+
+def premail(source):
+    """
+    Moves the CSS of an HTML email into style attributes.
+    """
+    return premailer(source).transform(pretty_print=True)
+
+
+def premail_attributes(tag, source):
+    """
+    Returns the attributes in source, the rendered attributes of a tag
+    element, as premailing would write them.
+
+    The first attribute is premailed-style if any of the CSS applies to
+    the element. It is the style that premailing gave the element without
+    its own style attribute. See compile_template().
+    """
+    p = premailer(None)
+    element = parse_element(u'<{}{}>'.format(tag, source), tag)
+    style = element.attrib.pop('premailed-style', None)
+    if style is not None:
+        style = merge_styles(element.get('style', ''),
+                             [csstext_to_pairs(style)], [''])
+        element.set('style', style)
+        p._style_to_basic_html_attributes(element, style, force=True)
+    for name in ('href', 'src'):
+        url = element.get(name)
+        if (url is None or
+                name == 'href' and p.preserve_internal_links and
+                url.startswith('#') or
+                name == 'src' and p.preserve_inline_attachments and
+                url.startswith('cid:')):
+            continue
+        element.set(name, urljoin(p.base_url, url))
+
+    start = len(u'<' + tag)
+    end = len(serialize(parse_element(u'<{}>'.format(tag), tag))) - start
+    return serialize(element)[start:-end]
+
+
+def parse_element(html, tag):
+    """
+    Returns the first tag element in html, parsed the way premailing
+    parses it. lxml writes some characters in elements that it parsed
+    differently from elements that it made itself.
+    """
+    return next(etree.fromstring(html, etree.HTMLParser()).iter(tag))
+
+
+def serialize(element):
+    return etree.tostring(element, method='html', encoding='utf-8',
+                          with_tail=False).decode('utf8')
+
+
+def template_sources():
+    """
+    Returns the source of each braintree/emails/*.html template, keyed by
+    its template name.
+    """
+    sources = {}
+    directory = os.path.join(os.path.dirname(__file__), 'templates')
+    for path in glob.glob(os.path.join(directory, 'braintree', 'emails',
+                                       '*.html')):
+        with open(path) as f:
+            sources[os.path.relpath(path, directory)] = (
+                f.read().decode('utf8'))
+    return sources
+
+
+def sources_sha1(sources):
+    sha1 = hashlib.sha1()
+    for name, source in sorted(sources.items()):
+        sha1.update(u'{}\0{}\0'.format(name, source).encode('utf8'))
+    return sha1.hexdigest()
+
+
+def compile_template(kind):
+    """
+    Returns the source of a template that renders the same HTML as
+    premailing the braintree/emails/{kind}.html template.
+
+    Each variable from CONTEXT_NAMES is swapped for a marker and the
+    template is rendered and premailed once. Markers in text are then
+    swapped back for the variables, with a filter that escapes values the
+    way premailing does (see templatetags/premailed.py).
+
+    A variable in an attribute can change more than its own text: cssutils
+    reads the style attribute, lxml picks the quotes for the whole value
+    and URLs are joined to settings.EMAIL_URL_ROOT. So the attributes of
+    an element that use variables are kept as they are in the template and
+    premailed for each email by premail_attributes(), with the style that
+    the CSS gave the element.
+
+    The kind variable is rendered into the result since it always matches
+    the template; other variables render as they would in an email. The
+    result starts with a comment with the sources_sha1() of the templates
+    it was compiled from.
+
+    Raises CompileError if the templates use tags other than
+    COMPILED_TAGS or filters other than COMPILED_FILTERS on CONTEXT_NAMES
+    variables, since the result could then differ from premailing.
+    """
+    expressions = []
+
+    def mark(match):
+        expression = match.group(1).strip()
+        name = re.split(r'[.|]', expression)[0].strip()
+        if name not in CONTEXT_NAMES or name == 'kind':
+            return match.group(0)
+        for applied in expression.split('|')[1:]:
+            applied = applied.split(':')[0].strip()
+            if applied not in COMPILED_FILTERS:
+                raise CompileError('cannot premail {} once: the {} filter '
+                                   'is applied to {}'
+                                   .format(kind, applied, name))
+        expressions.append(expression)
+        return u'premailvar{}x'.format(len(expressions) - 1)
+
+    sources = template_sources()
+    marked = {}
+    for name, source in sources.items():
+        for tag in _tag.findall(source):
+            if tag not in COMPILED_TAGS:
+                raise CompileError('cannot premail {} once: {} uses the {} '
+                                   'tag'.format(kind, name, tag))
+        marked[name] = _variable.sub(mark, source)
+    engine = Engine(loaders=[('django.template.loaders.locmem.Loader',
+                              marked)])
+    template = engine.get_template('braintree/emails/{}.html'.format(kind))
+    html = template.render(Context({'kind': kind})).strip()
+
+    # Premail the tree that premail() would, with the elements that have
+    # variables in their attributes marked and without their own style.
+    tree = etree.fromstring(html, etree.HTMLParser()).getroottree()
+    page = tree.getroot()
+    root = tree if html.startswith(tree.docinfo.doctype) else page
+    attributes = []
+    for element in page.iter(tag=etree.Element):
+        if any(_marker.search(value) for value in element.attrib.values()):
+            attributes.append(element.attrib.items())
+            element.attrib.pop('style', None)
+            element.set('premailelement', str(len(attributes) - 1))
+    premailer(page).transform()
+    styles = []
+    for element in page.iter(tag=etree.Element):
+        index = element.get('premailelement')
+        if index is None:
+            continue
+        style = element.get('style')
+        if style is not None and '{' in style:
+            raise CompileError('cannot premail {} once: a <{}> with '
+                               'variables has pseudo-class styles'
+                               .format(kind, element.tag))
+        styles.append(style)
+        element.attrib.clear()
+        element.set('premailelement', index)
+    html = etree.tostring(root, method='html', pretty_print=True,
+                          encoding='utf-8').decode('utf8')
+
+    def template_text(text):
+        return _template_syntax.sub(lambda m: _template_tags[m.group(0)],
+                                    text)
+
+    def premailed_attributes(match):
+        index = int(match.group('index'))
+        items = attributes[index]
+        if styles[index] is not None:
+            items = [('premailed-style', styles[index])] + items
+        source = u''
+        for name, value in items:
+            value = _marker.sub(
+                lambda m: u'{{{{ {} }}}}'.format(expressions[int(m.group(1))]),
+                template_text(escape(value)))
+            source += u' {}="{}"'.format(name, value)
+        return (u'<{tag}{{% premailed_attributes "{tag}" %}}{source}'
+                u'{{% endpremailed_attributes %}}'
+                .format(tag=match.group('tag'), source=source))
+
+    def unmark(match):
+        expression = expressions[int(match.group('index'))]
+        return u'{{{{ {}|premailed_text }}}}'.format(expression)
+
+    source = _element.sub(premailed_attributes, template_text(html))
+    return (u'{{# premailed from templates with sha1 {} #}}'
+            .format(sources_sha1(sources)) +
+            u'{% load premailed %}' + _marker.sub(unmark, source))
+
+
+class Sample(unicode):
+    """
+    A value, SAMPLE_VALUE by default, with the same value for any
+    attribute too.
+    """
+
+    def __new__(cls, value=SAMPLE_VALUE):
+        return super(Sample, cls).__new__(cls, value)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return Sample(self)
+
+
+def verify_compiled(kind, source):
+    """
+    Checks that source, from compile_template(kind), renders the same HTML
+    as premailing the template with the CSS at settings.EMAIL_URL_ROOT.
+
+    Every variable is set to SAMPLE_VALUE. Raises CompileError if the HTML
+    differs.
+    """
+    data = dict((name, Sample()) for name in CONTEXT_NAMES)
+    data['kind'] = kind
+    compiled = engines['django'].from_string(source).render(Context(data))
+    template = get_template('braintree/emails/{}.html'.format(kind))
+    if compiled != premail(template.render(Context(data))):
+        raise CompileError('premailing {} once does not render the same '
+                           'HTML as premailing each email'.format(kind))
+
+
+def compiled_path(kind, directory=None):
+    return os.path.join(directory or settings.PREMAILED_EMAIL_DIR,
+                        '{}.html'.format(kind))
+
+
+def write_compiled(directory=None):
+    """
+    Compiles every premailed template into a file in directory, which
+    defaults to settings.PREMAILED_EMAIL_DIR. Returns the paths written.
+
+    Each template is checked with verify_compiled() before it is written.
+    """
+    directory = directory or settings.PREMAILED_EMAIL_DIR
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    paths = []
+    for kind in PREMAILED_KINDS:
+        source = compile_template(kind)
+        verify_compiled(kind, source)
+        path = compiled_path(kind, directory)
+        with open(path, 'w') as f:
+            f.write(source.encode('utf8'))
+        log.info('wrote premailed {} email to {}'.format(kind, path))
+        paths.append(path)
+    return paths
+
+
+def premailed_template(kind):
+    """
+    Returns a template that renders premailed HTML for the
+    braintree/emails/{kind}.html template.
+
+    The template is read from settings.PREMAILED_EMAIL_DIR if the premail
+    command wrote it there from the templates as they are now. Otherwise
+    it is compiled on first use. Returns None if it can't be compiled; the
+    caller should premail the rendered HTML itself.
+    """
+    template = _compiled.get(kind)
+    if template is not None:
+        return template
+
+    with _compiled_lock:
+        template = _compiled.get(kind)
+        if template is not None:
+            return template
+        path = compiled_path(kind)
+        try:
+            source = None
+            if os.path.exists(path):
+                with open(path) as f:
+                    source = f.read().decode('utf8')
+                header = _header.match(source)
+                if (header and header.group('sha1') ==
+                        sources_sha1(template_sources())):
+                    log.info('using premailed {} email from {}'
+                             .format(kind, path))
+                else:
+                    log.warning('premailed {} email in {} is out of date; '
+                                'run the premail command'.format(kind, path))
+                    source = None
+            if source is None:
+                log.info('premailing {} email template'.format(kind))
+                source = compile_template(kind)
+            template = engines['django'].from_string(source)
+        except Exception:
+            log.exception('could not compile premailed {} email; premailing '
+                          'each email instead'.format(kind))
+            return None
+        _compiled[kind] = template
+        return template
+
+
+def compile_all():
+    """
+    Compiles every premailed template ahead of the first email.
+    """
+    for kind in PREMAILED_KINDS:
+        premailed_template(kind)
+
+
+def reset_compiled():
+    with _compiled_lock:
+        _compiled.clear()
+
+
+def render_text(kind, data):
+    template = get_template('braintree/emails/{}.txt'.format(kind))
+    return template.render(Context(data))
+
+
+def render_html(kind, data, premailed=True):
+    if premailed and settings.PREMAIL_TEMPLATES:
+        template = premailed_template(kind)
+        if template is not None:
+            return template.render(Context(data))
+
+    template = get_template('braintree/emails/{}.html'.format(kind))
+    response = template.render(Context(data))
+    if premailed:
+        response = premail(response)
+    return response
+
+
+def render(kind, data):
+    """
+    Returns the text and premailed HTML of an email.
+    """
+    return render_text(kind, data), render_html(kind, data)
+
+
+class RenderPool(object):
+    """
+    Processes that render email, how many more renders they can queue and
+    how many renders timed out without finishing since.
+    """
+
+    def __init__(self):
+        log.info('starting {} email rendering processes'
+                 .format(settings.EMAIL_RENDER_PROCESSES))
+        self.slots = threading.BoundedSemaphore(
+            settings.EMAIL_RENDER_QUEUE_SIZE)
+        self.abandoned = 0
+        self.lock = threading.Lock()
+        self.processes = multiprocessing.Pool(
+            settings.EMAIL_RENDER_PROCESSES,
+            initializer=_start_render_process)
+
+    def terminate(self):
+        self.processes.terminate()
+
+
+_pool = ProcessSingleton(RenderPool, close=lambda pool: pool.terminate())
+
+
+def render_pool():
+    """
+    Returns the RenderPool that renders email for this process.
+
+    The pool is started on first use, or by the process_webhooks command
+    before it starts any threads, since forking while another thread holds
+    a lock leaves the lock held in the new process. A process forked from
+    the one that started it starts its own.
+    """
+    return _pool.get()
+
+
+def reset_render_pool():
+    _pool.reset()
+
+
+def render_in_pool(kind, data):
+    """
+    Like render() but when settings.EMAIL_RENDER_POOL is enabled, the
+    email is rendered by one of the render_pool() processes so that
+    rendering several emails at the same time isn't held up by the GIL.
+
+    At most settings.EMAIL_RENDER_QUEUE_SIZE emails can wait for or be
+    rendered by the pool; beyond that, and when the pool does not render
+    an email within settings.EMAIL_RENDER_TIMEOUT seconds, the email is
+    rendered in this process.
+    """
+    if not settings.EMAIL_RENDER_POOL:
+        return render(kind, data)
+
+    pool = render_pool()
+    if not pool.slots.acquire(False):
+        log.warning('email render pool is full; rendering {} email here'
+                    .format(kind))
+        statsd.incr('email.render_pool.full')
+        return render(kind, data)
+
+    slot = _Slot(pool)
+    try:
+        pending = pool.processes.apply_async(
+            _render_in_process, (kind, data), callback=slot.finished)
+    except Exception:
+        slot.release()
+        raise
+    try:
+        error, result = pending.get(settings.EMAIL_RENDER_TIMEOUT)
+    except multiprocessing.TimeoutError:
+        log.warning('rendering {} email took more than {}s; rendering it '
+                    'here'.format(kind, settings.EMAIL_RENDER_TIMEOUT))
+        statsd.incr('email.render_pool.timeout')
+        slot.abandon()
+        return render(kind, data)
+    if error:
+        raise RenderError(result)
+    statsd.incr('email.render_pool.rendered')
+    return result
+
+
+class _Slot(object):
+    """
+    The place in the pool's queue of one render. It is given back once,
+    when the render finishes or when it times out, whichever comes first.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        """
+        Gives back the slot. Returns False if it was already given back.
+        """
+        with self._lock:
+            if self._released:
+                return False
+            self._released = True
+        self.pool.slots.release()
+        return True
+
+    def finished(self, result):
+        # Called by the pool's result handler thread.
+        if not self.release():
+            # The render timed out but finished after all.
+            with self.pool.lock:
+                if self.pool.abandoned:
+                    self.pool.abandoned -= 1
+
+    def abandon(self):
+        """
+        Gives back the slot of a render that timed out.
+
+        A render that never finishes leaves a worker stuck, and when a
+        worker dies the pool starts another but never finishes the render.
+        Once as many renders as there are processes are left like that, the
+        pool is started again.
+        """
+        if not self.release():
+            return
+        with self.pool.lock:
+            self.pool.abandoned += 1
+            if self.pool.abandoned != settings.EMAIL_RENDER_PROCESSES:
+                return
+        log.error('{} email renders did not finish; restarting the email '
+                  'render pool'.format(settings.EMAIL_RENDER_PROCESSES))
+        statsd.incr('email.render_pool.restarted')
+        # Not while holding the pool's lock, which its result handler
+        # thread may be waiting for in finished().
+        _pool.reset(self.pool)
+        render_pool()
+
+
+class CompileError(Exception):
+    """
+    Raised when a template can't be premailed once for every email.
+    """
+
+
+class RenderError(Exception):
+    """
+    Raised when a render process fails to render an email.
+    """
+
+
+def _start_render_process():
+    global _compiled_lock
+    # Another thread may have held these locks when this process was
+    # forked, which would leave them held here forever.
+    _compiled_lock = threading.Lock()
+    logging._lock = threading.RLock()
+    for ref in logging._handlerList:
+        handler = ref()
+        if handler is not None:
+            handler.createLock()
+
+
+def _render_in_process(kind, data):
+    # Return errors rather than raising them so that the pool always calls
+    # the callback that frees up the slot.
+    try:
+        return False, render(kind, data)
+    except Exception:
+        return True, ''.join(traceback.format_exception(*sys.exc_info()))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments_service.braintree import emails
+
+
+class Command(BaseCommand):
+    help = ('Premail the HTML email templates so that emails can be sent '
+            'without premailing each one')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help='Directory to write templates to. Default: '
+                 'settings.PREMAILED_EMAIL_DIR')
+
+    def handle(self, *args, **options):
+        try:
+            paths = emails.write_compiled(options['output'])
+        except emails.CompileError, exc:
+            raise CommandError(str(exc))
+        for path in paths:
+            self.stdout.write('Wrote {}'.format(path))
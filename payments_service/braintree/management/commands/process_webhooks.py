@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments_service.braintree import emails, webhook_queue
+from payments_service.braintree.views.webhook import Webhook
+
+
+class Command(BaseCommand):
+    help = 'Process webhook notifications queued in settings.WEBHOOK_QUEUE'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.WEBHOOK_WORKERS,
+            help='Number of notifications to process at the same time')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1,
+            help='Seconds to wait before checking an empty queue again')
+        parser.add_argument(
+            '--until-empty', action='store_true', default=False,
+            help='Exit once there is nothing left to process')
+
+    def handle(self, *args, **options):
+        if not settings.WEBHOOK_QUEUE:
+            raise CommandError('settings.WEBHOOK_QUEUE is not set')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        if settings.EMAIL_RENDER_POOL:
+            # Fork the render processes before the workers start threads.
+            emails.render_pool()
+
+        webhook_queue.run_workers(
+            Webhook().process, options['workers'],
+            poll_interval=options['poll_interval'],
+            until_empty=options['until_empty'])
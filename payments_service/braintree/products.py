@@ -0,0 +1,78 @@
+import copy
+import logging
+import threading
+
+import payments_config
+from django_statsd.clients import statsd
+
+log = logging.getLogger(__name__)
+
+
+class ProductCatalog(object):
+    """
+    Index of the products in payments_config and their Solitude records.
+
+    Products are static and already loaded in-process, so once we know
+    which Solitude product a URI points to we never need to ask Solitude
+    again. The catalog maps the public_id of each configured product to
+    its config entry and remembers the Solitude record of each configured
+    product the first time it is fetched. URIs of products that are not
+    in the config are always fetched from Solitude.
+
+    The index is rebuilt whenever payments_config.products changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._products = None
+        self._product_ids = frozenset()
+        self._records = {}
+
+    def build(self):
+        """
+        Index the products currently in payments_config.
+        """
+        with self._lock:
+            self._products = payments_config.products
+            self._product_ids = frozenset(self._products.keys())
+            self._records = {}
+        log.info('indexed {} products from payments_config'
+                 .format(len(self._product_ids)))
+
+    def expand(self, uri, fetch):
+        """
+        Returns the Solitude product record at uri.
+
+        This is an expansion provider for SolitudeAPIView. The record is
+        only fetched from Solitude, with fetch(uri), if the product is
+        not in the catalog yet.
+        """
+        self._refresh()
+        record = self._records.get(uri)
+        if record:
+            statsd.incr('braintree.catalog.hit')
+        else:
+            statsd.incr('braintree.catalog.miss')
+            record = fetch(uri)
+            self._learn(uri, record)
+        # Callers may expand or otherwise change the record.
+        return copy.deepcopy(record)
+
+    def _learn(self, uri, record):
+        public_id = (record or {}).get('public_id')
+        if public_id not in self._product_ids:
+            log.info('not indexing product {} at {}; it is not in '
+                     'payments_config'.format(public_id, uri))
+            return
+        with self._lock:
+            self._records[uri] = copy.deepcopy(record)
+
+    def _refresh(self):
+        products = payments_config.products
+        if (products is not self._products or
+                len(products) != len(self._product_ids)):
+            log.info('payments_config products changed; rebuilding index')
+            self.build()
+
+
+catalog = ProductCatalog()
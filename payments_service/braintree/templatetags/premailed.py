@@ -0,0 +1,46 @@
+from django import template
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from payments_service.braintree.emails import (
+    parse_element, premail_attributes, serialize)
+
+register = template.Library()
+
+# These tags render parts of a premailed template the way that premailing
+# a rendered template would. See emails.compile_template().
+
+
+@register.filter
+def premailed_text(value):
+    element = parse_element(
+        u'<p>{}</p>'.format(conditional_escape(value)), 'p')
+    return mark_safe(serialize(element)[len('<p>'):-len('</p>')])
+
+
+@register.tag
+def premailed_attributes(parser, token):
+    """
+    Premails the attributes of an element:
+
+        <img{% premailed_attributes "img" %} alt="{{ cc_type }}"
+        {% endpremailed_attributes %}>
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            '{} takes the name of the element'.format(bits[0]))
+    nodelist = parser.parse(('endpremailed_attributes',))
+    parser.delete_first_token()
+    return PremailedAttributesNode(bits[1][1:-1], nodelist)
+
+
+class PremailedAttributesNode(template.Node):
+
+    def __init__(self, tag, nodelist):
+        self.tag = tag
+        self.nodelist = nodelist
+
+    def render(self, context):
+        return mark_safe(premail_attributes(
+            self.tag, self.nodelist.render(context)))
@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from unittest import SkipTest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.template import Context, engines
+from django.template.loader import get_template
+from django.test import override_settings
+
+import mock
+from nose.tools import eq_, raises
+from premailer import Premailer
+
+from payments_service.base.tests import TestCase
+from payments_service.braintree import emails
+from payments_service.braintree.apps import BraintreeApp
+from payments_service.braintree.templatetags.premailed import premailed_text
+from payments_service.braintree.views.webhook import Webhook
+
+from .test_views.test_webhook import subscription_notice
+
+CSS = u'''
+#email { color: #333 }
+#logo { width: 40px }
+.header h1 { font-size: 2em; font-family: "{{ not a variable }}" }
+.footer-subscription_canceled p { color: blue }
+th { text-align: left }
+td { padding: 1px }
+@media (max-width: 600px) { .main { width: 100% } }
+'''
+
+# Values that premailing changes the HTML around.
+VALUES = (
+    u"a 'b'", u'a "b"', u'"  spaced  "', u'  a  ', u'a b(c)', u'&amp;',
+    u'a\nb', u'a\r\nb', u'<b>', u'/a/../b', u'#a',
+)
+
+
+class EmailTest(TestCase):
+
+    def setUp(self):
+        super(EmailTest, self).setUp()
+        p = mock.patch.object(Premailer, '_load_external', return_value=CSS)
+        self.load_css = p.start()
+        self.addCleanup(p.stop)
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.directory = os.path.join(tmp, 'premailed')
+        email_settings = override_settings(PREMAILED_EMAIL_DIR=self.directory)
+        email_settings.enable()
+        self.addCleanup(email_settings.disable)
+
+        emails.reset_compiled()
+        self.addCleanup(emails.reset_compiled)
+
+    def context(self, kind):
+        notice = subscription_notice('service-subscription', kind=kind)
+        product = mock.Mock(
+            description=u'Bob\'s <b>"stuff"</b> & co',
+            img=u'https://example.com/img/caf\xe9.png?size=64&fmt=png')
+        product.seller.name = u'Ann’s \xe9 shop'
+        product.seller.email = 'seller@example.com'
+        return Webhook().build_context(
+            notice['mozilla']['transaction']['braintree'],
+            notice['mozilla']['transaction']['generic'],
+            notice['mozilla']['paymethod'], product, kind)
+
+    def premailed(self, kind, data):
+        template = get_template('braintree/emails/{}.html'.format(kind))
+        return emails.premail(template.render(Context(data)))
+
+
+class TestCompileTemplate(EmailTest):
+
+    def test_same_as_premailing_each_email(self):
+        for kind in emails.PREMAILED_KINDS:
+            data = self.context(kind)
+            compiled = engines['django'].from_string(
+                emails.compile_template(kind))
+            eq_(compiled.render(Context(data)), self.premailed(kind, data))
+
+    def test_premail_once(self):
+        source = emails.compile_template('subscription_canceled')
+        eq_(self.load_css.call_count, 1)
+        assert 'font-size:2em' in source, source
+
+    def test_same_as_premailing_values(self):
+        for kind in emails.PREMAILED_KINDS:
+            compiled = engines['django'].from_string(
+                emails.compile_template(kind))
+            for value in VALUES:
+                data = dict((name, emails.Sample(value))
+                            for name in emails.CONTEXT_NAMES)
+                data['kind'] = kind
+                eq_(compiled.render(Context(data)),
+                    self.premailed(kind, data))
+
+    def test_variables(self):
+        source = emails.compile_template('subscription_canceled')
+        assert '{{ product.description|premailed_text }}' in source, source
+        assert ('<div{% premailed_attributes "div" %} '
+                'premailed-style="width:40px" id="logo" '
+                'style="background-image: url({{ product.img }});"'
+                '{% endpremailed_attributes %}>' in source), source
+        assert ('<img{% premailed_attributes "img" %} class="card" '
+                'alt="{{ cc_type|lower }}" src="/svg/{{ cc_type|lower }}.svg"'
+                ' width="40"{% endpremailed_attributes %}>' in source), source
+
+    def test_sha1(self):
+        source = emails.compile_template('subscription_canceled')
+        assert source.startswith(
+            '{{# premailed from templates with sha1 {} #}}'.format(
+                emails.sources_sha1(emails.template_sources()))), source
+
+    def test_css_is_not_a_variable(self):
+        data = self.context('subscription_canceled')
+        compiled = engines['django'].from_string(
+            emails.compile_template('subscription_canceled'))
+        assert '{{ not a variable }}' in compiled.render(Context(data))
+
+    def test_context_names(self):
+        for kind in emails.PREMAILED_KINDS:
+            eq_(sorted(self.context(kind)), sorted(emails.CONTEXT_NAMES))
+
+    def compile_source(self, source):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'subscription_canceled.html')
+        with open(path, 'w') as f:
+            f.write(source)
+        with mock.patch.object(emails.glob, 'glob', return_value=[path]), \
+                mock.patch.object(emails.os.path, 'relpath', return_value=(
+                    'braintree/emails/subscription_canceled.html')):
+            return emails.compile_template('subscription_canceled')
+
+    @raises(emails.CompileError)
+    def test_unsupported_tag(self):
+        self.compile_source('{% if product %}{{ product }}{% endif %}')
+
+    @raises(emails.CompileError)
+    def test_pseudo_class_styles(self):
+        self.load_css.return_value = '#logo:hover { color: red }'
+        emails.compile_template('subscription_canceled')
+
+    @raises(emails.CompileError)
+    def test_unsupported_filter(self):
+        self.compile_source('{{ product.description|safe }}')
+
+    def test_filter_on_other_variable(self):
+        # Other variables are rendered while compiling.
+        source = self.compile_source('<p>{{ EMAIL_URL_ROOT|safe }}</p>')
+        assert '<p></p>' in source, source
+
+    def test_verify(self):
+        for kind in emails.PREMAILED_KINDS:
+            emails.verify_compiled(kind, emails.compile_template(kind))
+
+    @raises(emails.CompileError)
+    def test_verify_different_html(self):
+        emails.verify_compiled('subscription_canceled', '<p>different</p>')
+
+
+class TestRealCSS(TestCompileTemplate):
+    """
+    Runs the TestCompileTemplate tests with the CSS that payments-ui
+    builds, when the EMAIL_CSS environment variable is the path to its
+    dist/email.css.
+    """
+
+    def setUp(self):
+        path = os.environ.get('EMAIL_CSS')
+        if not path:
+            raise SkipTest('EMAIL_CSS is not set')
+        super(TestRealCSS, self).setUp()
+        with open(path) as f:
+            self.load_css.return_value = f.read().decode('utf8')
+
+    def test_premail_once(self):
+        source = emails.compile_template('subscription_canceled')
+        eq_(self.load_css.call_count, 1)
+        assert 'style="' in source, source
+
+    def test_css_is_not_a_variable(self):
+        # Only the test CSS has a variable in it.
+        pass
+
+
+class TestPremailedTemplate(EmailTest):
+
+    def test_compile_once(self):
+        template = emails.premailed_template('subscription_canceled')
+        eq_(emails.premailed_template('subscription_canceled'), template)
+        eq_(self.load_css.call_count, 1)
+
+    def write(self, sha1, source):
+        os.makedirs(self.directory)
+        with open(emails.compiled_path('subscription_canceled'), 'w') as f:
+            f.write('{{# premailed from templates with sha1 {} #}}{}'
+                    .format(sha1, source))
+
+    def test_read_compiled_template(self):
+        self.write(emails.sources_sha1(emails.template_sources()),
+                   '{{ kind }} email')
+        template = emails.premailed_template('subscription_canceled')
+        eq_(template.render(Context({'kind': 'some'})), 'some email')
+        assert not self.load_css.called
+
+    def test_out_of_date_compiled_template(self):
+        self.write('0' * 40, '{{ kind }} email')
+        template = emails.premailed_template('subscription_canceled')
+        eq_(self.load_css.call_count, 1)
+        data = self.context('subscription_canceled')
+        eq_(template.render(Context(data)),
+            self.premailed('subscription_canceled', data))
+
+    def test_compiled_template_without_sha1(self):
+        os.makedirs(self.directory)
+        with open(emails.compiled_path('subscription_canceled'), 'w') as f:
+            f.write('{{ kind }} email')
+        template = emails.premailed_template('subscription_canceled')
+        assert template.render(Context({'kind': 'some'})) != 'some email'
+
+    def test_cannot_compile(self):
+        self.load_css.side_effect = IOError
+        eq_(emails.premailed_template('subscription_canceled'), None)
+
+    def test_write_compiled(self):
+        paths = emails.write_compiled()
+        eq_(sorted(os.listdir(self.directory)),
+            sorted('{}.html'.format(kind) for kind in emails.PREMAILED_KINDS))
+        eq_(len(paths), len(emails.PREMAILED_KINDS))
+
+        data = self.context('subscription_canceled')
+        template = emails.premailed_template('subscription_canceled')
+        eq_(template.render(Context(data)),
+            self.premailed('subscription_canceled', data))
+
+    def test_command(self):
+        output = os.path.join(self.directory, 'other')
+        call_command('premail', output=output, stdout=mock.Mock())
+        assert os.path.exists(
+            emails.compiled_path('subscription_canceled', output))
+
+    @raises(CommandError)
+    def test_command_checks_templates(self):
+        with mock.patch.object(emails, 'verify_compiled',
+                               side_effect=emails.CompileError):
+            call_command('premail', stdout=mock.Mock())
+
+    def test_compile_at_startup(self):
+        app = BraintreeApp('payments_service.braintree',
+                           __import__('payments_service.braintree'))
+        with self.settings(PREMAIL_AT_STARTUP=True):
+            app.ready()
+        eq_(len(emails._compiled), len(emails.PREMAILED_KINDS))
+
+    def test_do_not_compile_at_startup(self):
+        app = BraintreeApp('payments_service.braintree',
+                           __import__('payments_service.braintree'))
+        app.ready()
+        eq_(len(emails._compiled), 0)
+
+
+class TestRender(EmailTest):
+
+    def test_render_premailed_template(self):
+        data = self.context('subscription_canceled')
+        emails.premailed_template('subscription_canceled')
+        with mock.patch.object(emails, 'premail') as premail:
+            html = emails.render_html('subscription_canceled', data)
+        assert not premail.called
+        eq_(html, self.premailed('subscription_canceled', data))
+
+    @mock.patch('payments_service.braintree.emails.premailed_template')
+    def test_fall_back_to_premailing(self, premailed_template):
+        premailed_template.return_value = None
+        data = self.context('subscription_canceled')
+        eq_(emails.render_html('subscription_canceled', data),
+            self.premailed('subscription_canceled', data))
+
+    @mock.patch('payments_service.braintree.emails.premailed_template')
+    def test_disabled(self, premailed_template):
+        data = self.context('subscription_canceled')
+        with self.settings(PREMAIL_TEMPLATES=False):
+            emails.render_html('subscription_canceled', data)
+        assert not premailed_template.called
+
+    def test_not_premailed(self):
+        data = self.context('subscription_canceled')
+        html = emails.render_html('subscription_canceled', data,
+                                  premailed=False)
+        assert 'email.css' in html, html
+
+    def test_render(self):
+        text, html = emails.render('subscription_canceled',
+                                   self.context('subscription_canceled'))
+        assert 'Product       ' in text, text
+        assert html.startswith('<!DOCTYPE html>'), html
+
+
+class TestRenderInPool(EmailTest):
+
+    def setUp(self):
+        super(TestRenderInPool, self).setUp()
+        emails.reset_render_pool()
+        self.addCleanup(emails.reset_render_pool)
+        pool_settings = override_settings(
+            EMAIL_RENDER_POOL=True, EMAIL_RENDER_PROCESSES=2,
+            EMAIL_RENDER_QUEUE_SIZE=1, EMAIL_RENDER_TIMEOUT=5)
+        pool_settings.enable()
+        self.addCleanup(pool_settings.disable)
+
+        p = mock.patch.object(emails, 'render_pool')
+        self.pool = p.start().return_value
+        self.addCleanup(p.stop)
+        self.pool.slots = threading.BoundedSemaphore(1)
+        self.pool.abandoned = 0
+        self.pool.lock = threading.Lock()
+
+        def apply_async(func, args, callback):
+            result = func(*args)
+            callback(result)
+            pending = mock.Mock()
+            pending.get.return_value = result
+            return pending
+
+        self.pool.processes.apply_async.side_effect = apply_async
+
+    @mock.patch.object(emails, 'render')
+    def test_disabled(self, render):
+        with self.settings(EMAIL_RENDER_POOL=False):
+            emails.render_in_pool('subscription_canceled', {})
+        render.assert_called_with('subscription_canceled', {})
+        assert not self.pool.processes.apply_async.called
+
+    @mock.patch.object(emails, 'render')
+    def test_render_in_pool(self, render):
+        render.return_value = ('text', 'html')
+        eq_(emails.render_in_pool('subscription_canceled', {}),
+            ('text', 'html'))
+        eq_(self.pool.processes.apply_async.call_args[0][1],
+            ('subscription_canceled', {}))
+        # The slot was given back.
+        assert self.pool.slots.acquire(False)
+
+    @mock.patch.object(emails, 'render')
+    def test_error(self, render):
+        render.side_effect = ValueError('bad template')
+        with self.assertRaises(emails.RenderError) as cm:
+            emails.render_in_pool('subscription_canceled', {})
+        assert 'bad template' in str(cm.exception), cm.exception
+        assert self.pool.slots.acquire(False)
+
+    @mock.patch.object(emails, 'render')
+    def test_full(self, render):
+        render.return_value = ('text', 'html')
+        self.pool.slots.acquire()
+        eq_(emails.render_in_pool('subscription_canceled', {}),
+            ('text', 'html'))
+        assert not self.pool.processes.apply_async.called
+
+    @mock.patch.object(emails, 'render')
+    def test_timeout(self, render):
+        render.return_value = ('text', 'html')
+        pending = self.pool.processes.apply_async.return_value
+        self.pool.processes.apply_async.side_effect = None
+        pending.get.side_effect = multiprocessing.TimeoutError
+        eq_(emails.render_in_pool('subscription_canceled', {}),
+            ('text', 'html'))
+        pending.get.assert_called_with(5)
+        # The slot was given back.
+        assert self.pool.slots.acquire(False)
+
+    def time_out(self):
+        """
+        Renders an email that times out and returns the callback for when
+        it finishes after all.
+        """
+        self.pool.processes.apply_async.side_effect = None
+        pending = self.pool.processes.apply_async.return_value
+        pending.get.side_effect = multiprocessing.TimeoutError
+        with mock.patch.object(emails, 'render'):
+            emails.render_in_pool('subscription_canceled', {})
+        return self.pool.processes.apply_async.call_args[1]['callback']
+
+    def test_finish_after_timeout(self):
+        finished = self.time_out()
+        eq_(self.pool.abandoned, 1)
+        # The slot is not given back twice.
+        finished((False, ('text', 'html')))
+        eq_(self.pool.abandoned, 0)
+        assert self.pool.slots.acquire(False)
+
+    def test_restart_after_timeouts(self):
+        emails._pool._made = (os.getpid(), self.pool)
+        self.time_out()
+        assert not self.pool.terminate.called
+        self.pool.slots = threading.BoundedSemaphore(1)
+        self.time_out()
+        assert self.pool.terminate.called
+        eq_(emails._pool.peek(), None)
+        eq_(emails.render_pool.call_count, 3)
+
+
+class TestRenderPool(EmailTest):
+
+    def setUp(self):
+        super(TestRenderPool, self).setUp()
+        emails.reset_render_pool()
+        self.addCleanup(emails.reset_render_pool)
+
+    def test_render_in_other_process(self):
+        data = {'kind': 'subscription_canceled', 'product': {},
+                'seller': {'name': 'Some Seller'}}
+        # The render process is forked with CSS loading patched.
+        with self.settings(EMAIL_RENDER_POOL=True, EMAIL_RENDER_PROCESSES=1):
+            text, html = emails.render_in_pool('subscription_canceled', data)
+        assert 'Some Seller' in text, text
+        assert 'Some Seller' in html, html
+        # The template was compiled by the other process.
+        assert not self.load_css.called
+
+    def test_shared_pool(self):
+        with self.settings(EMAIL_RENDER_PROCESSES=1):
+            eq_(emails.render_pool(), emails.render_pool())
+
+    def test_new_pool_after_fork(self):
+        with self.settings(EMAIL_RENDER_PROCESSES=1):
+            pool = emails.render_pool()
+            # A forked process isn't the one that started the pool, and
+            # must not terminate it.
+            self.addCleanup(pool.terminate)
+            emails._pool._made = (-1, pool)
+            assert emails.render_pool() is not pool
+
+    @mock.patch('payments_service.braintree.management.commands.'
+                'process_webhooks.webhook_queue.run_workers')
+    def test_start_before_webhook_workers(self, run_workers):
+        started = []
+        run_workers.side_effect = lambda *args, **kw: started.append(
+            emails._pool.peek() is not None)
+        with self.settings(EMAIL_RENDER_POOL=True, EMAIL_RENDER_PROCESSES=1,
+                           WEBHOOK_QUEUE='/tmp/webhooks.db'):
+            call_command('process_webhooks', until_empty=True)
+        eq_(started, [True])
+
+    def test_do_not_start_at_startup(self):
+        app = BraintreeApp('payments_service.braintree',
+                           __import__('payments_service.braintree'))
+        with self.settings(EMAIL_RENDER_POOL=True):
+            app.ready()
+        eq_(emails._pool.peek(), None)
+
+    def test_reset_locks_in_render_process(self):
+        handler = logging.Handler()
+        lock = handler.lock
+        logging.getLogger('test_emails').addHandler(handler)
+        self.addCleanup(logging.getLogger('test_emails').removeHandler,
+                        handler)
+        module_lock = logging._lock
+        with mock.patch.object(logging, '_lock', module_lock):
+            emails._start_render_process()
+            assert logging._lock is not module_lock
+        assert handler.lock is not lock
+
+
+class TestPremailedTags(TestCase):
+
+    def test_text(self):
+        eq_(premailed_text(u'a "b" \'c\' & <d> \xe9'),
+            u'a "b" \'c\' &amp; &lt;d&gt; \xe9')
+
+    def test_text_control_character(self):
+        eq_(premailed_text(u'a\x0cb'), u'ab')
+
+    def test_attributes(self):
+        eq_(emails.premail_attributes('img', u' alt="a &amp; \xe9"'),
+            u' alt="a &amp; \xe9"')
+
+    def test_attributes_with_double_quotes(self):
+        eq_(emails.premail_attributes('img', u' alt="a &quot;b&quot;"'),
+            u' alt=\'a "b"\'')
+
+    def test_url(self):
+        with self.settings(EMAIL_URL_ROOT='https://pay.dev'):
+            eq_(emails.premail_attributes('img', u' src="/a b/\xe9.svg"'),
+                u' src="https://pay.dev/a%20b/%C3%A9.svg"')
+
+    def test_style(self):
+        eq_(emails.premail_attributes(
+            'div', u' premailed-style="width:40px; color:blue" '
+                   u'id="logo" style="color: red"'),
+            u' id="logo" style="color:red; width:40px" width="40"')
+
+    def test_tag(self):
+        template = engines['django'].from_string(
+            '{% load premailed %}<img{% premailed_attributes "img" %} '
+            'alt="{{ alt }}"{% endpremailed_attributes %}>')
+        eq_(template.render(Context({'alt': u'a "b"'})),
+            u'<img alt=\'a "b"\'>')
@@ -0,0 +1,59 @@
+import unittest
+
+import mock
+import payments_config
+from nose.tools import eq_
+
+from payments_service.base.tests import fake_payments_config
+
+from ..products import ProductCatalog
+
+
+class TestProductCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.patch_products()
+        self.catalog = ProductCatalog()
+        self.catalog.build()
+        self.uri = '/generic/product/1/'
+        self.fetch = mock.Mock()
+        self.fetch.return_value = {
+            'resource_uri': self.uri,
+            'public_id': 'service-subscription',
+        }
+
+    def patch_products(self):
+        sellers, products = payments_config.populate(fake_payments_config)
+        p = mock.patch.object(payments_config, 'products', products)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_fetch_unknown_uri(self):
+        eq_(self.catalog.expand(self.uri, self.fetch),
+            self.fetch.return_value)
+        self.fetch.assert_called_with(self.uri)
+
+    def test_expand_from_catalog(self):
+        self.catalog.expand(self.uri, self.fetch)
+        eq_(self.catalog.expand(self.uri, self.fetch),
+            self.fetch.return_value)
+        eq_(self.fetch.call_count, 1)
+
+    def test_always_fetch_products_not_in_config(self):
+        self.fetch.return_value = {'resource_uri': self.uri,
+                                   'public_id': 'not-configured'}
+        self.catalog.expand(self.uri, self.fetch)
+        self.catalog.expand(self.uri, self.fetch)
+        eq_(self.fetch.call_count, 2)
+
+    def test_return_copies(self):
+        self.catalog.expand(self.uri, self.fetch)
+        self.catalog.expand(self.uri, self.fetch)['public_id'] = 'changed'
+        eq_(self.catalog.expand(self.uri, self.fetch)['public_id'],
+            'service-subscription')
+
+    def test_rebuild_when_config_changes(self):
+        self.catalog.expand(self.uri, self.fetch)
+        self.patch_products()
+        self.catalog.expand(self.uri, self.fetch)
+        eq_(self.fetch.call_count, 2)
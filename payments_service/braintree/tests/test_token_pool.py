@@ -0,0 +1,151 @@
+import itertools
+import time
+
+from django.test import TestCase
+
+import mock
+from nose.tools import eq_
+
+from payments_service.braintree import token_pool
+from payments_service.braintree.token_pool import TokenPool
+
+
+class TestTokenPool(TestCase):
+
+    def setUp(self):
+        counter = itertools.count()
+        self.generate = mock.Mock(
+            side_effect=lambda: 'token-{}'.format(next(counter)))
+        p = mock.patch.object(TokenPool, '_start')
+        p.start()
+        self.addCleanup(p.stop)
+
+        p = mock.patch('payments_service.braintree.token_pool.time')
+        self.time = p.start()
+        self.time.time.return_value = 1000
+        self.addCleanup(p.stop)
+
+    def pool(self, size=2, max_age=10):
+        return TokenPool('test', self.generate, size=size, max_age=max_age)
+
+    def test_fill(self):
+        pool = self.pool(size=3)
+        pool.fill()
+        eq_(len(pool), 3)
+        eq_(self.generate.call_count, 3)
+
+    def test_fill_full_pool(self):
+        pool = self.pool()
+        pool.fill()
+        pool.fill()
+        eq_(self.generate.call_count, 2)
+
+    def test_get_from_pool(self):
+        pool = self.pool()
+        pool.fill()
+        eq_(pool.get(), 'token-0')
+        eq_(pool.get(), 'token-1')
+        eq_(self.generate.call_count, 2)
+        eq_(len(pool), 0)
+
+    def test_get_from_empty_pool(self):
+        pool = self.pool()
+        eq_(pool.get(), 'token-0')
+        eq_(len(pool), 0)
+
+    def test_get_wakes_up_refiller(self):
+        pool = self.pool()
+        pool.fill()
+        pool._wanted.clear()
+        pool.get()
+        assert pool._wanted.is_set()
+
+    def test_expired_tokens_are_not_used(self):
+        pool = self.pool(max_age=10)
+        pool.fill()
+        self.time.time.return_value = 1010
+        eq_(pool.get(), 'token-2')
+        eq_(len(pool), 0)
+
+    def test_refill_replaces_expired_tokens(self):
+        pool = self.pool(max_age=10)
+        pool.fill()
+        self.time.time.return_value = 1010
+        pool.fill()
+        eq_(pool.get(), 'token-2')
+
+    def test_next_expiry(self):
+        pool = self.pool(max_age=10)
+        eq_(pool._next_expiry(), None)
+        pool.fill()
+        self.time.time.return_value = 1004
+        eq_(pool._next_expiry(), 6)
+
+    def test_disabled(self):
+        pool = self.pool(size=0)
+        pool.fill()
+        eq_(len(pool), 0)
+        eq_(pool.get(), 'token-0')
+        assert not pool._start.called
+
+    @mock.patch('payments_service.braintree.token_pool.statsd')
+    def test_metrics(self, statsd):
+        pool = self.pool()
+        pool.fill()
+        self.time.time.return_value = 1002
+        pool.get()
+        statsd.gauge.assert_called_with('test.depth', 1)
+        statsd.timing.assert_called_with('test.age', 2000)
+        statsd.incr.assert_called_with('test.hit')
+
+    @mock.patch('payments_service.braintree.token_pool.statsd')
+    def test_miss_metric(self, statsd):
+        self.pool().get()
+        statsd.incr.assert_called_with('test.miss')
+
+    def test_stop(self):
+        pool = self.pool()
+        pool.stop()
+        pool.fill()
+        eq_(len(pool), 0)
+
+
+class TestRefiller(TestCase):
+
+    def test_refills_in_background(self):
+        generated = []
+
+        def generate():
+            generated.append(len(generated))
+            return generated[-1]
+
+        pool = TokenPool('test', generate, size=2)
+        self.addCleanup(pool.stop)
+        eq_(pool.get(), 0)
+        for i in range(100):
+            if len(pool) == 2:
+                break
+            time.sleep(0.01)
+        eq_(len(pool), 2)
+        eq_(pool.get(), 1)
+
+
+class TestSharedPool(TestCase):
+
+    def setUp(self):
+        token_pool.reset_pool()
+        self.addCleanup(token_pool.reset_pool)
+
+    def test_configured(self):
+        with self.settings(BRAINTREE_TOKEN_POOL_SIZE=5,
+                           BRAINTREE_TOKEN_POOL_MAX_AGE=30):
+            pool = token_pool.pool()
+        eq_(pool.size, 5)
+        eq_(pool.max_age, 30)
+        assert token_pool.pool() is pool
+
+    @mock.patch('payments_service.braintree.token_pool.solitude')
+    def test_generate_token(self, solitude):
+        generate = solitude.api.return_value.braintree.token.generate
+        generate.post.return_value = {'token': 'some-token'}
+        eq_(token_pool.get_token(), 'some-token')
@@ -9,6 +9,7 @@ from slumber.exceptions import HttpClientError
 
 from payments_service.base.tests import (AuthenticatedTestCase,
                                          WithFakePaymentsConfig)
+from payments_service.braintree import emails
 
 
 def subscription():
@@ -156,10 +157,13 @@ class ExistingSubscriptionTest(AuthenticatedTestCase):
         self.new_pay_method_uri = '/new_pay_method_uri'
         self.subscription_uri = '/subscription_uri'
 
-        p = mock.patch('payments_service.braintree.views.webhook.premail',
-                       autospec=True)
-        self.premail = p.start()
+        # Compile templates without fetching any CSS.
+        p = mock.patch('payments_service.braintree.emails.premail',
+                       side_effect=lambda source: source)
+        p.start()
         self.addCleanup(p.stop)
+        emails.reset_compiled()
+        self.addCleanup(emails.reset_compiled)
 
     def setup_uri_lookups(self, uri_404=None):
         resources = {
@@ -220,6 +224,17 @@ class TestGetSubscriptions(WithFakePaymentsConfig, AuthenticatedTestCase):
             self.seller_product)
         eq_(response.status_code, 200)
 
+    def test_expand_seller_product_from_catalog(self):
+        self.get()
+        # Solitude returns a new, unexpanded subscription each time.
+        bt = self.solitude.braintree
+        bt.mozilla.subscription.get.return_value = [subscription()]
+        response, data = self.get()
+
+        eq_(self.solitude.by_url.return_value.get_object.call_count, 1)
+        eq_(data['subscriptions'][0]['seller_product'],
+            self.seller_product)
+
     def test_only_get_user_subscriptions(self):
         self.get()
 
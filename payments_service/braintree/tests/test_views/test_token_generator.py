@@ -1,5 +1,6 @@
 from django.core.urlresolvers import reverse
 
+import mock
 from nose.tools import eq_
 
 from payments_service.base.tests import TestCase
@@ -28,3 +29,11 @@ class TestTokenGenerator(TestCase):
         res, data = self.post()
         eq_(res.status_code, 200, res)
         assert 'csrf_token' in data, data
+
+    @mock.patch('payments_service.braintree.token_pool.get_token')
+    def test_use_token_pool(self, get_token):
+        get_token.return_value = 'pooled-token'
+        res, data = self.post()
+        eq_(res.status_code, 200, res)
+        eq_(data['token'], 'pooled-token')
+        assert not self.solitude.braintree.token.generate.post.called
@@ -1,9 +1,12 @@
+from urllib import urlencode
+
 from django.core.urlresolvers import reverse
 
 import mock
 from nose.tools import eq_
 
 from payments_service.base.tests import AuthenticatedTestCase
+from payments_service.solitude.pagination import decode_cursor, encode_cursor
 
 
 class TestGetTransactions(AuthenticatedTestCase):
@@ -44,10 +47,11 @@ class TestGetTransactions(AuthenticatedTestCase):
         self.solitude.by_url.side_effect = get_api_object
         return resources
 
-    def get(self):
-        return self.json(
-            self.client.get(reverse('braintree:transactions'))
-        )
+    def get(self, query=None):
+        url = reverse('braintree:transactions')
+        if query:
+            url = '{url}?{query}'.format(url=url, query=urlencode(query))
+        return self.json(self.client.get(url))
 
     def test_return_api_transactions(self):
         res, data = self.get()
@@ -71,3 +75,56 @@ class TestGetTransactions(AuthenticatedTestCase):
         # }
         assert self.uri_resources[self.transaction_uri].get_object.called
         assert self.uri_resources[self.seller_product_uri].get_object.called
+
+    def test_not_paginated_by_default(self):
+        res, data = self.get()
+        get = self.solitude.braintree.mozilla.transaction.get
+        assert 'limit' not in get.call_args[1]
+        assert 'next_cursor' not in data
+
+    def set_transactions(self, count):
+        self.api_transactions = [{'transaction': self.transaction_uri,
+                                  'resource_pk': pk,
+                                  'created': '2015-08-07T00:00:0{}'.format(pk)}
+                                 for pk in range(count)]
+        self.solitude.braintree.mozilla.transaction.get.return_value = (
+            self.api_transactions
+        )
+
+    def test_first_page(self):
+        self.set_transactions(3)
+        res, data = self.get({'limit': 2})
+
+        eq_(res.status_code, 200, res)
+        get = self.solitude.braintree.mozilla.transaction.get
+        eq_(get.call_args[1]['limit'], 3)
+        eq_(get.call_args[1]['order_by'], ['created', 'id'])
+        eq_([t['resource_pk'] for t in data['transactions']], [0, 1])
+        eq_(decode_cursor(data['next_cursor'])['pk'], 1)
+
+    def test_last_page(self):
+        self.set_transactions(2)
+        res, data = self.get({'limit': 2,
+                              'cursor': encode_cursor(
+                                  '2015-08-07T00:00:00', 0)})
+
+        get = self.solitude.braintree.mozilla.transaction.get
+        eq_(get.call_args[1]['created__gte'], '2015-08-07T00:00:00')
+        eq_([t['resource_pk'] for t in data['transactions']], [1])
+        eq_(data['next_cursor'], None)
+
+    def test_only_expand_page(self):
+        self.set_transactions(3)
+        self.get({'limit': 2})
+        get_object = self.uri_resources[self.transaction_uri].get_object
+        eq_(get_object.call_count, 2)
+
+    def test_since(self):
+        res, data = self.get({'since': '2015-08-07T14:53:23Z'})
+        get = self.solitude.braintree.mozilla.transaction.get
+        eq_(get.call_args[1]['created__gt'], '2015-08-07T14:53:23+00:00')
+        eq_(get.call_args[1]['transaction__buyer__uuid'], self.buyer_uuid)
+
+    def test_invalid_cursor(self):
+        res, data = self.get({'cursor': 'nope'})
+        self.assert_error_response(res, msg_patterns={'cursor': '.*'})
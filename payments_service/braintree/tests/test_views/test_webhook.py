@@ -9,7 +9,10 @@ import mock
 from nose.tools import eq_
 from slumber.exceptions import HttpClientError
 
+from payments_service.base.sqlite_queue import Item, QueueFull
 from payments_service.base.tests import TestCase, WithFakePaymentsConfig
+from payments_service.braintree.views.webhook import Webhook
+from payments_service.braintree.webhook_queue import Progress
 
 from .test_subscriptions import (subscription, seller_product,
                                  ExistingSubscriptionTest)
@@ -113,6 +116,14 @@ class TestWebhook(WithFakePaymentsConfig, ExistingSubscriptionTest):
         self.solitude.braintree.webhook.post.assert_called_with(data)
         eq_(res.status_code, 200)
 
+    @mock.patch('payments_service.braintree.views.webhook.etags')
+    def test_bump_buyer_version(self, etags):
+        post = self.solitude.braintree.webhook.post
+        post.return_value = subscription_notice('service-subscription')
+        self.post()
+        etags.bump_buyer_version.assert_called_with(
+            post.return_value['mozilla']['buyer']['uuid'])
+
     def test_bad_solitude_response_for_parse(self):
         self.solitude.braintree.webhook.post.side_effect = HttpClientError
         res = self.post()
@@ -218,6 +229,56 @@ class TestWebhook(WithFakePaymentsConfig, ExistingSubscriptionTest):
             'braintree/emails/'
             'subscription_canceled.html')
 
+    @mock.patch('payments_service.braintree.views.webhook.webhook_queue')
+    def test_queue(self, webhook_queue):
+        data = {'bt_payload': 'p', 'bt_signature': 's'}
+        with self.settings(WEBHOOK_QUEUE='/tmp/webhooks.db'):
+            res = self.post(data=data)
+        eq_(res.status_code, 200)
+        webhook_queue.enqueue.assert_called_with(data)
+        assert not self.solitude.braintree.webhook.post.called
+
+    def test_missing_signature(self):
+        res = self.post(data={'bt_payload': 'p'})
+        eq_(res.status_code, 400)
+        assert not self.solitude.braintree.webhook.post.called
+
+    @mock.patch('payments_service.braintree.views.webhook.webhook_queue')
+    def test_do_not_queue_missing_payload(self, webhook_queue):
+        with self.settings(WEBHOOK_QUEUE='/tmp/webhooks.db'):
+            res = self.post(data={'bt_signature': 's'})
+        eq_(res.status_code, 400)
+        assert not webhook_queue.enqueue.called
+
+    @mock.patch('payments_service.braintree.views.webhook.webhook_queue')
+    def test_queue_full(self, webhook_queue):
+        webhook_queue.QueueFull = QueueFull
+        webhook_queue.enqueue.side_effect = QueueFull
+        with self.settings(WEBHOOK_QUEUE='/tmp/webhooks.db',
+                           WEBHOOK_RETRY_DELAY=60):
+            res = self.post()
+        eq_(res.status_code, 503)
+        eq_(res['Retry-After'], '60')
+
+    def test_do_not_email_twice(self):
+        notice = subscription_notice('service-subscription')
+        post = self.solitude.braintree.webhook.post
+        post.return_value = notice
+        queue = mock.Mock()
+        item = Item(1, {}, 0, 2, {'verified': notice, 'notified': None})
+        Webhook().process({}, Progress(queue, item))
+        assert not post.called
+        eq_(len(mail.outbox), 0)
+
+    def test_record_steps(self):
+        notice = subscription_notice('service-subscription')
+        self.solitude.braintree.webhook.post.return_value = notice
+        queue = mock.Mock()
+        Webhook().process({}, Progress(queue, Item(1, {}, 0, 1, None)))
+        eq_(len(mail.outbox), 1)
+        queue.save_state.assert_called_with(
+            1, {'verified': notice, 'notified': None})
+
     def test_ignore_inactionable_webhook(self):
         # Solitude returns a 204 when we do not need to act on the webhook.
         self.solitude.braintree.webhook.post.return_value = ''
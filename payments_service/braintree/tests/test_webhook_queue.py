@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+
+import mock
+from nose.tools import eq_, raises
+from slumber.exceptions import HttpClientError
+
+from payments_service.base.tests import TestCase
+from payments_service.braintree import webhook_queue
+
+from .test_views.test_webhook import subscription_notice
+
+
+class WebhookQueueTest(TestCase):
+
+    def setUp(self):
+        super(WebhookQueueTest, self).setUp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        queue_settings = override_settings(
+            WEBHOOK_QUEUE=os.path.join(tmp, 'webhooks.db'),
+            WEBHOOK_RETRIES=2, WEBHOOK_RETRY_DELAY=0)
+        queue_settings.enable()
+        self.addCleanup(queue_settings.disable)
+
+        webhook_queue.reset_queue()
+        self.addCleanup(webhook_queue.reset_queue)
+        self.queue = webhook_queue.queue()
+
+
+class TestProcessNext(WebhookQueueTest):
+
+    def test_empty(self):
+        process = mock.Mock()
+        eq_(webhook_queue.process_next(process), False)
+        assert not process.called
+
+    def test_process(self):
+        webhook_queue.enqueue({'bt_payload': 'p'})
+        process = mock.Mock()
+        eq_(webhook_queue.process_next(process), True)
+        process.assert_called_with({'bt_payload': 'p'}, mock.ANY)
+        eq_(self.queue.depth(), 0)
+
+    def test_rejected(self):
+        webhook_queue.enqueue({})
+        webhook_queue.process_next(mock.Mock(side_effect=HttpClientError))
+        eq_(self.queue.depth(), 0)
+        eq_(self.queue.failed_depth(), 1)
+
+    def test_do_not_retry_permanent_errors(self):
+        for error in (KeyError('product'), ValueError('No email')):
+            webhook_queue.enqueue({})
+            process = mock.Mock(side_effect=error)
+            webhook_queue.process_next(process)
+            eq_(process.call_count, 1)
+            eq_(self.queue.depth(), 0)
+        eq_(self.queue.failed_depth(), 2)
+
+    def test_retry(self):
+        webhook_queue.enqueue({})
+        process = mock.Mock(side_effect=[IOError, None])
+        webhook_queue.process_next(process)
+        eq_(self.queue.depth(), 1)
+        webhook_queue.process_next(process)
+        eq_(process.call_count, 2)
+        eq_(self.queue.depth(), 0)
+
+    def test_give_up(self):
+        webhook_queue.enqueue({})
+        process = mock.Mock(side_effect=IOError)
+        for i in range(4):
+            webhook_queue.process_next(process)
+        # The first attempt and 2 retries.
+        eq_(process.call_count, 3)
+        eq_(self.queue.depth(), 0)
+        eq_(self.queue.failed_depth(), 1)
+
+    def test_skip_finished_steps(self):
+        webhook_queue.enqueue({})
+        first = mock.Mock(return_value='first')
+        second = mock.Mock(side_effect=IOError, return_value=None)
+
+        def process(data, progress):
+            progress.run('first', first)
+            progress.run('second', second)
+
+        webhook_queue.process_next(process)
+        second.side_effect = None
+        webhook_queue.process_next(process)
+        eq_(first.call_count, 1)
+        eq_(second.call_count, 2)
+        eq_(self.queue.depth(), 0)
+
+    def test_return_finished_step(self):
+        webhook_queue.enqueue({})
+        results = []
+
+        def process(data, progress):
+            results.append(progress.run('step', lambda: {'n': 1}))
+            if len(results) == 1:
+                raise IOError
+
+        webhook_queue.process_next(process)
+        webhook_queue.process_next(process)
+        eq_(results, [{'n': 1}, {'n': 1}])
+
+    @raises(webhook_queue.QueueFull)
+    def test_full(self):
+        with self.settings(WEBHOOK_QUEUE_MAXSIZE=1):
+            webhook_queue.reset_queue()
+            webhook_queue.enqueue({})
+            webhook_queue.enqueue({})
+
+    @mock.patch('payments_service.braintree.webhook_queue.statsd')
+    def test_report(self, statsd):
+        webhook_queue.enqueue({})
+        eq_(webhook_queue.report(), 1)
+        statsd.gauge.assert_any_call('webhook_queue.depth', 1)
+
+
+class TestRunWorkers(WebhookQueueTest):
+
+    def test_until_empty(self):
+        for i in range(5):
+            webhook_queue.enqueue({'n': i})
+        process = mock.Mock()
+        webhook_queue.run_workers(process, 3, poll_interval=0.01,
+                                  until_empty=True)
+        eq_(sorted(c[0][0]['n'] for c in process.call_args_list),
+            range(5))
+        eq_(self.queue.depth(), 0)
+
+
+class TestCommand(WebhookQueueTest):
+
+    @mock.patch('payments_service.braintree.management.commands.'
+                'process_webhooks.webhook_queue.run_workers')
+    def test_run(self, run_workers):
+        call_command('process_webhooks', workers=2, until_empty=True)
+        args, kw = run_workers.call_args
+        eq_(args[1], 2)
+        eq_(kw['until_empty'], True)
+
+    def test_process_queued_webhooks(self):
+        webhook_queue.enqueue({'bt_payload': 'p', 'bt_signature': 's'})
+        # Solitude returns a 204 when we do not need to act on the webhook.
+        self.solitude.braintree.webhook.post.return_value = ''
+        call_command('process_webhooks', until_empty=True)
+        self.solitude.braintree.webhook.post.assert_called_with(
+            {'bt_payload': 'p', 'bt_signature': 's'})
+        eq_(self.queue.depth(), 0)
+
+    def test_unknown_product(self):
+        webhook_queue.enqueue({'bt_payload': 'p', 'bt_signature': 's'})
+        post = self.solitude.braintree.webhook.post
+        post.return_value = subscription_notice('unknown-product')
+        call_command('process_webhooks', until_empty=True)
+        eq_(post.call_count, 1)
+        eq_(self.queue.depth(), 0)
+        eq_(self.queue.failed_depth(), 1)
+
+    @raises(CommandError)
+    def test_not_configured(self):
+        with self.settings(WEBHOOK_QUEUE=None):
+            call_command('process_webhooks', until_empty=True)
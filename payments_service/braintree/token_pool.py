@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from django_statsd.clients import statsd
+
+from .. import solitude
+from ..base.concurrency import ProcessSingleton
+
+log = logging.getLogger(__name__)
+
+
+def generate_token():
+    """
+    Generates a new anonymous Braintree client token through Solitude.
+    """
+    return solitude.api().braintree.token.generate.post({})['token']
+
+
+def _create_pool():
+    return TokenPool('braintree.token_pool', generate_token,
+                     size=settings.BRAINTREE_TOKEN_POOL_SIZE,
+                     max_age=settings.BRAINTREE_TOKEN_POOL_MAX_AGE,
+                     retry_interval=settings.BRAINTREE_TOKEN_POOL_RETRY)
+
+
+_pool = ProcessSingleton(_create_pool, close=lambda pool: pool.stop())
+
+
+def pool():
+    """
+    Returns the client token pool for this process.
+    """
+    return _pool.get()
+
+
+def reset_pool():
+    _pool.reset()
+
+
+def get_token():
+    """
+    Returns a Braintree client token, from the pool if possible.
+    """
+    return pool().get()
+
+
+class TokenPool(object):
+    """
+    Keeps up to `size` tokens made by generate() ready to be handed out.
+
+    A background thread, started on first use, tops the pool up whenever a
+    token is taken or has become older than `max_age` seconds. Tokens
+    older than that are thrown away instead of being handed out. When the
+    pool is empty, get() calls generate() itself. If generate() fails, the
+    thread waits `retry_interval` seconds before trying again.
+
+    A pool with a size of 0 never keeps any tokens.
+    """
+
+    def __init__(self, name, generate, size=0, max_age=600, retry_interval=5):
+        self.name = name
+        self.generate = generate
+        self.size = size
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        self._tokens = deque()
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def get(self):
+        """
+        Returns a token from the pool or a newly generated one.
+        """
+        if self.size <= 0:
+            return self.generate()
+
+        self._start()
+        token = self._take()
+        # Replace the token we took or tell the thread the pool ran dry.
+        self._wanted.set()
+        if token is None:
+            log.info('{}: pool is empty, generating a token'
+                     .format(self.name))
+            statsd.incr('{}.miss'.format(self.name))
+            return self.generate()
+        statsd.incr('{}.hit'.format(self.name))
+        return token
+
+    def fill(self):
+        """
+        Generates tokens until the pool is full.
+        """
+        self._expire()
+        while len(self._tokens) < self.size and not self._stopped:
+            token = self.generate()
+            with self._lock:
+                self._tokens.append((time.time(), token))
+                statsd.gauge('{}.depth'.format(self.name), len(self._tokens))
+
+    def stop(self):
+        self._stopped = True
+        self._wanted.set()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _take(self):
+        self._expire()
+        with self._lock:
+            if not self._tokens:
+                return None
+            # The oldest token is the next one to expire.
+            created, token = self._tokens.popleft()
+            statsd.gauge('{}.depth'.format(self.name), len(self._tokens))
+        statsd.timing('{}.age'.format(self.name),
+                      (time.time() - created) * 1000)
+        return token
+
+    def _expire(self):
+        oldest = time.time() - self.max_age
+        with self._lock:
+            while self._tokens and self._tokens[0][0] <= oldest:
+                self._tokens.popleft()
+                statsd.incr('{}.expired'.format(self.name))
+
+    def _next_expiry(self):
+        with self._lock:
+            if not self._tokens:
+                return None
+            return max(self._tokens[0][0] + self.max_age - time.time(), 0)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work,
+                                                name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _work(self):
+        while not self._stopped:
+            self._wanted.clear()
+            try:
+                self.fill()
+            except Exception:
+                log.exception('{}: generating a token'.format(self.name))
+                statsd.incr('{}.failed'.format(self.name))
+                time.sleep(self.retry_interval)
+                continue
+            self._wanted.wait(self._next_expiry())
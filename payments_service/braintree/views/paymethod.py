@@ -21,6 +21,7 @@ class PayMethod(SolitudeBodyguard):
     """
     methods = ['get', 'patch']
     resource = 'braintree.mozilla.paymethod'
+    passthrough = True
 
     def replace_call_args(self, request, method, args, kw):
         """
@@ -8,6 +8,7 @@ from slumber.exceptions import HttpClientError
 
 from ..forms import (ChangeSubscriptionPayMethodForm, ManageSubscriptionForm,
                      SubscriptionForm)
+from ..products import catalog
 
 log = logging.getLogger(__name__)
 
@@ -16,6 +17,7 @@ class RetrieveSubscriptions(SolitudeAPIView):
     """
     Deals with retrieving Braintree plan subscriptions.
     """
+    expansion_providers = {'seller_product': catalog.expand}
 
     def get(self, request):
         subscriptions = self.api.braintree.mozilla.subscription.get(
@@ -23,10 +25,8 @@ class RetrieveSubscriptions(SolitudeAPIView):
             paymethod__braintree_buyer__buyer=self.request.user.pk,
         )
 
-        return Response({
-            'subscriptions': self.expand_api_objects(subscriptions,
-                                                     ['seller_product']),
-        }, status=200)
+        return self.expanded_list_response('subscriptions', subscriptions,
+                                           ['seller_product'])
 
 
 class CreateSubscriptions(AnonymousSolitudeAPIView):
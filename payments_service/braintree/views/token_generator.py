@@ -2,8 +2,8 @@ from django.middleware import csrf
 
 from rest_framework.response import Response
 
-from payments_service import solitude
 from payments_service.base.views import UnprotectedAPIView
+from payments_service.braintree import token_pool
 
 
 class TokenGenerator(UnprotectedAPIView):
@@ -12,7 +12,9 @@ class TokenGenerator(UnprotectedAPIView):
     """
 
     def post(self, request):
-        bt_data = solitude.api().braintree.token.generate.post({})
+        # Client tokens are not tied to a customer so they can be
+        # generated ahead of time.
+        bt_token = token_pool.get_token()
 
         # Generate a new token for added security.
         csrf.rotate_token(request)
@@ -24,6 +26,6 @@ class TokenGenerator(UnprotectedAPIView):
         # anonymous payments.
 
         return Response({
-            'token': bt_data['token'],
+            'token': bt_token,
             'csrf_token': csrf.get_token(request),
         })
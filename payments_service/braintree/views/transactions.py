@@ -1,19 +1,36 @@
-from rest_framework.response import Response
-
+from payments_service.base.views import error_400
 from payments_service.solitude import SolitudeAPIView
+from payments_service.solitude.pagination import PageForm
+
+from ..products import catalog
 
 
 class Transactions(SolitudeAPIView):
     """
     Deals with Braintree related transactions.
+
+    Clients can ask for one page of transactions at a time with the
+    limit, cursor and since query parameters. See PageForm.
     """
+    expansion_providers = {'seller_product': catalog.expand}
+
     def get(self, request):
-        transactions = self.api.braintree.mozilla.transaction.get(
-            transaction__buyer__uuid=self.request.user.uuid,
-        )
-        return Response({
-            'transactions': self.expand_api_objects(
-                transactions,
-                [{'transaction': ['seller_product']}],
-            ),
-        }, status=200)
+        params = {'transaction__buyer__uuid': self.request.user.uuid}
+
+        page = None
+        if PageForm.is_requested(request.query_params):
+            page = PageForm(request.query_params)
+            if not page.is_valid():
+                return error_400(response=page.errors)
+            params.update(page.solitude_params())
+
+        transactions = self.api.braintree.mozilla.transaction.get(**params)
+
+        extra = {}
+        if page:
+            transactions, extra['next_cursor'] = page.split(transactions)
+
+        # Only expand the transactions that are returned.
+        return self.expanded_list_response(
+            'transactions', transactions,
+            [{'transaction': ['seller_product']}], extra=extra)
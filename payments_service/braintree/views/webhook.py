@@ -3,18 +3,18 @@ import logging
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives, get_connection
 from django.http import HttpResponse
-from django.template import Context
-from django.template.loader import get_template
 
 import payments_config
 from dateutil.parser import parse as parse_date
-from premailer import Premailer
 from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
 from slumber.exceptions import HttpClientError
 
 from payments_service import solitude
-from payments_service.base.views import error_403, UnprotectedAPIView
+from payments_service.base import etags
+from payments_service.base.views import (error_403, error_503,
+                                         UnprotectedAPIView)
+from payments_service.braintree import emails, webhook_queue
 from payments_service.braintree.utils import recurring_amount
 
 log = logging.getLogger(__name__)
@@ -49,18 +49,28 @@ class Webhook(UnprotectedAPIView):
                         content_type='text/plain; charset=utf-8')
 
     def post(self, request):
+        data = {
+            'bt_payload': request.DATA.get('bt_payload'),
+            'bt_signature': request.DATA.get('bt_signature'),
+        }
+        if not all(data.values()):
+            log.info('webhook POST: ignoring request without a payload '
+                     'and signature')
+            return Response('verification failed', status=400)
+
+        if settings.WEBHOOK_QUEUE:
+            # Acknowledge right away and let a worker verify and act on
+            # the notification. See the process_webhooks command.
+            try:
+                webhook_queue.enqueue(data)
+            except webhook_queue.QueueFull, exc:
+                # Braintree retries notifications that fail.
+                log.warning('webhook POST: queue is full: {}'.format(exc))
+                return error_503(retry_after=settings.WEBHOOK_RETRY_DELAY)
+            return Response('', status=200)
+
         try:
-            webhook_result = self.api.braintree.webhook.post({
-                'bt_payload': request.DATA.get('bt_payload'),
-                'bt_signature': request.DATA.get('bt_signature'),
-            })
-            if webhook_result:
-                self.notify_buyer(webhook_result)
-            else:
-                # Solitude is configured to return a 204 when we do
-                # not need to act on the webhook.
-                log.warning('not notifying buyer of webhook result; '
-                            'received empty response (204)')
+            self.process(data)
             result = ''
             # Even though this is an empty response,
             # Braintree expects it to be a 200.
@@ -73,6 +83,36 @@ class Webhook(UnprotectedAPIView):
 
         return Response(result, status=status)
 
+    def process(self, data, progress=None):
+        """
+        Verifies a webhook notification through Solitude and notifies the
+        buyer about it.
+
+        When processing a queued notification, progress is a
+        webhook_queue.Progress that skips the steps an earlier attempt
+        finished, so that a retry doesn't post to Solitude or email the
+        buyer twice.
+
+        Raises HttpClientError if Solitude rejects the notification.
+        """
+        def run(step, func):
+            if progress is None:
+                return func()
+            return progress.run(step, func)
+
+        webhook_result = run(
+            'verified', lambda: self.api.braintree.webhook.post(data))
+        if webhook_result:
+            # The buyer's subscriptions or transactions changed.
+            etags.bump_buyer_version(
+                webhook_result['mozilla']['buyer'].get('uuid'))
+            run('notified', lambda: self.notify_buyer(webhook_result))
+        else:
+            # Solitude is configured to return a 204 when we do
+            # not need to act on the webhook.
+            log.warning('not notifying buyer of webhook result; '
+                        'received empty response (204)')
+
     def build_context(self, bt_trans, moz_trans, paymethod, product, kind):
         return {
             'bill_start': parsed_date(bt_trans['billing_period_start_date']),
@@ -91,17 +131,6 @@ class Webhook(UnprotectedAPIView):
             'transaction': moz_trans,
         }
 
-    def render_txt(self, data, kind):
-        template = get_template('braintree/emails/{}.txt'.format(kind))
-        return template.render(Context(data))
-
-    def render_html(self, data, kind, premailed):
-        template = get_template('braintree/emails/{}.html'.format(kind))
-        response = template.render(Context(data))
-        if premailed:
-            response = premail(response)
-        return response
-
     def notify_buyer(self, result):
         log.debug('about to handle webhook: {s}'
                   .format(s=result))
@@ -143,11 +172,12 @@ class Webhook(UnprotectedAPIView):
         data = self.build_context(
             bt_trans, moz_trans, result['mozilla']['paymethod'], product,
             notice_kind)
+        text, html = emails.render_in_pool(notice_kind, data)
         connection = get_connection(fail_silently=False)
 
         mail = EmailMultiAlternatives(
             subject,
-            self.render_txt(data, notice_kind),
+            text,
             settings.SUBSCRIPTION_FROM_EMAIL,
             [result['mozilla']['buyer']['email']],
             reply_to=[settings.SUBSCRIPTION_REPLY_TO_EMAIL],
@@ -157,9 +187,7 @@ class Webhook(UnprotectedAPIView):
                 'subscription_charged_successfully',
                 'subscription_charged_unsuccessfully',
                 'subscription_canceled']:
-            mail.attach_alternative(
-                self.render_html(data, notice_kind, True),
-                'text/html')
+            mail.attach_alternative(html, 'text/html')
         mail.send()
 
 
@@ -190,28 +218,10 @@ def debug_email(request):
 
     # Render the HTML.
     data = webhook.build_context(bt, moz, method, product, kind)
-    response = webhook.render_html(data, kind, premailed)
+    response = emails.render_html(kind, data, premailed=premailed)
 
     return HttpResponse(response, status=200)
 
 
 def parsed_date(date):
     return '{d.day} {d:%b} {d.year}'.format(d=parse_date(date))
-
-
-def premail(source):
-    p = Premailer(
-        html=source,
-        preserve_internal_links=True,
-        exclude_pseudoclasses=False,
-        keep_style_tags=False,
-        include_star_selectors=True,
-        remove_classes=False,
-        strip_important=False,
-        method='html',
-        base_path=settings.EMAIL_URL_ROOT,
-        base_url=settings.EMAIL_URL_ROOT,
-        disable_basic_attributes=[],
-        disable_validation=True
-    )
-    return p.transform(pretty_print=True)
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+from django_statsd.clients import statsd
+from slumber.exceptions import HttpClientError
+
+from ..base.concurrency import ProcessSingleton
+from ..base.sqlite_queue import QueueFull, SQLiteQueue
+
+log = logging.getLogger(__name__)
+
+# Errors that processing a notification again would only repeat, such as
+# Solitude rejecting it or an email that can't be built for it.
+PERMANENT_ERRORS = (HttpClientError, KeyError, ValueError)
+
+
+def _open_queue():
+    return SQLiteQueue(settings.WEBHOOK_QUEUE, lease=settings.WEBHOOK_LEASE,
+                       max_depth=settings.WEBHOOK_QUEUE_MAXSIZE)
+
+
+_queue = ProcessSingleton(_open_queue)
+
+
+def queue():
+    """
+    Returns the queue of webhook notifications waiting to be processed.
+    """
+    return _queue.get()
+
+
+def reset_queue():
+    _queue.reset()
+
+
+def enqueue(data):
+    """
+    Queues a webhook notification for a worker to process.
+
+    Raises QueueFull if settings.WEBHOOK_QUEUE_MAXSIZE notifications are
+    already waiting.
+    """
+    try:
+        item_id = queue().put(data)
+    except QueueFull:
+        statsd.incr('webhook_queue.full')
+        raise
+    statsd.incr('webhook_queue.queued')
+    log.info('queued webhook notification {}'.format(item_id))
+
+
+class Progress(object):
+    """
+    Records which steps of processing a queued notification are done, so
+    that a retry doesn't repeat them.
+    """
+
+    def __init__(self, queue, item):
+        self.queue = queue
+        self.item_id = item.id
+        self.steps = dict(item.state or {})
+
+    def run(self, step, func):
+        """
+        Returns func() and saves its result under step. If an earlier
+        attempt already finished step, returns what it saved instead.
+        The result must be JSON serializable.
+        """
+        if step in self.steps:
+            log.info('webhook notification {} already finished {}'
+                     .format(self.item_id, step))
+            return self.steps[step]
+        result = func()
+        self.steps[step] = result
+        self.queue.save_state(self.item_id, self.steps)
+        return result
+
+
+def process_next(process):
+    """
+    Calls process(data, progress) for the next queued notification, where
+    progress is a Progress for it.
+
+    Returns False if there was nothing to process.
+
+    Notifications that fail with one of PERMANENT_ERRORS are moved to the
+    queue's failed table right away. Other failures are retried up to
+    settings.WEBHOOK_RETRIES times, waiting settings.WEBHOOK_RETRY_DELAY
+    seconds before the first retry and twice as long before each next one,
+    and are then moved to the failed table too.
+    """
+    q = queue()
+    item = q.claim()
+    if item is None:
+        return False
+
+    statsd.timing('webhook_queue.lag', (time.time() - item.created) * 1000)
+    try:
+        process(item.data, Progress(q, item))
+    except PERMANENT_ERRORS, exc:
+        log.warning('webhook notification {id} failed and will not be '
+                    'retried: {e.__class__.__name__}: {e}'
+                    .format(id=item.id, e=exc), exc_info=True)
+        statsd.incr('webhook_queue.rejected')
+        q.fail(item.id, traceback.format_exc())
+    except Exception:
+        if item.attempts > settings.WEBHOOK_RETRIES:
+            log.exception('giving up on webhook notification {} after {} '
+                          'attempts'.format(item.id, item.attempts))
+            statsd.incr('webhook_queue.failed')
+            q.fail(item.id, traceback.format_exc())
+        else:
+            log.warning('processing webhook notification {} failed, '
+                        'retrying'.format(item.id), exc_info=True)
+            statsd.incr('webhook_queue.retried')
+            q.retry(item.id, settings.WEBHOOK_RETRY_DELAY *
+                    2 ** (item.attempts - 1))
+    else:
+        log.info('processed webhook notification {}'.format(item.id))
+        statsd.incr('webhook_queue.processed')
+        q.done(item.id)
+    return True
+
+
+def report():
+    """
+    Sends the depth and lag of the queue to statsd.
+    """
+    q = queue()
+    depth = q.depth()
+    statsd.gauge('webhook_queue.depth', depth)
+    statsd.gauge('webhook_queue.oldest', int(q.lag()))
+    statsd.gauge('webhook_queue.failed_depth', q.failed_depth())
+    return depth
+
+
+def run_workers(process, concurrency, poll_interval=1, until_empty=False):
+    """
+    Processes queued notifications on `concurrency` threads.
+
+    Idle threads check for new notifications every `poll_interval` seconds.
+    With until_empty, returns once nothing is left to process; otherwise
+    runs forever.
+    """
+    def work():
+        while True:
+            try:
+                if process_next(process):
+                    continue
+            except Exception:
+                # The queue itself failed; try again later.
+                log.exception('reading the webhook queue')
+            if until_empty:
+                return
+            time.sleep(poll_interval)
+
+    log.info('processing webhook notifications on {} threads'
+             .format(concurrency))
+    threads = []
+    for i in range(concurrency):
+        thread = threading.Thread(target=work,
+                                  name='webhook-worker-{}'.format(i))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    alive = threads
+    while alive:
+        try:
+            report()
+        except Exception:
+            log.exception('reporting on the webhook queue')
+        alive[0].join(poll_interval)
+        alive = [t for t in threads if t.is_alive()]
+    report()
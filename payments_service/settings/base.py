@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 """
 
 import logging.handlers
+import multiprocessing
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -40,13 +41,28 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'payments_service.base.middleware.RequestContextMiddleware',
+    'payments_service.base.middleware.DeadlineMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'payments_service.base.middleware.BuyerVersionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'payments_service.base.middleware.CORSMiddleware',
 )
 
+# Each request has this many seconds to respond. Every Solitude and FxA call
+# draws from the same budget and once it runs out, the remaining calls are
+# skipped. Set it to None to disable deadlines.
+REQUEST_DEADLINE = 20
+
+# Deadlines for specific routes, keyed by URL name. These override
+# REQUEST_DEADLINE.
+REQUEST_DEADLINE_BY_ROUTE = {
+    # Webhooks may look up several Solitude objects and send email.
+    'braintree:webhook': 30,
+}
+
 SESSION_ENGINE = 'encrypted_cookies'
 
 # Do not force secure cookies during development.
@@ -107,6 +123,14 @@ EMAIL_HOST_PASSWORD = os.environ.get('SERVICE_EMAIL_HOST_PASSWORD', '')
 # Not negotiable.
 EMAIL_USE_TLS = True
 
+# With payments_service.base.email.PooledEmailBackend, up to
+# EMAIL_POOL_SIZE logged in connections to the email server are kept open
+# in each process. Connections idle for EMAIL_POOL_MAX_IDLE seconds or
+# that have sent EMAIL_POOL_MAX_MESSAGES messages are closed.
+EMAIL_POOL_SIZE = 4
+EMAIL_POOL_MAX_IDLE = 60
+EMAIL_POOL_MAX_MESSAGES = 100
+
 # A list of regex's that we will allow emails too. If empty then
 # emails will be sent to all address.
 #
@@ -151,8 +175,10 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
         'rest_framework.filters.DjangoFilterBackend',
     ),
+    'EXCEPTION_HANDLER': 'payments_service.base.views.exception_handler',
     'PAGINATE_BY': 20,
-    'PAGINATE_BY_PARAM': 'limit'
+    'PAGINATE_BY_PARAM': 'limit',
+    'MAX_PAGINATE_BY': 100,
 }
 
 SYSLOG_TAG = 'http_app_payments_service'
@@ -207,10 +233,20 @@ NOSE_ARGS = [
     '--with-nicedots',
     '--with-blockage',
     '--http-whitelist=""',
+    # Only allow the local SMTP server that email backends are tested with.
+    '--smtp-whitelist=127.0.0.1',
 ]
 
 UNDER_TEST = os.environ.get('UNDER_TEST') == '1'
 
+# Metrics are sent to statsd.
+STATSD_CLIENT = 'django_statsd.clients.normal'
+if UNDER_TEST:
+    STATSD_CLIENT = 'django_statsd.clients.null'
+STATSD_HOST = os.environ.get('SERVICE_STATSD_HOST', 'localhost')
+STATSD_PORT = int(os.environ.get('SERVICE_STATSD_PORT', 8125))
+STATSD_PREFIX = 'payments_service'
+
 # URL to private payment processor. https://github.com/mozilla/solitude/
 SOLITUDE_URL = os.environ.get('SOLITUDE_URL', 'http://solitude:2602')
 
@@ -218,6 +254,176 @@ SOLITUDE_URL = os.environ.get('SOLITUDE_URL', 'http://solitude:2602')
 SOLITUDE_KEY = 'payments-service'
 SOLITUDE_SECRET = 'please change this'
 
+# Each worker process shares one Solitude client which keeps a pool of
+# keep-alive connections open. This is the maximum number of connections
+# (and therefore concurrent Solitude requests) per process.
+SOLITUDE_POOL_MAXSIZE = int(os.environ.get('SOLITUDE_POOL_MAXSIZE', 10))
+# The number of per-host connection pools to keep. Solitude is a single
+# host so there's no need to change this.
+SOLITUDE_POOL_CONNECTIONS = 1
+
+# Solitude responses for these resources are cached across requests.
+# Each key is a resource path, as a dot-separated Curling attribute path,
+# and each value is how many seconds to cache it for. Only add resources
+# that never (or very rarely) change; buyer data such as payment methods
+# must never be listed here.
+SOLITUDE_CACHE_TTLS = {
+    'generic.product': 300,
+    'generic.seller': 300,
+}
+# The maximum number of Solitude responses to cache per process.
+SOLITUDE_CACHE_MAXSIZE = 1000
+
+# Maximum number of seconds to wait for any single Solitude call.
+SOLITUDE_TIMEOUT = 10
+
+# Circuit breaker for Solitude. When at least SOLITUDE_BREAKER_MIN_CALLS
+# calls were made in the last SOLITUDE_BREAKER_WINDOW seconds and
+# SOLITUDE_BREAKER_FAILURE_RATE of them failed (connection errors,
+# timeouts or 5xx responses), Solitude calls fail immediately with a 503
+# for SOLITUDE_BREAKER_COOLDOWN seconds. After that, one probe call
+# decides whether to close the circuit again.
+SOLITUDE_BREAKER_FAILURE_RATE = 0.5
+SOLITUDE_BREAKER_MIN_CALLS = 10
+SOLITUDE_BREAKER_WINDOW = 30
+SOLITUDE_BREAKER_COOLDOWN = 15
+
+# When expanding Solitude URIs into sub-objects, this is the maximum
+# number of URIs that a single request will fetch at the same time.
+# Set this to 1 to fetch them one after another.
+SOLITUDE_EXPAND_CONCURRENCY = int(
+    os.environ.get('SOLITUDE_EXPAND_CONCURRENCY', 5))
+
+# When expanding several URIs of one of these resources, they are fetched
+# with a single pk__in list call instead of one call per URI. Resources
+# that turn out not to support the filter are fetched one by one again
+# for SOLITUDE_BULK_EXPAND_RETRY seconds.
+SOLITUDE_BULK_EXPAND = (
+    'generic.transaction',
+)
+SOLITUDE_BULK_EXPAND_RETRY = 600
+
+# Lists of expanded Solitude objects with at least this many rows are
+# streamed to the client, SOLITUDE_STREAM_CHUNK_SIZE rows at a time.
+# Set it to None to never stream.
+SOLITUDE_STREAM_MIN_ROWS = 100
+SOLITUDE_STREAM_CHUNK_SIZE = 20
+
+# The default cache only lives in each process, so what one process
+# stores or deletes there is not seen by any other. Set
+# SERVICE_CACHE_BACKEND and SERVICE_CACHE_LOCATION to share it, for example
+# django.core.cache.backends.memcached.MemcachedCache and host:11211 (the
+# backend's client library must be installed).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'SERVICE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('SERVICE_CACHE_LOCATION', ''),
+    },
+}
+
+# Read endpoints send a strong ETag and answer a matching If-None-Match
+# with a 304. Normally the ETag is a hash of the response so Solitude is
+# still called. When ETAG_VERSION_STAMPS is True, each buyer's data gets a
+# version stamp in the ETAG_VERSION_CACHE cache instead and a request with
+# a current ETag gets a 304 without calling Solitude at all. The stamp
+# changes whenever the buyer writes something or a webhook arrives for
+# them, and at least every ETAG_VERSION_TTL seconds to pick up any other
+# change. A bump made by one process, such as process_webhooks, only
+# reaches the others through a cache that all processes share, so this
+# can't be enabled with the default per-process cache (see CACHES).
+ETAG_VERSION_STAMPS = False
+ETAG_VERSION_CACHE = 'default'
+ETAG_VERSION_TTL = 60
+
+# After finding the buyer, sign-in makes up to this many Solitude calls at
+# the same time. Set this to 1 to make them one after another.
+SIGN_IN_CONCURRENCY = 2
+
+# Writes that a response doesn't need to wait for, such as updating a
+# buyer's email on sign-in, are made by a background thread in each process.
+# At most WRITE_BEHIND_MAXSIZE writes are queued; beyond that they are
+# made right away. A failed write is retried WRITE_BEHIND_RETRIES times,
+# waiting WRITE_BEHIND_BACKOFF seconds before the first retry and twice as
+# long before each next one. When a process exits, it waits up to
+# WRITE_BEHIND_SHUTDOWN_TIMEOUT seconds for queued writes to be made.
+WRITE_BEHIND_MAXSIZE = 1000
+WRITE_BEHIND_RETRIES = 3
+WRITE_BEHIND_BACKOFF = 1
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = 10
+
+# Each process keeps up to BRAINTREE_TOKEN_POOL_SIZE anonymous Braintree
+# client tokens generated ahead of time, so that starting a payment doesn't
+# wait for Solitude and Braintree. Tokens older than
+# BRAINTREE_TOKEN_POOL_MAX_AGE seconds are thrown away; this must be well
+# below the lifetime of a Braintree client token. If generating tokens
+# fails, the pool waits BRAINTREE_TOKEN_POOL_RETRY seconds before trying
+# again. A size of 0 generates every token on demand.
+BRAINTREE_TOKEN_POOL_SIZE = int(
+    os.environ.get('SERVICE_BRAINTREE_TOKEN_POOL_SIZE', 0))
+BRAINTREE_TOKEN_POOL_MAX_AGE = 60 * 10
+BRAINTREE_TOKEN_POOL_RETRY = 5
+
+# HTML emails are premailed (their CSS is moved into style attributes) once
+# per template instead of once per email. Templates that the premail
+# command wrote to PREMAILED_EMAIL_DIR are used until the templates they
+# were made from change. Others are premailed the first time they are
+# sent, or when the process starts if PREMAIL_AT_STARTUP is True.
+# Premailing fetches the CSS from EMAIL_URL_ROOT, so with
+# PREMAIL_AT_STARTUP the process does not start handling requests until
+# that fetch finishes or times out; prefer running the premail command.
+# Set PREMAIL_TEMPLATES to False to premail every email instead.
+PREMAIL_TEMPLATES = True
+PREMAILED_EMAIL_DIR = os.path.join(BASE_DIR, 'braintree', 'templates',
+                                   'braintree', 'emails', 'premailed')
+PREMAIL_AT_STARTUP = False
+
+# When EMAIL_RENDER_POOL is True, email is rendered by a pool of
+# EMAIL_RENDER_PROCESSES processes so that several emails can be rendered
+# at the same time. At most EMAIL_RENDER_QUEUE_SIZE emails wait for or are
+# being rendered by the pool; beyond that, or when the pool takes longer
+# than EMAIL_RENDER_TIMEOUT seconds, email is rendered by the process that
+# sends it. The pool is started by the process_webhooks command, or by a
+# web process the first time it sends email, and is started again once
+# EMAIL_RENDER_PROCESSES renders have timed out without finishing. Each
+# render process is a fork of the process that started the pool, so it
+# shares that process's memory at first, but every page it writes to
+# (which the garbage collector and reference counting do constantly)
+# gets copied. Over time, expect each render process to take about as
+# much memory as a web worker.
+EMAIL_RENDER_POOL = os.environ.get('SERVICE_EMAIL_RENDER_POOL') == '1'
+EMAIL_RENDER_PROCESSES = int(os.environ.get('SERVICE_EMAIL_RENDER_PROCESSES',
+                                            multiprocessing.cpu_count()))
+EMAIL_RENDER_QUEUE_SIZE = 100
+EMAIL_RENDER_TIMEOUT = 30
+
+# When set to the path of a SQLite database file, webhook notifications
+# from Braintree are queued there and acknowledged right away. They are
+# verified and acted on by the process_webhooks command, which runs
+# WEBHOOK_WORKERS threads. A notification that fails is retried
+# WEBHOOK_RETRIES times, waiting WEBHOOK_RETRY_DELAY seconds before the
+# first retry and twice as long before each next one, unless the error is
+# one that would only happen again (see webhook_queue.PERMANENT_ERRORS).
+# Notifications that are not retried are kept in the database file's
+# failed table. A worker that hasn't
+# finished with a notification after WEBHOOK_LEASE seconds is assumed to
+# have died and the notification is handed to another worker; the steps
+# the first worker finished, such as emailing the buyer, are not repeated.
+# Once WEBHOOK_QUEUE_MAXSIZE notifications are waiting, new ones get a 503
+# so that Braintree sends them again later. When not set, notifications
+# are processed before responding to Braintree.
+WEBHOOK_QUEUE = os.environ.get('SERVICE_WEBHOOK_QUEUE')
+WEBHOOK_WORKERS = int(os.environ.get('SERVICE_WEBHOOK_WORKERS', 4))
+WEBHOOK_RETRIES = 5
+WEBHOOK_RETRY_DELAY = 60
+WEBHOOK_LEASE = 60 * 5
+WEBHOOK_QUEUE_MAXSIZE = 10000
+
+# Number of threads each process keeps for running downstream calls
+# concurrently. This is shared by all requests.
+THREAD_POOL_SIZE = int(os.environ.get('SERVICE_THREAD_POOL_SIZE', 20))
+
 env_creds = os.environ.get('SERVICE_FXA_CREDENTIALS')
 if env_creds:
     if ':' not in env_creds:
@@ -246,6 +452,47 @@ else:
 FXA_OAUTH_URL = (os.environ.get('SERVICE_FXA_OAUTH_URL') or
                  'https://oauth-stable.dev.lcip.org')
 
+# Maximum number of seconds to wait for any single FxA call.
+FXA_TIMEOUT = 10
+
+# Each worker process keeps a pool of keep-alive connections to the FxA
+# OAuth server. This is the maximum number of connections (and therefore
+# concurrent FxA requests) per process.
+FXA_POOL_MAXSIZE = int(os.environ.get('SERVICE_FXA_POOL_MAXSIZE', 10))
+# How many times to retry an FxA request that could not connect.
+FXA_CONNECT_RETRIES = 2
+
+# Verified FxA access tokens are cached per process so that signing in
+# again with the same token doesn't call FxA. Entries last until the token
+# expires or for FXA_TOKEN_CACHE_TTL seconds, whichever is sooner, so
+# this is also how long a revoked token may still be accepted. Tokens that
+# FxA rejected are cached for FXA_TOKEN_CACHE_NEGATIVE_TTL seconds.
+# Set FXA_TOKEN_CACHE_MAXSIZE to 0 to disable the cache.
+FXA_TOKEN_CACHE_TTL = 300
+FXA_TOKEN_CACHE_NEGATIVE_TTL = 10
+FXA_TOKEN_CACHE_MAXSIZE = 10000
+
+# When True, signed (JWT) FxA access tokens are verified locally with the
+# public keys published at FXA_JWKS_URL instead of asking FxA. Opaque
+# tokens, tokens without an email claim and tokens signed by an unknown
+# key are still verified by FxA. The keys are refreshed in the background
+# once they are FXA_JWKS_MAX_AGE seconds old. If FXA_JWT_ISSUER is set,
+# tokens must have been issued by it.
+FXA_JWT_VERIFICATION = False
+FXA_JWKS_URL = (os.environ.get('SERVICE_FXA_JWKS_URL') or
+                FXA_OAUTH_URL.rstrip('/') + '/v1/jwks')
+FXA_JWKS_MAX_AGE = 3600
+FXA_JWT_ISSUER = os.environ.get('SERVICE_FXA_JWT_ISSUER')
+
+
+# Buyers known to have a Braintree customer are remembered in this cache,
+# for BRAINTREE_CUSTOMER_CACHE_TTL seconds, so that signing in doesn't
+# have to look the customer up again. Only customers that exist are
+# remembered, so nothing goes stale, but with the default per-process
+# cache (see CACHES) each process looks each buyer up once. Use a cache
+# that all processes share so that each buyer is only looked up once.
+BRAINTREE_CUSTOMER_CACHE = 'default'
+BRAINTREE_CUSTOMER_CACHE_TTL = 60 * 60 * 24
 
 # When emailing buyers about their subscriptions, this
 # will be the reply-to address. If a buyer replies to
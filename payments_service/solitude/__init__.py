@@ -1,25 +1,80 @@
+import copy
 import logging
+import resource
+import sys
+import time
+from collections import deque
 
 from django.conf import settings
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
 
 from curling.lib import API
+from django_statsd.clients import statsd
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from slumber.exceptions import HttpClientError
 
+from ..base import context, deadline, etags
+from ..base.concurrency import ProcessSingleton, bounded_map
 from ..base.views import error_400, error_405
+from . import fields
+from .session import SolitudeSession
 
 log = logging.getLogger(__name__)
 
+# Resources that turned out not to support pk__in lists, mapped to the
+# time when they should be fetched in bulk again. See
+# SolitudeAPIView._bulk_fetch().
+_bulk_unsupported = {}
+# Linux's getrusage() flag for the calling thread, which Python 2 doesn't
+# define.
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', 1)
+
 
 def api():
-    conn = SolitudeAPI(settings.SOLITUDE_URL)
+    """
+    Returns the Solitude API client for this process.
+
+    The client is created on first use and shared by all threads. It sends
+    requests through a pooled session so that connections to Solitude are
+    kept alive between requests.
+    """
+    return _api.get()
+
+
+def connect():
+    """
+    Returns a new, OAuth-activated Solitude API client.
+    """
+    session = SolitudeSession(
+        pool_connections=settings.SOLITUDE_POOL_CONNECTIONS,
+        pool_maxsize=settings.SOLITUDE_POOL_MAXSIZE)
+    conn = SolitudeAPI(settings.SOLITUDE_URL, session=session)
     conn.activate_oauth(settings.SOLITUDE_KEY,
                         settings.SOLITUDE_SECRET)
+    log.info('connected to solitude at {url} with a pool of {size} '
+             'connections'.format(url=settings.SOLITUDE_URL,
+                                  size=settings.SOLITUDE_POOL_MAXSIZE))
     return conn
 
 
+_api = ProcessSingleton(connect, close=lambda api: api.session.close())
+
+
+def reset_api():
+    """
+    Discards the shared Solitude API client and closes its connections.
+
+    The next call to api() will create a new client. This is useful when
+    Solitude settings change, such as in tests.
+    """
+    _api.reset()
+    _bulk_unsupported.clear()
+
+
 def url_parser(url):
     """
     Curling URL parser for resources with numeric primary keys.
@@ -38,20 +93,220 @@ def url_parser(url):
     return parts, pk
 
 
+def thread_cpu_time():
+    """
+    Returns the CPU time, in seconds, used by the current thread so far
+    or None where it can't be measured.
+
+    Unlike time.clock(), this doesn't include the time of other threads
+    serving other requests.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    usage = resource.getrusage(RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+class NotModified(Exception):
+    """
+    Raised to answer a conditional GET with a 304 before calling Solitude.
+    """
+
+    def __init__(self, etag):
+        self.etag = etag
+        super(NotModified, self).__init__('not modified: {}'.format(etag))
+
+
+def not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
 class SolitudeAPI(API):
 
+    @property
+    def session(self):
+        """
+        The requests session that all Solitude calls are sent through.
+        """
+        return self._store['session']
+
     def by_url(self, url, **kw):
         kw.setdefault('parser', url_parser)
         return super(SolitudeAPI, self).by_url(url, **kw)
 
 
 class SolitudeAPIView(APIView):
+    # Functions that can expand a URI without necessarily calling Solitude,
+    # keyed by the attribute they expand. Each one is called like
+    # provider(uri, fetch) and can call fetch(uri) to load the object
+    # from Solitude.
+    # Example: expansion_providers = {'seller_product': catalog.expand}
+    expansion_providers = {}
 
     def __init__(self, *args, **kw):
         super(SolitudeAPIView, self).__init__(*args, **kw)
         # Get a sys.modules reference so that mocking from tests is easier.
         from payments_service import solitude
         self.api = solitude.api()
+        self.version_etag = None
+
+    def initial(self, request, *args, **kw):
+        super(SolitudeAPIView, self).initial(request, *args, **kw)
+        buyer_uuid = getattr(request.user, 'uuid', None)
+        if (request.method == 'GET' and settings.ETAG_VERSION_STAMPS and
+                buyer_uuid):
+            self.version_etag = etags.version_etag(
+                etags.buyer_version(buyer_uuid), request)
+            if etags.if_none_match(request, self.version_etag):
+                # The client is up to date; skip the handler and Solitude.
+                raise NotModified(self.version_etag)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return not_modified(exc.etag)
+        return super(SolitudeAPIView, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kw):
+        """
+        Adds a strong ETag to successful GET responses and turns them
+        into a 304 when the client's If-None-Match already matches.
+
+        The ETag is made from the buyer's version stamp when
+        settings.ETAG_VERSION_STAMPS is enabled or from a hash of the
+        content otherwise. Streamed responses get no ETag: hashing them
+        would mean buffering them, and a stream that fails partway must
+        not be cached under a version stamp that stays valid.
+        """
+        response = super(SolitudeAPIView, self).finalize_response(
+            request, response, *args, **kw)
+        if (request.method != 'GET' or response.status_code != 200 or
+                response.streaming):
+            return response
+
+        etag = self.version_etag
+        if not etag:
+            if hasattr(response, 'render'):
+                response.render()
+            etag = etags.content_etag(response.content)
+            if etags.if_none_match(request, etag):
+                return not_modified(etag)
+        response['ETag'] = etag
+        return response
+
+    def selected_paths(self, param):
+        """
+        Returns the set of attribute paths that the client selected with
+        a query parameter such as ?fields=resource_uri,seller_product.name
+        or None if the client did not send the parameter.
+        """
+        request = getattr(self, 'request', None)
+        params = getattr(request, 'query_params', {})
+        if param not in params:
+            return None
+        return fields.parse_paths(params.getlist(param))
+
+    def select_fields(self, result):
+        """
+        Returns the result with only the attributes that the client asked
+        for with ?fields=. Without that parameter, the result is unchanged.
+        """
+        paths = self.selected_paths('fields')
+        if paths is None:
+            return result
+        return fields.project(result, fields.path_tree(paths))
+
+    def _wanted_expansions(self, to_expand):
+        field_paths = self.selected_paths('fields')
+        expand_paths = self.selected_paths('expand')
+
+        def is_wanted(path):
+            if field_paths is not None and not fields.covers(field_paths,
+                                                             path):
+                return False
+            if expand_paths is not None and not any(
+                    p == path or p.startswith(path + '.')
+                    for p in expand_paths):
+                return False
+            return True
+
+        return fields.prune_expansions(to_expand, is_wanted)
+
+    def expanded_list_response(self, key, objects, to_expand, extra=None):
+        """
+        Returns a response of {key: objects} with objects expanded like
+        expand_api_objects(). Other attributes can be added with extra.
+
+        When there are at least settings.SOLITUDE_STREAM_MIN_ROWS objects,
+        the response is streamed: objects are expanded and encoded a few
+        at a time, settings.SOLITUDE_STREAM_CHUNK_SIZE per chunk, so that
+        the client gets the first bytes sooner and the expanded list is
+        never held in memory all at once. A streamed response has the same
+        bytes as a buffered one, unless an object can't be expanded. The
+        list then ends early and is followed by an "error" attribute,
+        since the 200 status has already been sent.
+        """
+        min_rows = settings.SOLITUDE_STREAM_MIN_ROWS
+        if not min_rows or len(objects) < min_rows:
+            data = dict(extra or {})
+            data[key] = self.expand_api_objects(objects, to_expand)
+            return Response(data, status=200)
+
+        log.info('streaming {} {}'.format(len(objects), key))
+        request_deadline = deadline.current()
+        return StreamingHttpResponse(
+            self._stream_list(key, objects, to_expand, extra or {},
+                              settings.SOLITUDE_STREAM_CHUNK_SIZE,
+                              request_deadline and request_deadline.seconds),
+            content_type='application/json')
+
+    def _stream_list(self, key, objects, to_expand, extra, chunk_size,
+                     seconds):
+        # The response is iterated after the request has ended and its
+        # context was closed, maybe long after its deadline. The stream
+        # gets a context of its own with a deadline as long as the
+        # request's.
+        values = {}
+        with context.inherit(values):
+            if seconds:
+                deadline.start(seconds)
+
+        # Encode like JSONRenderer so that the bytes are the same as those
+        # of a buffered response.
+        render = JSONRenderer().render
+        placeholder = '<{} {}>'.format(key, id(values))
+        head, tail = render(dict(extra, **{key: placeholder})).split(
+            render(placeholder))
+        # Take the rows out of the list so that each chunk can be freed
+        # once it has been sent.
+        rows = deque(objects)
+        del objects[:]
+
+        try:
+            yield head + '['
+            first = True
+            while rows:
+                chunk = [rows.popleft()
+                         for i in range(min(chunk_size, len(rows)))]
+                try:
+                    with context.inherit(values):
+                        chunk = self.expand_api_objects(chunk, to_expand)
+                except Exception:
+                    log.exception('expanding a streamed {} list'.format(key))
+                    statsd.incr('solitude.stream.failed')
+                    yield '],{}:{}{}'.format(
+                        render('error'),
+                        render('could not expand every object; the {} list '
+                               'is incomplete'.format(key)),
+                        tail)
+                    return
+                encoded = ','.join(render(row) for row in chunk)
+                yield encoded if first else ',' + encoded
+                first = False
+            yield ']' + tail
+        finally:
+            context.close(values)
 
     def expand_api_objects(self, objects, to_expand):
         """
@@ -89,48 +344,166 @@ class SolitudeAPIView(APIView):
             self.expand_api_objects(objects,
                                     [{'transaction_uri': ['product_uri']}])
 
+        URIs are fetched one nesting level at a time. Within a level,
+        URIs of the resources in settings.SOLITUDE_BULK_EXPAND are
+        fetched with one list call per resource. All other fetches are
+        made concurrently, up to settings.SOLITUDE_EXPAND_CONCURRENCY
+        at once. Attributes with an entry in `expansion_providers` are
+        expanded by that provider.
+
+        Clients can choose what to get back with query parameters:
+        ?expand= limits expansion to the listed attribute paths and
+        ?fields= limits the objects to the listed attribute paths. URIs
+        that would not be returned are never expanded.
         """
-
-        def expand(leaf, to_expand):
-            log.debug('expanding {} within {}'.format(to_expand, leaf))
-            # Make a map of attributes that we need to expand and their
-            # corresponding value. If the value is a dict, it will
-            # indicate nested expansion.
-            attr_map = {}
-            for a in to_expand:
-                if isinstance(a, dict):
-                    for sub_key in a:
-                        attr_map[sub_key] = a
-                else:
-                    attr_map[a] = None
-
-            for attr, uri in leaf.iteritems():
-                if attr in attr_map:
-                    # TODO: adjust Solitude's output so that we don't have to
-                    # make sub requests.
-                    log.info('expanding object result by calling URI "{}": {}'
-                             .format(attr, uri))
-                    sub_objects = self.api.by_url(uri).get_object()
-                    leaf[attr] = sub_objects
-
-                    # Check if the mapped attribute has nested expansions.
-                    if isinstance(attr_map[attr], dict):
-                        # To detect nesting easier, the attribute mapping links
-                        # to the actual expansion.
-                        # For example, to expand product within transaction,
-                        # it would be mapped like:
-                        # {"transaction": {"transaction": ["product"]}}
-                        # This is different from a single level
-                        # attribute (no nesting) which would look like:
-                        # {"transaction": None}
-                        expand(sub_objects, attr_map[attr][attr])
-
         if not isinstance(objects, list):
             raise TypeError('expected a list of objects to expand')
-        for sub in objects:
-            expand(sub, to_expand)
 
-        return objects
+        to_expand = self._wanted_expansions(to_expand)
+
+        # Each level is a list of (leaf, to_expand) pairs.
+        level = [(sub, to_expand) for sub in objects]
+        while level:
+            fetches = []
+            for leaf, leaf_to_expand in level:
+                log.debug('expanding {} within {}'.format(leaf_to_expand,
+                                                          leaf))
+                attr_map = self._expansion_map(leaf_to_expand)
+                for attr, uri in leaf.iteritems():
+                    if attr in attr_map:
+                        fetches.append((leaf, attr, uri, attr_map[attr]))
+
+            sub_objects = self._expand_attributes(
+                [(attr, uri) for _, attr, uri, _ in fetches])
+
+            next_level = []
+            for (leaf, attr, uri, nested), sub in zip(fetches, sub_objects):
+                leaf[attr] = sub
+                # Check if the mapped attribute has nested expansions.
+                if isinstance(nested, dict):
+                    # To detect nesting easier, the attribute mapping links
+                    # to the actual expansion.
+                    # For example, to expand product within transaction,
+                    # it would be mapped like:
+                    # {"transaction": {"transaction": ["product"]}}
+                    # This is different from a single level
+                    # attribute (no nesting) which would look like:
+                    # {"transaction": None}
+                    next_level.append((sub, nested[attr]))
+            level = next_level
+
+        return self.select_fields(objects)
+
+    def _expansion_map(self, to_expand):
+        """
+        Make a map of attributes that we need to expand and their
+        corresponding value. If the value is a dict, it will
+        indicate nested expansion.
+        """
+        attr_map = {}
+        for a in to_expand:
+            if isinstance(a, dict):
+                for sub_key in a:
+                    attr_map[sub_key] = a
+            else:
+                attr_map[a] = None
+        return attr_map
+
+    def _expand_attributes(self, attrs_and_uris):
+        """
+        Returns the expanded object for each (attr, uri) pair, in order.
+        """
+        # Group the URIs that can be fetched in bulk by resource.
+        pks_by_resource = {}
+        for attr, uri in attrs_and_uris:
+            if attr in self.expansion_providers:
+                continue
+            parts, pk = url_parser(uri)
+            resource = '.'.join(parts)
+            if (pk and resource in settings.SOLITUDE_BULK_EXPAND and
+                    _bulk_unsupported.get(resource, 0) <= time.time()):
+                pks_by_resource.setdefault(resource, set()).add(pk)
+        groups = [(name, pks) for name, pks in pks_by_resource.items()
+                  if len(pks) > 1]
+
+        # Objects fetched in bulk, keyed by (resource, pk).
+        found = {}
+        for objects in bounded_map(self._bulk_fetch, groups,
+                                   settings.SOLITUDE_EXPAND_CONCURRENCY):
+            found.update(objects)
+
+        def expand(attr_and_uri):
+            attr, uri = attr_and_uri
+            if attr not in self.expansion_providers:
+                parts, pk = url_parser(uri)
+                key = ('.'.join(parts), pk)
+                if key in found:
+                    # Each occurrence gets its own copy since nested
+                    # expansion changes it.
+                    return copy.deepcopy(found[key])
+            return self._expand_attribute(attr_and_uri)
+
+        return bounded_map(expand, attrs_and_uris,
+                           settings.SOLITUDE_EXPAND_CONCURRENCY)
+
+    def _bulk_fetch(self, resource_and_pks):
+        """
+        Fetches several objects of one resource with a single list call.
+
+        Returns a dict of the objects found, keyed by (resource, pk).
+        Objects that are missing from the list, or that couldn't be listed,
+        are later fetched one by one. If the resource ignores the pk__in
+        filter or rejects it with a 400, it is not fetched in bulk again
+        for settings.SOLITUDE_BULK_EXPAND_RETRY seconds.
+        """
+        resource, pks = resource_and_pks
+        pks = sorted(pks)
+        uri = '/{}/'.format('/'.join(resource.split('.')))
+        log.info('expanding {} objects with one list call to "{}"'
+                 .format(len(pks), uri))
+        try:
+            objects = self.api.by_url(uri).get(pk__in=','.join(pks),
+                                               limit=len(pks))
+        except HttpClientError, exc:
+            status = getattr(getattr(exc, 'response', None), 'status_code',
+                             None)
+            if status != 400:
+                # Something else went wrong with this call, such as a 404
+                # or 429. Only these objects are fetched one by one.
+                log.warning('{}: listing objects failed: {}'.format(uri, exc))
+                statsd.incr('solitude.bulk_expand.failed')
+                return {}
+            log.warning('{}: pk__in is not supported: {}'.format(uri, exc))
+            objects = None
+
+        if (not isinstance(objects, list) or
+                any(str(obj.get('resource_pk')) not in pks
+                    for obj in objects)):
+            # The filter was ignored or rejected.
+            retry = settings.SOLITUDE_BULK_EXPAND_RETRY
+            log.warning('not expanding {} objects in bulk for {}s'
+                        .format(resource, retry))
+            statsd.incr('solitude.bulk_expand.unsupported')
+            _bulk_unsupported[resource] = time.time() + retry
+            return {}
+
+        found = dict(((resource, str(obj['resource_pk'])), obj)
+                     for obj in objects)
+        statsd.incr('solitude.bulk_expand.fetched', len(found))
+        return found
+
+    def _expand_attribute(self, attr_and_uri):
+        attr, uri = attr_and_uri
+        provider = self.expansion_providers.get(attr)
+        if provider:
+            return provider(uri, self._fetch_expansion)
+        return self._fetch_expansion(uri)
+
+    def _fetch_expansion(self, uri):
+        # TODO: adjust Solitude's output so that we don't have to
+        # make sub requests.
+        log.info('expanding object result by calling URI "{}"'.format(uri))
+        return self.api.by_url(uri).get_object()
 
 
 class AnonymousSolitudeAPIView(SolitudeAPIView):
@@ -159,6 +532,30 @@ class SolitudeBodyguard(SolitudeAPIView):
     # would be:
     # resource = 'services.status'
     resource = None
+    # When True, GET responses for a single object are sent to the client
+    # exactly as Solitude returned them, without decoding and re-encoding
+    # the JSON. The body is still read in full rather than streamed since
+    # responses are shared through the identity map and caches of
+    # SolitudeSession. List responses are always decoded because Solitude
+    # wraps them in a meta/objects envelope that clients never see.
+    passthrough = False
+
+    def dispatch(self, request, *args, **kw):
+        self.passed_through = False
+        start = thread_cpu_time()
+        response = super(SolitudeBodyguard, self).dispatch(request, *args,
+                                                           **kw)
+        # Render now so that encoding the response is part of the
+        # measurement.
+        if hasattr(response, 'render'):
+            response.render()
+        if start is not None:
+            cpu_ms = (thread_cpu_time() - start) * 1000
+            statsd.timing('solitude.bodyguard.{view}.{mode}.cpu'.format(
+                view=self.__class__.__name__,
+                mode='passthrough' if self.passed_through else 'decoded'),
+                cpu_ms)
+        return response
 
     def replace_call_args(self, django_request, method, args, kw):
         """
@@ -191,8 +588,11 @@ class SolitudeBodyguard(SolitudeAPIView):
         return args, kw
 
     def get(self, request, pk=None):
-        return self._api_request(request, 'get', resource_pk=pk,
-                                 **request.REQUEST)
+        # Field selection is done here, not by Solitude.
+        params = dict((key, request.REQUEST[key])
+                      for key in request.REQUEST.keys()
+                      if key not in ('fields', 'expand'))
+        return self._api_request(request, 'get', resource_pk=pk, **params)
 
     def patch(self, request, pk=None):
         if pk is None:
@@ -212,7 +612,8 @@ class SolitudeBodyguard(SolitudeAPIView):
             return error_405()
 
         # Get the endpoint + method, such as api.services.status.get
-        api_request = getattr(self._resource(pk=resource_pk), method)
+        resource = self._resource(pk=resource_pk)
+        api_request = getattr(resource, method)
 
         # Allow this view to replace call args if it wants to.
         args, kw = self.replace_call_args(django_request, method.lower(),
@@ -224,14 +625,30 @@ class SolitudeBodyguard(SolitudeAPIView):
                          args=args, kw=kw,
                          instance='({})'.format(resource_pk)
                                   if resource_pk else ''))
+        pass_through = (self.passthrough and resource_pk and
+                        method.lower() == 'get' and
+                        django_request.method.lower() == 'get' and
+                        self.selected_paths('fields') is None)
         try:
+            if pass_through:
+                return self._pass_through(resource, kw)
             result = api_request(*args, **kw)
         except HttpClientError, exc:
             log.warn('{api}: solitude returned 400: {details}'
                      .format(api=api_request, details=exc))
             return error_400(exception=exc)
 
-        return Response(result)
+        return Response(self.select_fields(result))
+
+    def _pass_through(self, resource, params):
+        """
+        Returns Solitude's response to a GET as is.
+        """
+        res = resource._request('GET', params=params)
+        self.passed_through = True
+        return HttpResponse(res.content, status=res.status_code,
+                            content_type=res.headers.get('Content-Type',
+                                                         'application/json'))
 
     def _resource(self, pk=None):
         """
@@ -0,0 +1,81 @@
+def parse_paths(values):
+    """
+    Returns the set of dot-separated attribute paths in a list of
+    comma-separated query parameter values.
+
+    For example, ['resource_uri,seller_product.public_id'] returns
+    set(['resource_uri', 'seller_product.public_id'])
+    """
+    paths = set()
+    for value in values:
+        paths.update(p.strip() for p in value.split(',') if p.strip())
+    return paths
+
+
+def path_tree(paths):
+    """
+    Returns a nested dict of the attributes in a set of paths.
+
+    For example, ['a', 'b.c', 'b.d'] returns {'a': {}, 'b': {'c': {}, 'd': {}}}
+    An empty dict means the whole attribute.
+    """
+    tree = {}
+    for path in sorted(paths, key=len):
+        node = tree
+        for part in path.split('.'):
+            if part in node and not node[part]:
+                # The whole attribute was already selected.
+                break
+            node = node.setdefault(part, {})
+    return tree
+
+
+def project(value, tree):
+    """
+    Returns value with only the attributes in tree.
+
+    Lists are projected item by item. Attributes in tree that value does
+    not have are ignored.
+    """
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return dict((attr, project(value[attr], sub_tree))
+                for attr, sub_tree in tree.items() if attr in value)
+
+
+def covers(paths, path):
+    """
+    Returns True if the set of selected paths includes any part of path.
+    """
+    for selected in paths:
+        if (selected == path or selected.startswith(path + '.') or
+                path.startswith(selected + '.')):
+            return True
+    return False
+
+
+def prune_expansions(to_expand, is_wanted, prefix=''):
+    """
+    Returns the expansions in to_expand, in the format used by
+    SolitudeAPIView.expand_api_objects(), for which is_wanted(path)
+    returns True.
+
+    For example, if only 'transaction' is wanted then
+    [{'transaction': ['seller_product']}] becomes ['transaction']
+    """
+    pruned = []
+    for attr in to_expand:
+        if isinstance(attr, dict):
+            for name, nested in attr.items():
+                path = prefix + name
+                if not is_wanted(path):
+                    continue
+                nested = prune_expansions(nested, is_wanted, path + '.')
+                pruned.append({name: nested} if nested else name)
+        elif is_wanted(prefix + attr):
+            pruned.append(attr)
+    return pruned
@@ -0,0 +1,164 @@
+import base64
+import binascii
+import json
+
+from django import forms
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.settings import api_settings
+
+
+# The order of rows in every page. Rows that were created at the same
+# time are told apart by primary key so that the order never changes.
+# Solitude takes one order_by parameter per field.
+ORDER_BY = ['created', 'id']
+
+
+def encode_cursor(created, pk, ties=1):
+    """
+    Returns an opaque cursor that points after the row with the created
+    date and primary key pk.
+
+    ties is how many rows up to and including that one were created at
+    the same time; the next page skips them.
+    """
+    return base64.urlsafe_b64encode(json.dumps({'created': created,
+                                                'pk': pk,
+                                                'ties': ties}))
+
+
+def decode_cursor(cursor):
+    """
+    Returns a dict of the created, pk and ties values in a cursor.
+
+    Raises ValueError if the cursor is not valid.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('invalid cursor')
+    if (not isinstance(data, dict) or
+            not isinstance(data.get('created'), basestring) or
+            not is_count(data.get('pk')) or
+            not is_count(data.get('ties'))):
+        raise ValueError('invalid cursor')
+    return data
+
+
+def is_count(value):
+    # bool is a subclass of int but True is not a count.
+    return (isinstance(value, (int, long)) and
+            not isinstance(value, bool) and value >= 0)
+
+
+class PageForm(forms.Form):
+    """
+    Validates the query parameters for one page of a Solitude list.
+
+    limit
+        Maximum number of rows to return. This defaults to
+        REST_FRAMEWORK['PAGINATE_BY'] and can't be more than
+        REST_FRAMEWORK['MAX_PAGINATE_BY'].
+    cursor
+        The next_cursor value of the previous page.
+    since
+        Only return rows created after this ISO 8601 date and time.
+
+    Rows are ordered by ORDER_BY. A cursor points after the last row of
+    the previous page rather than at an offset so that rows created or
+    deleted in the meantime don't make pages skip or repeat rows.
+    """
+    cursor = forms.CharField(required=False)
+    since = forms.CharField(required=False)
+
+    def __init__(self, data, *args, **kw):
+        # Only keep our own parameters. Take the last value of each one.
+        data = dict((key, data[key]) for key in ('limit', 'cursor', 'since')
+                    if key in data)
+        super(PageForm, self).__init__(data, *args, **kw)
+        # Set up the limit lazily for testing.
+        self.fields['limit'] = forms.IntegerField(
+            min_value=1, max_value=api_settings.MAX_PAGINATE_BY,
+            required=False)
+
+    @classmethod
+    def is_requested(cls, data):
+        """
+        Returns True if the client asked for a page.
+        """
+        return any(key in data for key in ('limit', 'cursor', 'since'))
+
+    def clean_cursor(self):
+        cursor = self.cleaned_data['cursor']
+        if not cursor:
+            return None
+        try:
+            return decode_cursor(cursor)
+        except ValueError:
+            raise forms.ValidationError('invalid cursor')
+
+    def clean_since(self):
+        since = self.cleaned_data['since']
+        if not since:
+            return None
+        try:
+            parsed = parse_datetime(since)
+        except ValueError:
+            parsed = None
+        if not parsed:
+            raise forms.ValidationError('Enter a valid date/time.')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.utc)
+        return parsed.isoformat()
+
+    def clean(self):
+        data = self.cleaned_data
+        data['limit'] = data.get('limit') or api_settings.PAGINATE_BY
+        return data
+
+    def solitude_params(self):
+        """
+        Returns the parameters that ask Solitude for this page.
+
+        The rows of the previous page that were created at the same time
+        as its last row are requested again and dropped by split(). One
+        more row than the limit is requested to find out whether there is
+        a next page.
+        """
+        cursor = self.cleaned_data.get('cursor')
+        params = {
+            'limit': self.cleaned_data['limit'] + 1,
+            'order_by': ORDER_BY,
+        }
+        if cursor:
+            params['limit'] += cursor['ties']
+            params['created__gte'] = cursor['created']
+        elif self.cleaned_data.get('since'):
+            params['created__gt'] = self.cleaned_data['since']
+        return params
+
+    def split(self, rows):
+        """
+        Returns a tuple of the rows that belong to this page and the
+        cursor of the next page, or None if this is the last page.
+        """
+        cursor = self.cleaned_data.get('cursor')
+        if cursor:
+            # Drop the rows that the previous page already returned.
+            rows = [row for row in rows
+                    if not (row['created'] == cursor['created'] and
+                            row['resource_pk'] <= cursor['pk'])]
+
+        limit = self.cleaned_data['limit']
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+
+        last = rows[-1]
+        ties = len([row for row in rows
+                    if row['created'] == last['created']])
+        if cursor and cursor['created'] == last['created']:
+            ties += cursor['ties']
+        return rows, encode_cursor(last['created'], last['resource_pk'],
+                                   ties=ties)
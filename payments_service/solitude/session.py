@@ -0,0 +1,220 @@
+import logging
+import sys
+import threading
+from urlparse import urlparse
+
+from django.conf import settings
+
+from django_statsd.clients import statsd
+from requests.exceptions import Timeout
+
+from ..base import context, deadline
+from ..base.breaker import CircuitBreaker
+from ..base.cache import LRUCache, Pending, SingleFlight
+from ..base.deadline import DeadlineExceeded
+from ..base.http import PooledSession
+
+log = logging.getLogger(__name__)
+
+
+def request_key(url, params=None):
+    """
+    Returns a hashable key for a GET request to url with query params.
+    """
+    items = []
+    for name, value in sorted((params or {}).items()):
+        if isinstance(value, list):
+            value = tuple(value)
+        items.append((name, value))
+    return url, tuple(items)
+
+
+def resource_name(url):
+    """
+    Returns the resource path of a Solitude URL as a dot-separated
+    Curling attribute path.
+
+    For example, http://solitude/generic/product/1/ is generic.product
+    """
+    path = urlparse(url).path
+    base_path = urlparse(settings.SOLITUDE_URL).path.rstrip('/')
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    # Like url_parser(), ignore empty parts and a numeric primary key.
+    parts = [p for p in path.split('/') if p != '']
+    if parts and parts[-1].isdigit():
+        parts.pop()
+    return '.'.join(parts)
+
+
+class SolitudeSession(PooledSession):
+    """
+    Pooled session for talking to Solitude.
+
+    Within a request, identical GETs are only sent to Solitude once.
+    See IdentityMap.
+
+    Identical GETs that are in flight at the same time, from any request,
+    share a single call to Solitude. See SingleFlight. A request does not
+    share a GET that started before its own last write and only waits for
+    it for as long as its own deadline allows.
+
+    GETs for resources in settings.SOLITUDE_CACHE_TTLS are also cached
+    across requests.
+
+    Every call that reaches the network goes through a circuit breaker.
+    When Solitude keeps failing, calls raise CircuitOpen right away instead
+    of waiting on a dependency that is down.
+    """
+
+    def __init__(self, **kw):
+        super(SolitudeSession, self).__init__('solitude', **kw)
+        self.cache = LRUCache('solitude.cache',
+                              settings.SOLITUDE_CACHE_MAXSIZE)
+        self.in_flight = SingleFlight('solitude.single_flight')
+        self.breaker = CircuitBreaker(
+            'solitude',
+            failure_rate=settings.SOLITUDE_BREAKER_FAILURE_RATE,
+            min_calls=settings.SOLITUDE_BREAKER_MIN_CALLS,
+            window=settings.SOLITUDE_BREAKER_WINDOW,
+            cooldown=settings.SOLITUDE_BREAKER_COOLDOWN)
+
+    def request(self, method, url, **kw):
+        send = self.send_through_breaker
+        identity_map = IdentityMap.current()
+
+        if method.upper() != 'GET':
+            if identity_map:
+                # Any write can change what a GET would return.
+                identity_map.clear()
+            if resource_name(url) in settings.SOLITUDE_CACHE_TTLS:
+                log.info('clearing solitude cache after {} {}'
+                         .format(method, url))
+                self.cache.clear()
+            try:
+                return send(method, url, **kw)
+            finally:
+                if identity_map:
+                    # GETs already in flight may not see this write.
+                    identity_map.last_write = self.in_flight.mark()
+
+        key = request_key(url, kw.get('params'))
+
+        def fetch():
+            ttl = settings.SOLITUDE_CACHE_TTLS.get(resource_name(url))
+            if not ttl:
+                return send(method, url, **kw)
+            return self.cache.get_or_load(
+                key, lambda: send(method, url, **kw), ttl,
+                keep=lambda response: response.status_code == 200,
+                timeout=deadline.remaining())
+
+        def get():
+            # Wait no longer than this request has left and don't share a
+            # GET that started before this request's last write.
+            return self.in_flight.do(
+                key, fetch, timeout=deadline.remaining(),
+                since=identity_map.last_write if identity_map else None)
+
+        if not identity_map:
+            return get()
+        return identity_map.get(key, get)
+
+    def send_through_breaker(self, method, url, **kw):
+        send = super(SolitudeSession, self).request
+        call = 'solitude {} {}'.format(method, url)
+        # Stay within the deadline of the current request, if any.
+        timeout = kw.get('timeout') or settings.SOLITUDE_TIMEOUT
+        kw['timeout'] = deadline.timeout(timeout, call=call)
+
+        def send_within_deadline():
+            try:
+                return send(method, url, **kw)
+            except Timeout:
+                if kw['timeout'] < timeout:
+                    # The request ran out of time, not Solitude.
+                    raise DeadlineExceeded('{} timed out: request deadline '
+                                           'exceeded'.format(call))
+                raise
+
+        return self.breaker.call(
+            send_within_deadline,
+            # Client errors such as 404 mean that Solitude is working.
+            is_failure=lambda response: response.status_code >= 500,
+            ignore=(DeadlineExceeded,))
+
+
+class IdentityMap(object):
+    """
+    Collapses duplicate Solitude GETs made during a single request.
+
+    Each response is stored by URL and query parameters. Later GETs for
+    the same key share that response instead of calling Solitude again.
+    If another thread of the same request is already fetching a key,
+    the caller waits for that response.
+
+    The map is cleared whenever the request writes to Solitude and
+    discarded when the request ends.
+    """
+    context_key = 'solitude.identity_map'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # SingleFlight.mark() as of the request's last write to Solitude.
+        self.last_write = None
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def current(cls):
+        """
+        Returns the identity map of the current request or None if there
+        is no request.
+        """
+        values = context.current()
+        if values is None:
+            return None
+        return values.setdefault(cls.context_key, cls())
+
+    def get(self, key, fetch):
+        """
+        Returns the response for key, calling fetch() to get it
+        if it hasn't been fetched yet.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                is_fetching = False
+            else:
+                self.misses += 1
+                entry = self._entries[key] = Pending()
+                is_fetching = True
+
+        if not is_fetching:
+            log.debug('identity map hit: {}'.format(key))
+            return entry.wait()
+
+        try:
+            entry.set(fetch())
+        except Exception:
+            # Do not keep the failure around for later calls.
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry.fail(sys.exc_info())
+            raise
+        return entry.wait()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        if not (self.hits or self.misses):
+            return
+        log.info('solitude identity map: {hits} hits, {misses} misses'
+                 .format(hits=self.hits, misses=self.misses))
+        statsd.incr('solitude.identity_map.hit', self.hits)
+        statsd.incr('solitude.identity_map.miss', self.misses)
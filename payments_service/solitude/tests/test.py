@@ -1,17 +1,48 @@
 from urllib import urlencode
+import json
+import threading
 import unittest
 
+from django.core.cache import caches
+from django.test.utils import override_settings
+
 import mock
+from nose.plugins.skip import SkipTest
 from nose.tools import eq_, raises
 from rest_framework.response import Response
 from slumber.exceptions import HttpClientError, HttpServerError
 
+from payments_service import solitude
+from payments_service.base import context, deadline, etags
+from payments_service.base.http import PooledSession
 from payments_service.base.tests import (
     APIMock, AuthenticatedTestCase, WithDynamicEndpoints)
 
 from .. import SolitudeAPIView, SolitudeBodyguard, url_parser
 
 
+class TestAPI(unittest.TestCase):
+
+    def setUp(self):
+        solitude.reset_api()
+        self.addCleanup(solitude.reset_api)
+
+    def test_share_one_client(self):
+        eq_(solitude.api(), solitude.api())
+
+    def test_use_pooled_session(self):
+        assert isinstance(solitude.api().session, PooledSession)
+
+    @override_settings(SOLITUDE_POOL_MAXSIZE=3)
+    def test_configure_pool_size(self):
+        eq_(solitude.api().session.pool_maxsize, 3)
+
+    def test_reset(self):
+        conn = solitude.api()
+        solitude.reset_api()
+        assert solitude.api() is not conn
+
+
 class TestSolitudeBodyguard(AuthenticatedTestCase, WithDynamicEndpoints):
 
     def setUp(self):
@@ -156,6 +187,138 @@ class TestSolitudeBodyguard(AuthenticatedTestCase, WithDynamicEndpoints):
         eq_(data['error_response'], exc.content)
         eq_(res.status_code, 400)
 
+    def test_select_fields(self):
+        self.solitude.services.status.get.return_value = [
+            {'resource_pk': 1, 'active': True, 'type': 1},
+        ]
+        res, data = self.get(query_params={'fields': 'resource_pk,active'})
+        eq_(data, [{'resource_pk': 1, 'active': True}])
+
+    def test_do_not_pass_fields_to_solitude(self):
+        self.get(query_params={'fields': 'resource_pk', 'expand': '',
+                               'foo': 'bar'})
+        call_args = self.solitude.services.status.get.call_args
+        eq_(call_args[1], {'foo': 'bar'})
+
+
+class TestPassthrough(AuthenticatedTestCase, WithDynamicEndpoints):
+
+    def setUp(self):
+        super(TestPassthrough, self).setUp()
+
+        class Passthrough(SolitudeBodyguard):
+            methods = ['get', 'patch']
+            resource = 'services.status'
+            passthrough = True
+
+        self.endpoint(Passthrough, r'^dynamic-endpoint/(?P<pk>[^/]+)?/?$')
+
+        self.body = '{"resource_pk": 1}'
+        self.resource = APIMock()
+        self.resource._request.return_value = mock.Mock(
+            content=self.body, status_code=200,
+            headers={'Content-Type': 'application/json'})
+        self.resource.get.return_value = {'resource_pk': 1}
+        self.resource.patch.return_value = {}
+        self.solitude.services.status.return_value = self.resource
+
+    def test_send_raw_response(self):
+        res = self.client.get('/dynamic-endpoint/1/?foo=bar')
+        eq_(res.status_code, 200)
+        eq_(res.content, self.body)
+        eq_(res['Content-Type'], 'application/json')
+        self.resource._request.assert_called_with('GET',
+                                                  params={'foo': 'bar'})
+        assert not self.resource.get.called
+
+    def test_replace_call_args(self):
+
+        class Replacer(SolitudeBodyguard):
+            methods = ['get']
+            resource = 'services.status'
+            passthrough = True
+
+            def replace_call_args(self, request, method, args, kw):
+                return args, {'replaced': 'yes'}
+
+        self.endpoint(Replacer, r'^dynamic-endpoint/(?P<pk>[^/]+)?/?$')
+        self.client.get('/dynamic-endpoint/1/?foo=bar')
+        self.resource._request.assert_called_with(
+            'GET', params={'replaced': 'yes'})
+
+    def test_decode_lists(self):
+        self.solitude.services.status.get.return_value = [{'item': 'value'}]
+        res = self.client.get('/dynamic-endpoint/')
+        res, data = self.json(res)
+        eq_(data, [{'item': 'value'}])
+        assert not self.resource._request.called
+
+    def test_decode_writes(self):
+        res = self.client.patch('/dynamic-endpoint/1/')
+        eq_(res.status_code, 200)
+        assert self.resource.patch.called
+        assert not self.resource._request.called
+
+    def test_bad_request(self):
+        self.resource._request.side_effect = HttpClientError('404')
+        res = self.client.get('/dynamic-endpoint/1/')
+        eq_(res.status_code, 400)
+
+    def test_disallow_method(self):
+        res = self.client.post('/dynamic-endpoint/1/')
+        eq_(res.status_code, 405)
+        assert not self.resource._request.called
+
+    def test_decode_to_select_fields(self):
+        res = self.client.get('/dynamic-endpoint/1/?fields=resource_pk')
+        res, data = self.json(res)
+        eq_(data, {'resource_pk': 1})
+        assert not self.resource._request.called
+
+    @mock.patch('payments_service.solitude.statsd')
+    def test_measure_cpu(self, statsd):
+        self.client.get('/dynamic-endpoint/1/')
+        eq_(statsd.timing.call_args[0][0],
+            'solitude.bodyguard.Passthrough.passthrough.cpu')
+
+    @mock.patch('payments_service.solitude.statsd')
+    def test_measure_cpu_when_decoded(self, statsd):
+        self.solitude.services.status.get.return_value = []
+        self.client.get('/dynamic-endpoint/')
+        eq_(statsd.timing.call_args[0][0],
+            'solitude.bodyguard.Passthrough.decoded.cpu')
+
+    @mock.patch('payments_service.solitude.statsd')
+    @mock.patch('payments_service.solitude.thread_cpu_time')
+    def test_measure_thread_cpu_time(self, thread_cpu_time, statsd):
+        thread_cpu_time.side_effect = [1.0, 1.25]
+        self.client.get('/dynamic-endpoint/1/')
+        eq_(statsd.timing.call_args[0][1], 250)
+
+    @mock.patch('payments_service.solitude.statsd')
+    @mock.patch('payments_service.solitude.thread_cpu_time')
+    def test_no_cpu_time(self, thread_cpu_time, statsd):
+        thread_cpu_time.return_value = None
+        self.client.get('/dynamic-endpoint/1/')
+        assert not statsd.timing.called
+
+
+class TestThreadCPUTime(unittest.TestCase):
+
+    def test_exclude_other_threads(self):
+        start = solitude.thread_cpu_time()
+        if start is None:
+            raise SkipTest('thread CPU time is not available here')
+        busy = threading.Thread(target=lambda: sum(xrange(10 ** 7)))
+        busy.start()
+        busy.join()
+        assert solitude.thread_cpu_time() - start < 0.05
+
+    @mock.patch('payments_service.solitude.sys')
+    def test_unavailable(self, sys):
+        sys.platform = 'darwin'
+        eq_(solitude.thread_cpu_time(), None)
+
 
 class TestUrlParser(unittest.TestCase):
 
@@ -216,9 +379,10 @@ class TestExpandAPIObjects(AuthenticatedTestCase, WithDynamicEndpoints):
             lambda u: self.uri_mocks[u]
         )
 
-    def execute_expansion(self, to_expand):
+    def execute_expansion(self, to_expand, providers=None, query=''):
 
         class ExpandingView(SolitudeAPIView):
+            expansion_providers = providers or {}
 
             def get(self, *args, **kw):
                 res = self.api.transaction.get()
@@ -226,7 +390,7 @@ class TestExpandAPIObjects(AuthenticatedTestCase, WithDynamicEndpoints):
                 return Response(res)
 
         self.endpoint(ExpandingView)
-        return self.json(self.client.get('/dynamic-endpoint'))
+        return self.json(self.client.get('/dynamic-endpoint' + query))
 
     def test_expand_top_level_attribute(self):
         res, data = self.execute_expansion(['seller'])
@@ -243,3 +407,516 @@ class TestExpandAPIObjects(AuthenticatedTestCase, WithDynamicEndpoints):
             '/some/product/1234/')
         eq_(data[0]['product']['category']['resource_uri'],
             '/some/category/1234/')
+
+    def test_keep_row_order(self):
+        rows = [{'resource_pk': i, 'seller': '/some/seller/{}/'.format(i)}
+                for i in range(10)]
+        self.solitude.transaction.get.return_value = rows
+        for i in range(10):
+            uri = '/some/seller/{}/'.format(i)
+            self.uri_mocks[uri] = mock.Mock()
+            self.uri_mocks[uri].get_object.return_value = {'pk': i}
+
+        with self.settings(SOLITUDE_EXPAND_CONCURRENCY=4):
+            res, data = self.execute_expansion(['seller'])
+
+        eq_([row['resource_pk'] for row in data], range(10))
+        eq_([row['seller']['pk'] for row in data], range(10))
+
+    def test_expand_rows_concurrently(self):
+        self.solitude.transaction.get.return_value = [
+            {'resource_pk': 1, 'seller': '/some/seller/1/'},
+            {'resource_pk': 2, 'seller': '/some/seller/2/'},
+        ]
+        second_started = threading.Event()
+        overlapped = []
+
+        def first_seller():
+            # The second fetch has to start while this one is in flight.
+            overlapped.append(second_started.wait(5))
+            return {}
+
+        def second_seller():
+            second_started.set()
+            return {}
+
+        self.uri_mocks['/some/seller/1/'] = mock.Mock()
+        self.uri_mocks['/some/seller/1/'].get_object.side_effect = (
+            first_seller)
+        self.uri_mocks['/some/seller/2/'] = mock.Mock()
+        self.uri_mocks['/some/seller/2/'].get_object.side_effect = (
+            second_seller)
+
+        with self.settings(SOLITUDE_EXPAND_CONCURRENCY=2):
+            res, data = self.execute_expansion(['seller'])
+
+        eq_(res.status_code, 200)
+        eq_(overlapped, [True])
+
+    def test_expand_one_at_a_time(self):
+        with self.settings(SOLITUDE_EXPAND_CONCURRENCY=1):
+            res, data = self.execute_expansion([{'product': ['category']},
+                                                'seller'])
+        eq_(data[0]['product']['category']['resource_uri'],
+            '/some/category/1234/')
+        eq_(data[0]['seller']['resource_uri'], '/some/seller/1234/')
+
+    def test_expansion_provider(self):
+        provider = mock.Mock()
+        provider.return_value = {'resource_uri': 'provided'}
+        res, data = self.execute_expansion(['seller'],
+                                           providers={'seller': provider})
+
+        eq_(data[0]['seller']['resource_uri'], 'provided')
+        eq_(provider.call_args[0][0], '/some/seller/1234/')
+        assert not self.uri_mocks['/some/seller/1234/'].get_object.called
+
+    def test_expansion_provider_can_fetch(self):
+
+        def provider(uri, fetch):
+            return fetch(uri)
+
+        res, data = self.execute_expansion(['seller'],
+                                           providers={'seller': provider})
+        eq_(data[0]['seller']['resource_uri'], '/some/seller/1234/')
+
+    def test_select_fields(self):
+        res, data = self.execute_expansion(
+            [{'product': ['category']}, 'seller'],
+            query='?fields=resource_pk,product.resource_uri')
+        eq_(data, [{'resource_pk': 1,
+                    'product': {'resource_uri': '/some/product/1234/'}}])
+
+    def test_only_expand_selected_fields(self):
+        res, data = self.execute_expansion(
+            [{'product': ['category']}, 'seller'],
+            query='?fields=product.resource_uri')
+        assert self.uri_mocks['/some/product/1234/'].get_object.called
+        assert not self.uri_mocks['/some/category/1234/'].get_object.called
+        assert not self.uri_mocks['/some/seller/1234/'].get_object.called
+
+    def test_expand_selected_attributes(self):
+        res, data = self.execute_expansion(
+            [{'product': ['category']}, 'seller'], query='?expand=seller')
+        eq_(data[0]['seller']['resource_uri'], '/some/seller/1234/')
+        eq_(data[0]['product'], '/some/product/1234/')
+        assert not self.uri_mocks['/some/product/1234/'].get_object.called
+
+    def test_expand_nested_attributes(self):
+        res, data = self.execute_expansion(
+            [{'product': ['category']}, 'seller'],
+            query='?expand=product.category')
+        eq_(data[0]['product']['category']['resource_uri'],
+            '/some/category/1234/')
+        eq_(data[0]['seller'], '/some/seller/1234/')
+
+    def test_expand_nothing(self):
+        res, data = self.execute_expansion(['seller'], query='?expand=')
+        eq_(data[0]['seller'], '/some/seller/1234/')
+
+
+class FakeSolitude(object):
+    """
+    A stand-in for Solitude's by_url() with list and detail resources.
+    """
+
+    def __init__(self, objects, supports_pk_in=True):
+        # Objects keyed by URI.
+        self.objects = objects
+        self.supports_pk_in = supports_pk_in
+        self.calls = []
+
+    def by_url(self, uri):
+        parts, pk = url_parser(uri)
+        resource = mock.Mock()
+        if pk:
+            resource.get_object.side_effect = (
+                lambda: self.detail(uri))
+        else:
+            resource.get.side_effect = (
+                lambda **params: self.list(uri, **params))
+        return resource
+
+    def detail(self, uri):
+        self.calls.append(uri)
+        return dict(self.objects[uri])
+
+    def list(self, uri, pk__in=None, limit=20):
+        self.calls.append(uri)
+        objects = [dict(obj) for obj_uri, obj in sorted(self.objects.items())
+                   if obj_uri.startswith(uri)]
+        if pk__in and self.supports_pk_in:
+            pks = pk__in.split(',')
+            objects = [obj for obj in objects
+                       if str(obj['resource_pk']) in pks]
+        return objects[:limit]
+
+
+class TestBulkExpansion(AuthenticatedTestCase, WithDynamicEndpoints):
+
+    def setUp(self):
+        super(TestBulkExpansion, self).setUp()
+        solitude.reset_api()
+        self.addCleanup(solitude.reset_api)
+
+        objects = {}
+        for i in range(1, 4):
+            objects['/generic/transaction/{}/'.format(i)] = {
+                'resource_pk': i,
+                'seller': '/generic/seller/{}/'.format(i),
+            }
+            objects['/generic/seller/{}/'.format(i)] = {'resource_pk': i}
+        # This one is never listed.
+        objects['/generic/transaction/9/'] = {'resource_pk': 9}
+        self.fake = FakeSolitude(objects)
+        self.solitude.by_url.side_effect = self.fake.by_url
+
+        self.list_transactions()
+
+    def list_transactions(self):
+        # Expanding changes the rows so each expansion needs new ones.
+        self.solitude.transaction.get.return_value = [
+            {'transaction': '/generic/transaction/{}/'.format(i)}
+            for i in (1, 2, 3, 2)]
+
+    def expand(self, **settings):
+        settings.setdefault('SOLITUDE_BULK_EXPAND',
+                            ('generic.transaction', 'generic.seller'))
+
+        class ExpandingView(SolitudeAPIView):
+
+            def get(self, *args, **kw):
+                return Response(self.expand_api_objects(
+                    self.api.transaction.get(),
+                    [{'transaction': ['seller']}]))
+
+        self.endpoint(ExpandingView)
+        with self.settings(**settings):
+            res, data = self.json(self.client.get('/dynamic-endpoint'))
+        return data
+
+    def check(self, data):
+        eq_([row['transaction']['resource_pk'] for row in data],
+            [1, 2, 3, 2])
+        eq_([row['transaction']['seller']['resource_pk'] for row in data],
+            [1, 2, 3, 2])
+
+    def test_one_call_per_resource_and_level(self):
+        data = self.expand()
+        self.check(data)
+        eq_(sorted(self.fake.calls),
+            ['/generic/seller/', '/generic/transaction/'])
+
+    def test_only_listed_resources(self):
+        data = self.expand(SOLITUDE_BULK_EXPAND=('generic.transaction',))
+        self.check(data)
+        assert '/generic/seller/' not in self.fake.calls
+        eq_(self.fake.calls.count('/generic/transaction/'), 1)
+
+    def test_single_uri(self):
+        self.solitude.transaction.get.return_value = [
+            {'transaction': '/generic/transaction/1/'}]
+        self.expand()
+        eq_(self.fake.calls, ['/generic/transaction/1/',
+                              '/generic/seller/1/'])
+
+    def test_fetch_missing_objects(self):
+        self.solitude.transaction.get.return_value.append(
+            {'transaction': '/generic/transaction/9/'})
+        self.fake.objects['/generic/transaction/9/']['resource_pk'] = 99
+        data = self.expand()
+        eq_(data[-1]['transaction']['resource_pk'], 99)
+        assert '/generic/transaction/9/' in self.fake.calls
+
+    def test_fall_back_when_filter_is_ignored(self):
+        self.fake.supports_pk_in = False
+        self.solitude.transaction.get.side_effect = lambda: [
+            {'transaction': '/generic/transaction/{}/'.format(i)}
+            for i in (2, 3)]
+        data = self.expand()
+        eq_([row['transaction']['seller']['resource_pk'] for row in data],
+            [2, 3])
+        assert '/generic/transaction/2/' in self.fake.calls
+
+        # Don't try again.
+        del self.fake.calls[:]
+        self.expand()
+        assert '/generic/transaction/' not in self.fake.calls
+
+    def reject(self, status):
+        self.fake.list = mock.Mock(side_effect=HttpClientError(
+            'rejected', response=mock.Mock(status_code=status)))
+
+    def test_fall_back_when_filter_is_rejected(self):
+        self.reject(400)
+        self.check(self.expand())
+
+        # Don't try again for a while.
+        del self.fake.calls[:]
+        self.list_transactions()
+        self.expand()
+        assert '/generic/transaction/' not in self.fake.calls
+
+    @mock.patch('payments_service.solitude.time.time')
+    def test_try_again_later(self, time):
+        time.return_value = 1000
+        self.reject(400)
+        self.expand(SOLITUDE_BULK_EXPAND_RETRY=60)
+
+        del self.fake.list
+        del self.fake.calls[:]
+        self.list_transactions()
+        time.return_value = 1060
+        self.check(self.expand())
+        assert '/generic/transaction/' in self.fake.calls
+
+    def test_keep_bulk_expansion_after_other_errors(self):
+        for status in (403, 404, 429):
+            self.reject(status)
+            self.list_transactions()
+            self.check(self.expand())
+        eq_(solitude._bulk_unsupported, {})
+
+
+class TestExpandedListResponse(AuthenticatedTestCase, WithDynamicEndpoints):
+
+    def setUp(self):
+        super(TestExpandedListResponse, self).setUp()
+        self.rows = [{'resource_pk': i, 'seller': '/some/seller/{}/'.format(i)}
+                     for i in range(5)]
+        self.solitude.transaction.get.return_value = self.rows
+
+        def by_url(uri):
+            resource = mock.Mock()
+            resource.get_object.return_value = {'resource_uri': uri}
+            return resource
+
+        self.solitude.by_url.side_effect = by_url
+
+    def request(self, extra=None, **settings):
+
+        class ListView(SolitudeAPIView):
+
+            def get(self, *args, **kw):
+                return self.expanded_list_response(
+                    'rows', self.api.transaction.get(), ['seller'],
+                    extra=extra)
+
+        self.endpoint(ListView)
+        with self.settings(**settings):
+            return self.client.get('/dynamic-endpoint')
+
+    def read(self, res):
+        assert res.streaming
+        return json.loads(''.join(res.streaming_content))
+
+    def test_small_list(self):
+        res = self.request(SOLITUDE_STREAM_MIN_ROWS=10)
+        assert not res.streaming
+        res, data = self.json(res)
+        eq_(len(data['rows']), 5)
+
+    def test_stream(self):
+        res = self.request(SOLITUDE_STREAM_MIN_ROWS=2,
+                           SOLITUDE_STREAM_CHUNK_SIZE=2)
+        eq_(res['Content-Type'], 'application/json')
+        data = self.read(res)
+        eq_([row['resource_pk'] for row in data['rows']], range(5))
+        eq_([row['seller']['resource_uri'] for row in data['rows']],
+            ['/some/seller/{}/'.format(i) for i in range(5)])
+
+    def test_stream_extra(self):
+        res = self.request(extra={'next_cursor': None},
+                           SOLITUDE_STREAM_MIN_ROWS=2)
+        data = self.read(res)
+        eq_(data['next_cursor'], None)
+        eq_(len(data['rows']), 5)
+
+    def test_expand_while_streaming(self):
+        res = self.request(SOLITUDE_STREAM_MIN_ROWS=2,
+                           SOLITUDE_STREAM_CHUNK_SIZE=2)
+        assert not self.solitude.by_url.called
+        chunks = iter(res.streaming_content)
+        next(chunks)
+        next(chunks)
+        eq_(self.solitude.by_url.call_count, 2)
+
+    def test_stream_within_request_context(self):
+        seen = []
+
+        def by_url(uri):
+            seen.append(context.current())
+            return mock.Mock(get_object=mock.Mock(return_value={}))
+
+        self.solitude.by_url.side_effect = by_url
+        res = self.request(SOLITUDE_STREAM_MIN_ROWS=2)
+        self.read(res)
+        assert all(values is not None for values in seen), seen
+
+    def test_never_stream(self):
+        res = self.request(SOLITUDE_STREAM_MIN_ROWS=None)
+        assert not res.streaming
+
+    def test_same_bytes_as_buffered_response(self):
+        self.rows[0]['name'] = u'caf\xe9 \u2028'
+        rows = [dict(row) for row in self.rows]
+        extra = {'next_cursor': 'abc', 'count': 5}
+        streamed = ''.join(self.request(
+            extra=extra, SOLITUDE_STREAM_MIN_ROWS=2,
+            SOLITUDE_STREAM_CHUNK_SIZE=2).streaming_content)
+        self.solitude.transaction.get.return_value = rows
+        buffered = self.request(extra=extra,
+                                SOLITUDE_STREAM_MIN_ROWS=None).content
+        eq_(streamed, buffered)
+
+    def test_mark_incomplete_stream(self):
+        calls = []
+
+        def by_url(uri):
+            calls.append(uri)
+            if len(calls) > 2:
+                raise HttpServerError('down')
+            return mock.Mock(get_object=mock.Mock(return_value={}))
+
+        self.solitude.by_url.side_effect = by_url
+        res = self.request(extra={'next_cursor': None},
+                           SOLITUDE_STREAM_MIN_ROWS=2,
+                           SOLITUDE_STREAM_CHUNK_SIZE=2)
+        data = self.read(res)
+        eq_(len(data['rows']), 2)
+        assert 'incomplete' in data['error'], data
+        eq_(data['next_cursor'], None)
+
+    def test_stream_has_own_context(self):
+        seen = []
+
+        def by_url(uri):
+            values = context.current()
+            seen.append(values)
+            values.setdefault('probe', mock.Mock())
+            return mock.Mock(get_object=mock.Mock(return_value={}))
+
+        self.solitude.by_url.side_effect = by_url
+        res = self.request(SOLITUDE_STREAM_MIN_ROWS=2,
+                           SOLITUDE_STREAM_CHUNK_SIZE=2)
+        self.read(res)
+        # One context for the whole stream, closed once it's done.
+        eq_(len(set(id(values) for values in seen)), 1)
+        assert seen[0]['probe'].close.called
+
+    def test_stream_has_own_deadline(self):
+        deadlines = []
+
+        def by_url(uri):
+            deadlines.append(deadline.current())
+            return mock.Mock(get_object=mock.Mock(return_value={}))
+
+        self.solitude.by_url.side_effect = by_url
+        res = self.request(SOLITUDE_STREAM_MIN_ROWS=2, REQUEST_DEADLINE=3)
+        self.read(res)
+        eq_(deadlines[0].seconds, 3)
+        assert deadlines[0].remaining() > 2
+
+
+class TestConditionalGet(AuthenticatedTestCase, WithDynamicEndpoints):
+
+    def setUp(self):
+        super(TestConditionalGet, self).setUp()
+        caches['default'].clear()
+        self.solitude.services.status.get.return_value = {'resource_pk': 1}
+
+        class ReadView(SolitudeAPIView):
+
+            def get(self, request):
+                return Response(self.api.services.status.get())
+
+            def post(self, request):
+                return Response({})
+
+        self.endpoint(ReadView)
+
+    def get(self, etag=None):
+        headers = {}
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get('/dynamic-endpoint', **headers)
+
+    def test_etag(self):
+        res = self.get()
+        eq_(res.status_code, 200)
+        eq_(res['ETag'], etags.content_etag(res.content))
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        res = self.get(etag)
+        eq_(res.status_code, 304)
+        eq_(res.content, '')
+        eq_(res['ETag'], etag)
+
+    def test_modified(self):
+        etag = self.get()['ETag']
+        self.solitude.services.status.get.return_value = {'resource_pk': 2}
+        res = self.get(etag)
+        eq_(res.status_code, 200)
+        assert res['ETag'] != etag
+
+    def test_no_etag_for_writes(self):
+        res = self.client.post('/dynamic-endpoint')
+        assert not res.has_header('ETag')
+
+    def test_no_etag_for_errors(self):
+
+        class BadView(SolitudeAPIView):
+
+            def get(self, request):
+                return Response({}, status=400)
+
+        self.endpoint(BadView)
+        res = self.get()
+        eq_(res.status_code, 400)
+        assert not res.has_header('ETag')
+
+    def test_no_etag_for_streams(self):
+
+        class StreamView(SolitudeAPIView):
+
+            def get(self, request):
+                return self.expanded_list_response('rows', [{}], [])
+
+        self.endpoint(StreamView)
+        with self.settings(SOLITUDE_STREAM_MIN_ROWS=1):
+            res = self.get()
+        assert res.streaming
+        assert not res.has_header('ETag')
+
+    def test_skip_solitude_with_version_stamp(self):
+        with self.settings(ETAG_VERSION_STAMPS=True):
+            etag = self.get()['ETag']
+            self.solitude.services.status.get.reset_mock()
+            res = self.get(etag)
+        eq_(res.status_code, 304)
+        eq_(res['ETag'], etag)
+        assert not self.solitude.services.status.get.called
+
+    def test_version_stamp_changes_after_write(self):
+        with self.settings(ETAG_VERSION_STAMPS=True):
+            etag = self.get()['ETag']
+            self.client.post('/dynamic-endpoint')
+            res = self.get(etag)
+        eq_(res.status_code, 200)
+        assert res['ETag'] != etag
+        assert self.solitude.services.status.get.called
+
+    def test_no_version_stamp_for_streams(self):
+
+        class StreamView(SolitudeAPIView):
+
+            def get(self, request):
+                return self.expanded_list_response('rows', [{}], [])
+
+        self.endpoint(StreamView)
+        with self.settings(ETAG_VERSION_STAMPS=True,
+                           SOLITUDE_STREAM_MIN_ROWS=1):
+            res = self.get()
+        assert res.streaming
+        assert not res.has_header('ETag')
@@ -0,0 +1,84 @@
+import unittest
+
+from nose.tools import eq_
+
+from ..fields import covers, parse_paths, path_tree, project, prune_expansions
+
+
+class TestParsePaths(unittest.TestCase):
+
+    def test_comma_separated(self):
+        eq_(parse_paths(['a, b.c']), set(['a', 'b.c']))
+
+    def test_repeated(self):
+        eq_(parse_paths(['a', 'b']), set(['a', 'b']))
+
+    def test_empty(self):
+        eq_(parse_paths(['']), set())
+
+
+class TestPathTree(unittest.TestCase):
+
+    def test_tree(self):
+        eq_(path_tree(['a', 'b.c', 'b.d']),
+            {'a': {}, 'b': {'c': {}, 'd': {}}})
+
+    def test_whole_attribute_wins(self):
+        eq_(path_tree(['b.c', 'b']), {'b': {}})
+
+
+class TestProject(unittest.TestCase):
+
+    def test_select(self):
+        eq_(project({'a': 1, 'b': 2}, {'a': {}}), {'a': 1})
+
+    def test_nested(self):
+        eq_(project({'a': {'b': 1, 'c': 2}, 'd': 3}, {'a': {'b': {}}}),
+            {'a': {'b': 1}})
+
+    def test_list(self):
+        eq_(project([{'a': 1, 'b': 2}, {'a': 3}], {'a': {}}),
+            [{'a': 1}, {'a': 3}])
+
+    def test_ignore_missing(self):
+        eq_(project({'a': 1}, {'a': {}, 'b': {}}), {'a': 1})
+
+    def test_unexpanded_uri(self):
+        eq_(project({'a': '/uri/'}, {'a': {'b': {}}}), {'a': '/uri/'})
+
+    def test_no_selection(self):
+        eq_(project({'a': 1}, {}), {'a': 1})
+
+
+class TestCovers(unittest.TestCase):
+
+    def test_same(self):
+        assert covers(['a.b'], 'a.b')
+
+    def test_part_of_path(self):
+        assert covers(['a.b'], 'a')
+
+    def test_within_path(self):
+        assert covers(['a'], 'a.b')
+
+    def test_other_path(self):
+        assert not covers(['ab'], 'a')
+
+
+class TestPruneExpansions(unittest.TestCase):
+
+    def test_keep_wanted(self):
+        eq_(prune_expansions(['a', 'b'], lambda path: path == 'a'), ['a'])
+
+    def test_nested(self):
+        eq_(prune_expansions([{'a': ['b', 'c']}],
+                             lambda path: path in ('a', 'a.c')),
+            [{'a': ['c']}])
+
+    def test_drop_nested(self):
+        eq_(prune_expansions([{'a': ['b']}], lambda path: path == 'a'),
+            ['a'])
+
+    def test_drop_parent(self):
+        eq_(prune_expansions([{'a': ['b']}], lambda path: path == 'a.b'),
+            [])
@@ -0,0 +1,128 @@
+import unittest
+import urlparse
+
+import requests
+from nose.tools import eq_, raises
+
+from ..pagination import decode_cursor, encode_cursor, PageForm
+
+
+def row(pk, created='2015-08-07T00:00:00'):
+    return {'resource_pk': pk, 'created': created}
+
+
+class TestCursor(unittest.TestCase):
+
+    def test_round_trip(self):
+        eq_(decode_cursor(encode_cursor('2015-08-07T00:00:00', 20, ties=2)),
+            {'created': '2015-08-07T00:00:00', 'pk': 20, 'ties': 2})
+
+    @raises(ValueError)
+    def test_garbage(self):
+        decode_cursor('not a cursor')
+
+    @raises(ValueError)
+    def test_negative_pk(self):
+        decode_cursor(encode_cursor('2015-08-07T00:00:00', -1))
+
+    @raises(ValueError)
+    def test_bool_pk(self):
+        decode_cursor(encode_cursor('2015-08-07T00:00:00', True))
+
+    @raises(ValueError)
+    def test_bool_ties(self):
+        decode_cursor(encode_cursor('2015-08-07T00:00:00', 1, ties=False))
+
+    @raises(ValueError)
+    def test_missing_created(self):
+        decode_cursor(encode_cursor(None, 1))
+
+
+class TestPageForm(unittest.TestCase):
+
+    def form(self, **data):
+        form = PageForm(data)
+        assert form.is_valid(), form.errors
+        return form
+
+    def test_requested(self):
+        assert PageForm.is_requested({'limit': '1'})
+        assert PageForm.is_requested({'cursor': 'x'})
+        assert PageForm.is_requested({'since': '2015-08-07'})
+        assert not PageForm.is_requested({'fields': 'a'})
+
+    def test_default_limit(self):
+        eq_(self.form().solitude_params(),
+            {'limit': 21, 'order_by': ['created', 'id']})
+
+    def test_solitude_query(self):
+        # This is how the Solitude client encodes the parameters.
+        url = requests.Request('GET', 'http://solitude/',
+                               params=self.form().solitude_params()
+                               ).prepare().url
+        query = urlparse.parse_qs(urlparse.urlparse(url).query)
+        eq_(query['order_by'], ['created', 'id'])
+
+    def test_limit(self):
+        eq_(self.form(limit='5').solitude_params()['limit'], 6)
+
+    def test_invalid_limit(self):
+        assert not PageForm({'limit': '0'}).is_valid()
+        assert not PageForm({'limit': '101'}).is_valid()
+
+    def test_invalid_cursor(self):
+        form = PageForm({'cursor': 'nope'})
+        assert not form.is_valid()
+        assert 'cursor' in form.errors
+
+    def test_since(self):
+        params = self.form(since='2015-08-07T14:53:23Z').solitude_params()
+        eq_(params['created__gt'], '2015-08-07T14:53:23+00:00')
+
+    def test_cursor(self):
+        params = self.form(
+            cursor=encode_cursor('2015-08-07T00:00:00', 10, ties=2),
+            limit='5').solitude_params()
+        eq_(params, {'limit': 8, 'order_by': ['created', 'id'],
+                     'created__gte': '2015-08-07T00:00:00'})
+
+    def test_last_page(self):
+        eq_(self.form(limit='2').split([row(1), row(2)]),
+            ([row(1), row(2)], None))
+
+    def test_next_page(self):
+        rows, cursor = self.form(limit='2').split(
+            [row(1, '2015-08-01'), row(2, '2015-08-02'),
+             row(3, '2015-08-03')])
+        eq_(rows, [row(1, '2015-08-01'), row(2, '2015-08-02')])
+        eq_(decode_cursor(cursor),
+            {'created': '2015-08-02', 'pk': 2, 'ties': 1})
+
+    def test_skip_rows_of_previous_page(self):
+        form = self.form(limit='2',
+                         cursor=encode_cursor('2015-08-02', 2, ties=2))
+        rows, cursor = form.split(
+            [row(1, '2015-08-02'), row(2, '2015-08-02'),
+             row(3, '2015-08-02'), row(4, '2015-08-03')])
+        eq_(rows, [row(3, '2015-08-02'), row(4, '2015-08-03')])
+        eq_(cursor, None)
+
+    def test_count_ties_across_pages(self):
+        form = self.form(limit='1',
+                         cursor=encode_cursor('2015-08-02', 2, ties=2))
+        rows, cursor = form.split(
+            [row(1, '2015-08-02'), row(2, '2015-08-02'),
+             row(3, '2015-08-02'), row(4, '2015-08-02')])
+        eq_(rows, [row(3, '2015-08-02')])
+        eq_(decode_cursor(cursor),
+            {'created': '2015-08-02', 'pk': 3, 'ties': 3})
+
+    def test_rows_created_between_pages(self):
+        first, cursor = self.form(limit='2').split(
+            [row(1, '2015-08-01'), row(2, '2015-08-02'),
+             row(3, '2015-08-03')])
+        # Row 1 is deleted and row 5 is created before the next page.
+        rows, cursor = self.form(limit='2', cursor=cursor).split(
+            [row(2, '2015-08-02'), row(3, '2015-08-03'),
+             row(5, '2015-08-04')])
+        eq_(rows, [row(3, '2015-08-03'), row(5, '2015-08-04')])
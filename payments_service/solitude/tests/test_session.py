@@ -0,0 +1,394 @@
+import threading
+import time
+import unittest
+
+import mock
+from nose.tools import eq_, raises
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from django.test.utils import override_settings
+
+from payments_service.base import context, deadline
+from payments_service.base.breaker import CircuitOpen
+from payments_service.base.deadline import DeadlineExceeded
+from payments_service.base.tests.test_http import fake_response
+
+from ..session import (IdentityMap, request_key, resource_name,
+                       SolitudeSession)
+
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        p = mock.patch.object(HTTPAdapter, 'send')
+        self.send = p.start()
+        self.addCleanup(p.stop)
+        self.send.side_effect = fake_response
+        self.session = SolitudeSession()
+
+
+class TestIdentityMap(SessionTest):
+
+    def setUp(self):
+        super(TestIdentityMap, self).setUp()
+        context.start()
+        self.addCleanup(context.end)
+
+    def test_collapse_duplicate_gets(self):
+        self.session.get('http://solitude/thing/1/')
+        self.session.get('http://solitude/thing/1/')
+        eq_(self.send.call_count, 1)
+
+    def test_share_response(self):
+        res = self.session.get('http://solitude/thing/1/')
+        eq_(self.session.get('http://solitude/thing/1/'), res)
+
+    def test_different_urls(self):
+        self.session.get('http://solitude/thing/1/')
+        self.session.get('http://solitude/thing/2/')
+        eq_(self.send.call_count, 2)
+
+    def test_different_params(self):
+        self.session.get('http://solitude/thing/', params={'a': 1})
+        self.session.get('http://solitude/thing/', params={'a': 2})
+        eq_(self.send.call_count, 2)
+
+    def test_same_params(self):
+        self.session.get('http://solitude/thing/',
+                         params={'a': 1, 'b': 2})
+        self.session.get('http://solitude/thing/',
+                         params={'b': 2, 'a': 1})
+        eq_(self.send.call_count, 1)
+
+    def test_clear_on_write(self):
+        self.session.get('http://solitude/thing/1/')
+        self.session.patch('http://solitude/thing/1/', data='{}')
+        self.session.get('http://solitude/thing/1/')
+        eq_(self.send.call_count, 3)
+
+    def test_never_collapse_writes(self):
+        self.session.post('http://solitude/thing/', data='{}')
+        self.session.post('http://solitude/thing/', data='{}')
+        eq_(self.send.call_count, 2)
+
+    def test_count_hits_and_misses(self):
+        self.session.get('http://solitude/thing/1/')
+        self.session.get('http://solitude/thing/1/')
+        self.session.get('http://solitude/thing/2/')
+        identity_map = IdentityMap.current()
+        eq_(identity_map.hits, 1)
+        eq_(identity_map.misses, 2)
+
+    def test_discard_at_end_of_request(self):
+        self.session.get('http://solitude/thing/1/')
+        context.end()
+        context.start()
+        self.session.get('http://solitude/thing/1/')
+        eq_(self.send.call_count, 2)
+
+    @raises(RuntimeError)
+    def test_raise_errors(self):
+        self.send.side_effect = RuntimeError
+        self.session.get('http://solitude/thing/1/')
+
+    def test_do_not_keep_errors(self):
+        self.send.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            self.session.get('http://solitude/thing/1/')
+
+        self.send.side_effect = fake_response
+        eq_(self.session.get('http://solitude/thing/1/').status_code, 200)
+
+    def test_wait_for_concurrent_fetch(self):
+        sending = threading.Event()
+        finish = threading.Event()
+
+        def slow_send(request, **kw):
+            sending.set()
+            finish.wait()
+            return fake_response(request)
+
+        self.send.side_effect = slow_send
+        values = context.current()
+
+        def get():
+            with context.inherit(values):
+                self.session.get('http://solitude/thing/1/')
+
+        threads = [threading.Thread(target=get) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        sending.wait()
+        finish.set()
+        for thread in threads:
+            thread.join()
+
+        eq_(self.send.call_count, 1)
+
+
+class TestWithoutRequest(SessionTest):
+
+    def test_do_not_collapse_gets(self):
+        self.session.get('http://solitude/thing/1/')
+        self.session.get('http://solitude/thing/1/')
+        eq_(self.send.call_count, 2)
+
+
+class TestCache(SessionTest):
+
+    def setUp(self):
+        settings = override_settings(
+            SOLITUDE_URL='http://solitude',
+            SOLITUDE_CACHE_TTLS={'generic.product': 60})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        super(TestCache, self).setUp()
+
+    def test_cache_allowed_resource(self):
+        self.session.get('http://solitude/generic/product/1/')
+        self.session.get('http://solitude/generic/product/1/')
+        eq_(self.send.call_count, 1)
+
+    def test_cache_across_requests(self):
+        context.start()
+        self.session.get('http://solitude/generic/product/1/')
+        context.end()
+        context.start()
+        self.addCleanup(context.end)
+        self.session.get('http://solitude/generic/product/1/')
+        eq_(self.send.call_count, 1)
+
+    def test_cache_by_params(self):
+        self.session.get('http://solitude/generic/product/',
+                         params={'public_id': 'a'})
+        self.session.get('http://solitude/generic/product/',
+                         params={'public_id': 'b'})
+        self.session.get('http://solitude/generic/product/',
+                         params={'public_id': 'a'})
+        eq_(self.send.call_count, 2)
+
+    def test_do_not_cache_other_resources(self):
+        self.session.get('http://solitude/braintree/paymethod/1/')
+        self.session.get('http://solitude/braintree/paymethod/1/')
+        eq_(self.send.call_count, 2)
+
+    def test_do_not_cache_errors(self):
+        def not_found(request, **kw):
+            response = fake_response(request)
+            response.status_code = 404
+            return response
+
+        self.send.side_effect = not_found
+        self.session.get('http://solitude/generic/product/1/')
+        self.session.get('http://solitude/generic/product/1/')
+        eq_(self.send.call_count, 2)
+
+    def test_clear_on_write(self):
+        self.session.get('http://solitude/generic/product/1/')
+        self.session.patch('http://solitude/generic/product/1/', data='{}')
+        self.session.get('http://solitude/generic/product/1/')
+        eq_(self.send.call_count, 3)
+
+    @override_settings(SOLITUDE_CACHE_TTLS={})
+    def test_disabled(self):
+        self.session.get('http://solitude/generic/product/1/')
+        self.session.get('http://solitude/generic/product/1/')
+        eq_(self.send.call_count, 2)
+
+
+class TestResourceName(unittest.TestCase):
+
+    @override_settings(SOLITUDE_URL='http://solitude')
+    def test_name(self):
+        eq_(resource_name('http://solitude/generic/product/1/'),
+            'generic.product')
+
+    @override_settings(SOLITUDE_URL='http://solitude')
+    def test_list(self):
+        eq_(resource_name('http://solitude/generic/product/'),
+            'generic.product')
+
+    @override_settings(SOLITUDE_URL='http://host/solitude/')
+    def test_url_with_path(self):
+        eq_(resource_name('http://host/solitude/generic/product/1/'),
+            'generic.product')
+
+    @override_settings(SOLITUDE_URL='http://solitude')
+    def test_root(self):
+        eq_(resource_name('http://solitude/'), '')
+
+
+class TestSingleFlight(SessionTest):
+
+    def test_coalesce_concurrent_gets(self):
+        sending = threading.Event()
+        finish = threading.Event()
+
+        def slow_send(request, **kw):
+            sending.set()
+            finish.wait()
+            return fake_response(request)
+
+        self.send.side_effect = slow_send
+        responses = []
+
+        def get():
+            # Each thread acts like a separate request.
+            context.start()
+            try:
+                responses.append(
+                    self.session.get('http://solitude/thing/1/'))
+            finally:
+                context.end()
+
+        threads = [threading.Thread(target=get) for i in range(3)]
+        threads[0].start()
+        sending.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while self.session.in_flight.coalesced < 2:
+            time.sleep(0.001)
+        finish.set()
+        for thread in threads:
+            thread.join()
+
+        eq_(self.send.call_count, 1)
+        eq_(len(responses), 3)
+
+    def test_do_not_coalesce_gets_started_before_a_write(self):
+        sending = threading.Event()
+        finish = threading.Event()
+
+        def send(request, **kw):
+            if not sending.is_set():
+                sending.set()
+                finish.wait()
+            return fake_response(request)
+
+        self.send.side_effect = send
+
+        def get():
+            context.start()
+            try:
+                self.session.get('http://solitude/thing/1/')
+            finally:
+                context.end()
+
+        thread = threading.Thread(target=get)
+        thread.start()
+        sending.wait()
+        context.start()
+        try:
+            self.session.patch('http://solitude/thing/1/', data='{}')
+            self.session.get('http://solitude/thing/1/')
+        finally:
+            context.end()
+            finish.set()
+            thread.join()
+
+        eq_(self.send.call_count, 3)
+        eq_(self.session.in_flight.coalesced, 0)
+
+    def test_do_not_coalesce_sequential_gets(self):
+        self.session.get('http://solitude/thing/1/')
+        self.session.get('http://solitude/thing/1/')
+        eq_(self.send.call_count, 2)
+        eq_(self.session.in_flight.coalesced, 0)
+
+
+class TestBreaker(SessionTest):
+
+    def setUp(self):
+        settings = override_settings(SOLITUDE_BREAKER_MIN_CALLS=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        super(TestBreaker, self).setUp()
+
+    def server_error(self, request, **kw):
+        response = fake_response(request)
+        response.status_code = 500
+        return response
+
+    def test_open_after_server_errors(self):
+        self.send.side_effect = self.server_error
+        self.session.get('http://solitude/thing/1/')
+        self.session.get('http://solitude/thing/1/')
+        with self.assertRaises(CircuitOpen):
+            self.session.get('http://solitude/thing/1/')
+        eq_(self.send.call_count, 2)
+
+    def test_open_after_connection_errors(self):
+        self.send.side_effect = ConnectionError
+        for i in range(2):
+            with self.assertRaises(ConnectionError):
+                self.session.post('http://solitude/thing/', data='{}')
+        with self.assertRaises(CircuitOpen):
+            self.session.post('http://solitude/thing/', data='{}')
+
+    def test_client_errors_are_not_failures(self):
+        def not_found(request, **kw):
+            response = fake_response(request)
+            response.status_code = 404
+            return response
+
+        self.send.side_effect = not_found
+        for i in range(3):
+            self.session.get('http://solitude/thing/1/')
+        eq_(self.session.breaker.state, 'closed')
+
+
+class TestDeadline(SessionTest):
+
+    def setUp(self):
+        super(TestDeadline, self).setUp()
+        context.start()
+        self.addCleanup(context.end)
+
+    def timeout(self):
+        return self.send.call_args[1]['timeout']
+
+    def test_default_timeout(self):
+        with override_settings(SOLITUDE_TIMEOUT=7):
+            self.session.get('http://solitude/thing/1/')
+        eq_(self.timeout(), 7)
+
+    def test_use_remaining_time(self):
+        deadline.start(2)
+        with override_settings(SOLITUDE_TIMEOUT=7):
+            self.session.get('http://solitude/thing/1/')
+        assert 0 < self.timeout() <= 2, self.timeout()
+
+    def test_skip_calls_after_deadline(self):
+        deadline.start(-1)
+        with self.assertRaises(DeadlineExceeded):
+            self.session.get('http://solitude/thing/1/')
+        assert not self.send.called
+
+    def test_deadline_timeout_is_not_a_failure(self):
+        deadline.start(2)
+        self.send.side_effect = Timeout
+        with override_settings(SOLITUDE_BREAKER_MIN_CALLS=1):
+            session = SolitudeSession()
+            with self.assertRaises(DeadlineExceeded):
+                session.get('http://solitude/thing/1/')
+        eq_(session.breaker.stats()['failures'], 0)
+
+    def test_solitude_timeout_is_a_failure(self):
+        self.send.side_effect = Timeout
+        with self.assertRaises(Timeout):
+            self.session.get('http://solitude/thing/1/')
+        eq_(self.session.breaker.stats()['failures'], 1)
+
+
+class TestRequestKey(unittest.TestCase):
+
+    def test_no_params(self):
+        eq_(request_key('/thing/'), ('/thing/', ()))
+
+    def test_sort_params(self):
+        eq_(request_key('/thing/', {'b': 1, 'a': 2}),
+            ('/thing/', (('a', 2), ('b', 1))))
+
+    def test_list_params(self):
+        eq_(request_key('/thing/', {'a': [1, 2]}),
+            ('/thing/', (('a', (1, 2)),)))
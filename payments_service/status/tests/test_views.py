@@ -8,6 +8,12 @@ from payments_service.base.tests import TestCase
 
 class TestStatus(TestCase):
 
+    def setUp(self):
+        super(TestStatus, self).setUp()
+        self.circuit = {'state': 'closed', 'calls': 0, 'failures': 0,
+                        'retry_after': 0}
+        self.solitude.session.breaker.stats.return_value = self.circuit
+
     def data(self):
         res = self.client.get(reverse('status:index'))
         return self.json(res)
@@ -37,3 +43,8 @@ class TestStatus(TestCase):
         self.solitude.services.status.get.side_effect = exc
         res, data = self.data()
         eq_(data['solitude']['error_response'], exc.content)
+
+    def test_circuit(self):
+        self.solitude.services.status.get.return_value = {}
+        res, data = self.data()
+        eq_(data['solitude']['circuit'], self.circuit)
@@ -12,8 +12,10 @@ class Index(UnprotectedAPIView):
 
     def get(self, request):
         error = False
+        breaker = None
         try:
             api = solitude.api()
+            breaker = api.session.breaker
             api.services.status.get()
         except Exception, exc:
             log.exception('checking solitude status')
@@ -30,5 +32,7 @@ class Index(UnprotectedAPIView):
         return Response({'ok': not error,
                          'solitude': {'connected': not error,
                                       'error': str(error),
-                                      'error_response': error_response}},
+                                      'error_response': error_response,
+                                      'circuit': (breaker.stats() if breaker
+                                                  else None)}},
                         status=status)